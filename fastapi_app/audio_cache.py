@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryAudioCache:
+    """
+    进程内 LRU 缓存，同时受条目数和音频总字节数限制。
+    只在事件循环线程中访问，不加锁。
+    """
+
+    def __init__(self, max_entries, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # 键是请求的哈希，值是 WAV 字节
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        audio_content = self.entries.get(key)
+        if audio_content is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return audio_content
+
+    def put(self, key, audio_content):
+        if self.max_entries <= 0 or (self.max_bytes is not None and len(audio_content) > self.max_bytes):
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= len(old)
+        self.entries[key] = audio_content
+        self.total_bytes += len(audio_content)
+        while len(self.entries) > self.max_entries or (
+            self.max_bytes is not None and self.total_bytes > self.max_bytes
+        ):
+            _, evicted = self.entries.popitem(last=False)  # last=False 移除最久未使用的
+            self.total_bytes -= len(evicted)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class DiskAudioCache:
+    """
+    磁盘缓存，可由同一目录下的多个进程（多个 uvicorn worker、重启前后的进程）共享。
+
+    - 音频按内容的 sha256 寻址，保存在 `objects/<前2位>/<前2~4位>/<sha256>.wav` 分片目录中，内容相同的请求只存一份；
+    - 索引是 `index.sqlite3`（WAL 模式，通过 mmap 读取），记录请求哈希 -> 音频哈希，以及每个音频的大小和最近访问时间；
+    - 写入先落到同目录的临时文件再 `os.replace`，读取方不会看到写了一半的文件；
+    - 音频总字节数超过 `max_bytes` 时按最近访问时间淘汰最旧的音频及引用它的请求。
+
+    写入和淘汰都在 sqlite 的写事务（`BEGIN IMMEDIATE`）中完成，跨进程串行执行。方法是阻塞的，
+    每个线程使用自己的数据库连接，可以在 `asyncio.to_thread` 中调用。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS blobs (
+        digest TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        last_access REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs (last_access);
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        digest TEXT NOT NULL REFERENCES blobs (digest)
+    );
+    CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+    """
+
+    def __init__(self, root, max_bytes, mmap_bytes=64 * 1024 * 1024):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.mmap_bytes = mmap_bytes
+        self.index_path = os.path.join(self.root, "index.sqlite3")
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        self.local = threading.local()
+        self.stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")  # 读写互不阻塞，多进程并发读
+        conn.executescript(self.SCHEMA)
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # isolation_level=None：事务由 BEGIN/COMMIT 显式控制
+            conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_bytes)}")
+            self.local.conn = conn
+        return conn
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest[2:4], f"{digest}.wav")
+
+    def count(self, key):
+        with self.stats_lock:
+            setattr(self, key, getattr(self, key) + 1)
+
+    def get(self, key):
+        conn = self.connection()
+        row = conn.execute("SELECT digest FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.count("misses")
+            return None
+        digest = row[0]
+        try:
+            with open(self.blob_path(digest), "rb") as f:
+                audio_content = f.read()
+        except FileNotFoundError:
+            # 索引提交前进程退出等情况下留下的失效条目
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.count("misses")
+            return None
+        conn.execute("UPDATE blobs SET last_access = ? WHERE digest = ?", (time.time(), digest))
+        self.count("hits")
+        return audio_content
+
+    def put(self, key, audio_content):
+        size = len(audio_content)
+        if size > self.max_bytes:
+            return
+        digest = hashlib.sha256(audio_content).hexdigest()
+        path = self.blob_path(digest)
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 文件在写事务内写入/删除，其他进程的淘汰不会删掉刚写入的同一音频
+            if not os.path.exists(path):
+                self.write_atomic(path, audio_content)
+            conn.execute(
+                "INSERT INTO blobs (digest, size, last_access) VALUES (?, ?, ?) "
+                "ON CONFLICT (digest) DO UPDATE SET last_access = excluded.last_access",
+                (digest, size, time.time()),
+            )
+            conn.execute("INSERT OR REPLACE INTO entries (key, digest) VALUES (?, ?)", (key, digest))
+            self.evict(conn, keep=digest)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def evict(self, conn, keep):
+        total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        oldest = conn.execute(
+            "SELECT digest, size FROM blobs WHERE digest != ? ORDER BY last_access", (keep,)
+        ).fetchall()
+        for digest, size in oldest:
+            if total_bytes <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE digest = ?", (digest,))
+            conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            try:
+                os.remove(self.blob_path(digest))
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+            self.count("evictions")
+
+    @staticmethod
+    def write_atomic(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def stats(self):
+        entries, blobs, total_bytes = self.connection().execute(
+            "SELECT (SELECT COUNT(*) FROM entries), COUNT(*), COALESCE(SUM(size), 0) FROM blobs"
+        ).fetchone()
+        return {
+            "dir": self.root,
+            "entries": entries,
+            "blobs": blobs,
+            "bytes": total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class AudioCache:
+    """
+    两级音频缓存：先查进程内的 MemoryAudioCache，未命中再查（可选的）DiskAudioCache，磁盘命中的音频提升到内存。
+    磁盘读写在线程池中执行，不阻塞事件循环；磁盘出错时只打印警告，请求按未命中/不缓存处理。
+    """
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    async def get(self, key):
+        audio_content = self.memory.get(key)
+        if audio_content is not None or self.disk is None:
+            return audio_content
+        try:
+            audio_content = await asyncio.to_thread(self.disk.get, key)
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️ 读取磁盘缓存失败: {key}, {e}")
+            return None
+        if audio_content is not None:
+            self.memory.put(key, audio_content)
+        return audio_content
+
+    async def put(self, key, audio_content):
+        self.memory.put(key, audio_content)
+        if self.disk is None:
+            return
+        try:
+            await asyncio.to_thread(self.disk.put, key, audio_content)
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️ 写入磁盘缓存失败: {key}, {e}")
+
+    def stats(self):
+        stats = {"memory": self.memory.stats(), "disk": None}
+        if self.disk is not None:
+            try:
+                stats["disk"] = self.disk.stats()
+            except sqlite3.Error as e:
+                stats["disk"] = {"error": str(e)}
+        return stats
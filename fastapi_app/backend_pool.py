@@ -0,0 +1,242 @@
+import asyncio
+import hashlib
+import queue
+import time
+from abc import ABC, abstractmethod
+
+import httpx
+from fastapi import HTTPException
+from gradio_client import Client
+
+from tts_worker_pool import BlockingCallPool, build_infer_kwargs
+
+
+class NoBackendAvailable(Exception):
+    """没有健康（未被摘除）的推理后端可用。"""
+
+
+class Backend(ABC):
+    """
+    一个推理后端及其健康状态。pool 是后端的工作池（TTSWorkerPool 或 BlockingCallPool），
+    其 stats.outstanding（排队中 + 执行中的任务数）用于最少未完成请求的负载均衡。
+    支持流式输出的后端（supports_stream=True）另外实现 submit_stream(speech_request, prompt_path)。
+    """
+
+    kind = None
+    supports_stream = False
+
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.healthy = False
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.failures = 0
+        self.ejections = 0
+
+    @property
+    def available(self):
+        return self.healthy and time.monotonic() >= self.ejected_until
+
+    @property
+    def outstanding(self):
+        return self.pool.stats.outstanding
+
+    @abstractmethod
+    async def check(self):
+        """主动健康检查，返回后端是否可用。"""
+
+    @abstractmethod
+    def submit(self, speech_request, prompt_path):
+        """提交非流式合成，返回结果为 WAV 字节的 asyncio.Future；队列已满时抛出 queue.Full。"""
+
+    def stop(self):
+        self.pool.stop()
+
+    def info(self):
+        return {
+            "name": self.name,
+            "type": self.kind,
+            "healthy": self.healthy,
+            "ejected_for": max(0.0, round(self.ejected_until - time.monotonic(), 1)),
+            "queue_depth": self.pool.queue_depth,
+            "max_queue_size": self.pool.max_queue_size,
+            # 开始推理的请求数、因队列满被拒绝（429）的请求数、排队等待与推理耗时（秒）
+            "queue_stats": self.pool.stats.snapshot(),
+            "failures": self.failures,
+            "ejections": self.ejections,
+        }
+
+
+class LocalBackend(Backend):
+    """进程内的 TTSWorkerPool，唯一支持流式输出的后端。"""
+
+    kind = "local"
+    supports_stream = True
+
+    def __init__(self, worker_pool):
+        super().__init__("local", worker_pool)
+
+    async def check(self):
+        return self.pool.ready
+
+    def submit(self, speech_request, prompt_path):
+        return self.pool.submit(build_infer_kwargs(speech_request, prompt_path))
+
+    def submit_stream(self, speech_request, prompt_path):
+        """提交流式合成，返回逐段产出 int16 PCM 字节的异步迭代器；队列已满时抛出 queue.Full。"""
+        return self.pool.submit_stream(build_infer_kwargs(speech_request, prompt_path))
+
+    def info(self):
+        info = super().info()
+        info["workers"] = self.pool.num_workers
+        info["cond_cache"] = self.pool.cond_cache_stats()
+        info["gpt_batching"] = self.pool.gpt_batching_stats()
+        return info
+
+
+class GradioBackend(Backend):
+    """
+    一个 webui（Gradio）实例。阻塞的 client.predict 在专用线程池中执行，
+    synthesize_fn(client, speech_request, prompt_path) 负责调用并返回 WAV 字节。
+    连接失败时由健康检查重新连接。
+    """
+
+    kind = "gradio"
+
+    def __init__(self, url, synthesize_fn, concurrency=1, max_queue_size=16, check_timeout=5.0):
+        super().__init__(url, BlockingCallPool(concurrency, max_queue_size, name=f"gradio-{url}"))
+        self.url = url
+        self.synthesize_fn = synthesize_fn
+        self.check_timeout = check_timeout
+        self.client = None
+        self.pool.start()
+
+    async def check(self):
+        if self.client is None:
+            try:
+                self.client = await asyncio.to_thread(Client, self.url)
+                print(f"✅ Gradio 客户端连接成功: {self.url}")
+            except Exception as e:
+                print(f"❌ Gradio 客户端连接失败 {self.url}: {e}")
+                return False
+        try:
+            async with httpx.AsyncClient(timeout=self.check_timeout) as client:
+                response = await client.get(self.url)
+            return response.status_code < 500
+        except httpx.HTTPError:
+            return False
+
+    def submit(self, speech_request, prompt_path):
+        if self.client is None:
+            raise NoBackendAvailable(f"Gradio 后端未连接: {self.url}")
+        return self.pool.submit(self.synthesize_fn, self.client, speech_request, prompt_path)
+
+    def info(self):
+        info = super().info()
+        info["connected"] = self.client is not None
+        info["concurrency"] = self.pool.num_workers
+        return info
+
+
+class BackendBalancer:
+    """
+    多个推理后端之间的负载均衡：
+    - 按最少未完成请求（排队中 + 执行中）选择后端；
+    - 音色亲和：同一参考音频按最高随机权重哈希（rendezvous hashing）固定优先发往同一后端，使其参考音色的
+      条件特征缓存保持命中；该后端的未完成请求数比最空闲的后端多出 affinity_slack 以上时才改发其他后端；
+    - 主动健康检查（每 check_interval 秒）决定后端是否可用；连续 max_failures 次合成失败的后端被摘除
+      eject_seconds 秒，到期后健康检查通过即恢复；
+    - 某个后端的队列已满时依次尝试下一个，全部已满时抛出 queue.Full。
+    """
+
+    def __init__(self, backends, max_failures=3, eject_seconds=30.0, affinity_slack=2, check_interval=10.0):
+        self.backends = backends
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.affinity_slack = affinity_slack
+        self.check_interval = check_interval
+
+    @staticmethod
+    def affinity_score(voice_key, backend):
+        return int.from_bytes(hashlib.sha256(f"{voice_key}:{backend.name}".encode()).digest()[:8], "big")
+
+    @property
+    def available(self):
+        return any(backend.available for backend in self.backends)
+
+    @staticmethod
+    def streams(backend):
+        return backend.supports_stream and hasattr(backend, "submit_stream")
+
+    @property
+    def can_stream(self):
+        return any(backend.available and self.streams(backend) for backend in self.backends)
+
+    def candidates(self, voice_key, stream=False, exclude=()):
+        """按优先顺序排列的可用后端，不含 exclude 中的后端。"""
+        backends = [b for b in self.backends
+                    if b.available and b not in exclude and (not stream or self.streams(b))]
+        if not backends:
+            raise NoBackendAvailable("没有可用的推理后端")
+        # 未完成请求数相同时按亲和度排序，亲和度最高的是该音色的首选后端
+        ordered = sorted(backends, key=lambda b: (b.outstanding, -self.affinity_score(voice_key, b)))
+        preferred = max(backends, key=lambda b: self.affinity_score(voice_key, b))
+        if preferred.outstanding <= ordered[0].outstanding + self.affinity_slack:
+            ordered.remove(preferred)
+            ordered.insert(0, preferred)
+        return ordered
+
+    def submit(self, voice_key, submit, stream=False, exclude=()):
+        """
+        把 submit(backend) 交给优先的后端，返回 (backend, submit 的返回值)。
+        队列已满的后端跳过，全部已满时抛出 queue.Full；exclude 中的后端（如本请求已失败过的）不参与。
+        """
+        error = None
+        for backend in self.candidates(voice_key, stream, exclude):
+            try:
+                return backend, submit(backend)
+            except queue.Full as e:
+                error = e
+            except NoBackendAvailable as e:
+                error = error or e
+        raise error
+
+    def retry_after(self):
+        """所有可用后端中最短的预计等待时间（秒），用于 429 的 Retry-After。"""
+        estimates = [b.pool.stats.retry_after(b.pool.queue_depth) for b in self.backends if b.available]
+        return min(estimates) if estimates else 5
+
+    def record(self, backend, error=None):
+        """记录一次合成的结果。客户端错误（4xx）不算后端故障。"""
+        if error is None or (isinstance(error, HTTPException) and error.status_code < 500):
+            backend.consecutive_failures = 0
+            return
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= self.max_failures:
+            backend.consecutive_failures = 0
+            backend.ejected_until = time.monotonic() + self.eject_seconds
+            backend.ejections += 1
+            print(f"🚫 推理后端 {backend.name} 连续失败 {self.max_failures} 次，摘除 {self.eject_seconds} 秒")
+
+    async def check_all(self):
+        results = await asyncio.gather(*(backend.check() for backend in self.backends), return_exceptions=True)
+        for backend, healthy in zip(self.backends, results):
+            healthy = healthy is True
+            if healthy != backend.healthy:
+                print(f"{'✅' if healthy else '⚠️'} 推理后端 {backend.name} {'恢复可用' if healthy else '健康检查失败'}")
+            backend.healthy = healthy
+
+    async def run_health_checks(self):
+        """后台任务：周期性地主动检查所有后端。"""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check_all()
+
+    def stop(self):
+        for backend in self.backends:
+            backend.stop()
+
+    def stats(self):
+        return [backend.info() for backend in self.backends]
@@ -1,29 +1,33 @@
 import os
 import time
 import hashlib
-from collections import OrderedDict
+import json
+import numpy as np
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Response, HTTPException
-from fastapi.responses import JSONResponse
-from gradio_client import Client, handle_file
+from fastapi.responses import JSONResponse, StreamingResponse
+from gradio_client import handle_file
 from dotenv import load_dotenv
-from tenacity import retry, stop_after_attempt, wait_fixed
-from pydantic import BaseModel
-from typing import Literal
+from pydantic import BaseModel, Field
+from typing import Literal, Optional, Tuple
 import uvicorn
 import asyncio
+import queue
 import httpx # 导入 httpx 用于发送 HTTP 请求
 from fastapi.middleware.cors import CORSMiddleware
 
 # 1. 导入新的 WebSocket 管理器
 from websocket_manager import router as websocket_router, manager as websocket_manager
+from tts_worker_pool import TTSWorkerPool, build_infer_kwargs, decode_wav_pcm, encode_wav, streaming_wav_header, SAMPLING_RATE
+from audio_cache import AudioCache, DiskAudioCache, MemoryAudioCache
+from backend_pool import BackendBalancer, GradioBackend, LocalBackend, NoBackendAvailable
 
 load_dotenv()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    global gradio_client, MODEL_PROMPT_MAP
+    global MODEL_PROMPT_MAP, worker_pool, balancer
     print("🚀 正在初始化服务...")
     
     # 动态加载模型参考语音
@@ -38,19 +42,55 @@ async def lifespan(app: FastAPI):
     print(f"🔗 API 文档 (Swagger UI): http://{host}:{port}/docs")
     print(f"🔌 WebSocket 连接地址: ws://{host}:{port}/ws\n")
 
-    for attempt in range(5):
+    backends = []
+    if "local" in TTS_BACKENDS:
+        print(f"🧠 使用本地推理后端，正在加载 IndexTTS2 模型 (工作线程数: {TTS_NUM_WORKERS})...")
+        worker_pool = TTSWorkerPool(
+            num_workers=TTS_NUM_WORKERS,
+            max_queue_size=TTS_QUEUE_SIZE,
+            model_dir=os.getenv("INDEXTTS_MODEL_DIR"),
+            use_fp16=os.getenv("INDEXTTS_FP16", "false").lower() == "true",
+            device=os.getenv("INDEXTTS_DEVICE") or None,
+            cond_cache_entries=TTS_COND_CACHE_ENTRIES,
+            cond_cache_max_bytes=TTS_COND_CACHE_MB * 1024 * 1024 if TTS_COND_CACHE_MB > 0 else None,
+            voice_store_dir=TTS_VOICE_STORE_DIR,
+            gpt_batch_size=TTS_GPT_BATCH_SIZE,
+            capture_gpt_latent=TTS_CAPTURE_GPT_LATENT,
+            use_static_kv_cache=TTS_GPT_STATIC_CACHE,
+            compile_s2mel=TTS_S2MEL_COMPILE,
+            vocoder_backend=TTS_VOCODER_BACKEND,
+            vocoder_threads=TTS_VOCODER_THREADS,
+            use_cpu_kernel=TTS_VOCODER_CPU_KERNEL,
+        )
         try:
-            gradio_client = Client(GRADIO_URL)
-            print(f"✅ Gradio 客户端连接成功！尝试次数: {attempt + 1}")
-            # 连接成功后，作为后台任务启动自动请求
+            await asyncio.to_thread(worker_pool.start)
+        except Exception as e:
+            print(f"🚨 警告：本地推理后端初始化失败，服务可能无法正常工作: {e}")
+        backends.append(LocalBackend(worker_pool))
+    if "gradio" in TTS_BACKENDS:
+        # 每个 webui 实例一个后端；阻塞的 client.predict 在各自的专用线程池中执行，不阻塞事件循环
+        for url in GRADIO_URLS:
+            backends.append(GradioBackend(url, gradio_synthesize, concurrency=TTS_GRADIO_CONCURRENCY,
+                                          max_queue_size=TTS_QUEUE_SIZE))
+    balancer = BackendBalancer(
+        backends,
+        max_failures=TTS_BACKEND_MAX_FAILS,
+        eject_seconds=TTS_BACKEND_EJECT_SECONDS,
+        affinity_slack=TTS_BACKEND_AFFINITY_SLACK,
+        check_interval=TTS_BACKEND_CHECK_INTERVAL,
+    )
+    for attempt in range(5):
+        await balancer.check_all()
+        if balancer.available:
+            print(f"✅ 可用推理后端: {[b.name for b in backends if b.available]}，尝试次数: {attempt + 1}")
+            # 后端可用后，作为后台任务启动自动请求
             asyncio.create_task(send_startup_request())
             break
-        except Exception as e:
-            print(f"❌ Gradio 客户端连接失败 (尝试 {attempt + 1}/5): {e}")
-            await asyncio.sleep(2)
-    if not gradio_client:
-        print("🚨 警告：Gradio 客户端初始化失败，服务可能无法正常工作。" )
-    
+        await asyncio.sleep(2)
+    else:
+        print("🚨 警告：没有可用的推理后端，服务可能无法正常工作；健康检查会继续重试。")
+    health_check_task = asyncio.create_task(balancer.run_health_checks())
+
     # 启动后台监控任务
     monitor_task = asyncio.create_task(monitor_inactivity())
     
@@ -59,6 +99,8 @@ async def lifespan(app: FastAPI):
     # Shutdown
     print("🔌 正在关闭服务...")
     monitor_task.cancel()
+    health_check_task.cancel()
+    balancer.stop()
     try:
         await monitor_task
     except asyncio.CancelledError:
@@ -93,15 +135,55 @@ app.add_middleware(
 # 2. 将 WebSocket 路由集成到主应用中
 app.include_router(websocket_router)
 
+# 一个或多个 webui 地址，逗号分隔；多个地址之间按负载、音色亲和与健康状态分发请求
 GRADIO_URL = os.getenv("GRADIO_URL", "http://127.0.0.1:7860/")
+GRADIO_URLS = [url.strip() for url in GRADIO_URL.split(",") if url.strip()]
+
+# --- 推理后端配置 ---
+# gradio: 通过 gradio_client 转发给 webui（默认）
+# local: 在本进程内加载 IndexTTS2，通过有界队列分发到工作线程，直接返回内存中的音频
+# local,gradio: 两者同时作为后端
+TTS_BACKEND = os.getenv("TTS_BACKEND", "gradio").lower()
+TTS_BACKENDS = {backend.strip() for backend in TTS_BACKEND.split(",")}
+TTS_BACKEND_CHECK_INTERVAL = float(os.getenv("TTS_BACKEND_CHECK_INTERVAL", "10")) # 主动健康检查间隔（秒）
+TTS_BACKEND_MAX_FAILS = int(os.getenv("TTS_BACKEND_MAX_FAILS", "3")) # 连续合成失败多少次后摘除后端
+TTS_BACKEND_EJECT_SECONDS = float(os.getenv("TTS_BACKEND_EJECT_SECONDS", "30")) # 后端被摘除的时长（秒）
+TTS_BACKEND_AFFINITY_SLACK = int(os.getenv("TTS_BACKEND_AFFINITY_SLACK", "2")) # 音色首选后端最多可比最空闲后端多出的未完成请求数
+TTS_SYNTH_ATTEMPTS = int(os.getenv("TTS_SYNTH_ATTEMPTS", "3")) # 非流式合成最多尝试几个后端（失败后立即改发其他后端）
+TTS_NUM_WORKERS = int(os.getenv("TTS_NUM_WORKERS", "1")) # 本地 IndexTTS2 实例（工作线程）数
+TTS_QUEUE_SIZE = int(os.getenv("TTS_QUEUE_SIZE", "16")) # 等待推理的最大请求数，超出时返回 429
+TTS_GRADIO_CONCURRENCY = int(os.getenv("TTS_GRADIO_CONCURRENCY", "1")) # 同时转发给每个 Gradio 实例的最大请求数
+TTS_COND_CACHE_ENTRIES = int(os.getenv("TTS_COND_CACHE_ENTRIES", "8")) # 每个实例缓存的参考音色数
+TTS_COND_CACHE_MB = int(os.getenv("TTS_COND_CACHE_MB", "0")) # 参考音色缓存的显存/内存上限（MB），0 表示不限
+TTS_VOICE_STORE_DIR = os.getenv("TTS_VOICE_STORE_DIR") or None # indextts-enroll 生成的预注册音色目录
+TTS_GPT_BATCH_SIZE = int(os.getenv("TTS_GPT_BATCH_SIZE", "0")) # GPT 连续批处理的最大批大小，0 表示不启用
+TTS_CAPTURE_GPT_LATENT = os.getenv("TTS_CAPTURE_GPT_LATENT", "false").lower() == "true" # 生成时收集 GPT latent，省去第二次前向；mel 位置相差一位，latent 与第二次前向不同，默认关闭
+TTS_GPT_STATIC_CACHE = os.getenv("TTS_GPT_STATIC_CACHE", "false").lower() == "true" # 预分配 KV cache + torch.compile 解码
+TTS_S2MEL_COMPILE = os.getenv("TTS_S2MEL_COMPILE", "false").lower() == "true" # s2mel DiT 按长度分桶 + torch.compile
+TTS_VOCODER_BACKEND = os.getenv("TTS_VOCODER_BACKEND", "torch").lower() # BigVGAN 后端：torch 或 onnxruntime（CPU）
+TTS_VOCODER_THREADS = int(os.getenv("TTS_VOCODER_THREADS", "0")) or None # onnxruntime 声码器的线程数，0 表示默认
+TTS_VOCODER_CPU_KERNEL = os.getenv("TTS_VOCODER_CPU_KERNEL", "false").lower() == "true" # CPU 上 BigVGAN 使用融合编译的抗混叠激活
+worker_pool = None
+balancer = None
+
+# --- 音频缓存配置 ---
+MAX_CACHE_SIZE = int(os.getenv("MAX_CACHE_SIZE", "100")) # 内存缓存最大条目数
+TTS_CACHE_MEMORY_MB = int(os.getenv("TTS_CACHE_MEMORY_MB", "256")) # 内存缓存音频总大小上限（MB），0 表示不限
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR") or None # 磁盘缓存目录（多个 worker 进程可共享），留空则只用内存缓存
+TTS_CACHE_DISK_MB = int(os.getenv("TTS_CACHE_DISK_MB", "2048")) # 磁盘缓存音频总大小上限（MB）
+TTS_MODEL_VERSION = os.getenv("TTS_MODEL_VERSION") or None # 参与缓存键的模型版本，留空时本地后端使用 config.yaml 的 version
+TTS_DETERMINISTIC_SEED = os.getenv("TTS_DETERMINISTIC_SEED", "true").lower() == "true" # 未指定 seed 的请求使用由请求内容导出的种子
+# 两级 LRU 缓存：键是请求的哈希，值是音频内容的 bytes
+audio_cache = AudioCache(
+    MemoryAudioCache(MAX_CACHE_SIZE, TTS_CACHE_MEMORY_MB * 1024 * 1024 if TTS_CACHE_MEMORY_MB > 0 else None),
+    DiskAudioCache(TTS_CACHE_DIR, TTS_CACHE_DISK_MB * 1024 * 1024) if TTS_CACHE_DIR else None,
+)
 
-gradio_client = None
-
-# --- 内存缓存配置 ---
-MAX_CACHE_SIZE = int(os.getenv("MAX_CACHE_SIZE", "100")) # 最大缓存条目数
-# 使用 OrderedDict 实现 LRU 缓存
-# 键是请求的哈希，值是音频内容的bytes
-in_memory_cache = OrderedDict()
+# --- 相同请求合并（single-flight）---
+# 同一请求（缓存键相同）正在生成时，后到的请求不再重复推理，而是等待首个请求的结果
+# 键是请求的缓存键，值是首个请求生成音频字节的 asyncio.Future
+in_flight_requests = {}
+request_stats = {"cache_hits": 0, "coalesced": 0, "generated": 0}
 
 MODEL_PROMPT_MAP = {}
 def load_model_prompt_map():
@@ -150,35 +232,266 @@ class SpeechRequest(BaseModel):
     top_k: int = 30
     temperature: float = 0.8
     length_penalty: float = 0.0
-    num_beams: int = 3
+    # 连续批处理（TTS_GPT_BATCH_SIZE>0）只合并 num_beams=1 的解码，此时默认不做束搜索：
+    # 纯采样比 3 束的束采样更快、可批处理，但输出的波动略大，偶尔出现重复或读音不稳，需要时可显式指定 3
+    num_beams: int = 1 if TTS_GPT_BATCH_SIZE > 0 else 3
     repetition_penalty: float = 10.0
     max_mel_tokens: int = 1500
+    # s2mel 扩散步数、ODE 求解器与时间步分布（仅本地推理后端支持）；heun/midpoint 每步调用两次估计网络
+    diffusion_steps: int = Field(25, ge=1, le=100)
+    diffusion_solver: Literal['euler', 'midpoint', 'heun', 'multistep'] = "euler"
+    diffusion_schedule: Literal['linear', 'cosine', 'sway'] = "linear"
+    # CFG 调度：仅在 t 属于 [start, end] 区间内做无分类器引导；无条件预测每 N 次引导计算一次、其间复用
+    diffusion_cfg_interval: Optional[Tuple[float, float]] = None
+    diffusion_cfg_reuse_steps: int = Field(1, ge=1)
+    # 长分段的 s2mel 分窗：每个窗口的目标 mel 帧数（0 表示整段），相邻窗口重叠 diffusion_window_overlap 帧并交叉淡化
+    diffusion_window: int = Field(0, ge=0)
+    diffusion_window_overlap: int = Field(64, ge=0)
+    # 流式输出：每合成完一个文本分段即通过 chunked 响应发送（仅本地推理后端支持）
+    stream: bool = False
+    # 流式输出格式：wav（带流式 WAV 头）或 pcm（裸 16-bit 单声道 PCM，22050Hz）
+    response_format: Literal['wav', 'pcm'] = "wav"
+    # 随机种子：相同参数与种子的请求生成相同的音频（仅本地推理后端支持）；
+    # 留空且 TTS_DETERMINISTIC_SEED=true 时使用由缓存键导出的种子
+    seed: Optional[int] = Field(None, ge=0, le=2 ** 32 - 1)
+
+
+VOICE_HASHES = {}
+def hash_voice_file(path):
+    """参考音频内容的 sha256，按 (路径, 修改时间, 大小) 记忆，文件被替换后重新计算。"""
+    stat = os.stat(path)
+    memo_key = (path, stat.st_mtime_ns, stat.st_size)
+    if memo_key not in VOICE_HASHES:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        VOICE_HASHES[memo_key] = h.hexdigest()
+    return VOICE_HASHES[memo_key]
+
+# 只有本地后端支持的参数：Gradio 后端（webui 的 /gen_single）不接收，不参与其缓存键
+LOCAL_ONLY_PARAMS = ("diffusion_steps", "diffusion_solver", "diffusion_schedule", "diffusion_cfg_interval",
+                     "diffusion_cfg_reuse_steps", "diffusion_window", "diffusion_window_overlap", "seed")
+
+async def canonical_request_params(speech_request, full_prompt_path, backend_kind):
+    """
+    由 backend_kind（local 或 gradio）类型的后端合成时的规范化请求参数，其哈希（request_cache_key）作为缓存键。
+    只包含该类后端合成结果实际依赖的输入：
+    - 文本：本地后端使用 IndexTTS2 的 TextNormalizer 规范化后的文本（写法不同但读音相同的文本共用缓存），
+      Gradio 后端收到的是原始文本；
+    - 参考音频的内容哈希（而不是模型名或路径，替换参考音频后旧缓存自然失效）；
+    - 按 build_infer_kwargs 映射后的情感输入和生成参数（未选用的情感向量、情感参考音频和情感文本不参与）；
+      Gradio 后端不支持的 s2mel 参数和随机种子（LOCAL_ONLY_PARAMS）不参与其缓存键；
+    - 模型版本和后端类型，本地与 Gradio 后端生成的音频不共用缓存。
+    只影响传输方式的 stream / response_format 不参与。
+    """
+    params = build_infer_kwargs(speech_request, full_prompt_path)
+    local = backend_kind == "local"
+    if local and worker_pool and worker_pool.ready: # 本地后端初始化失败时不规范化，由其余后端照常服务
+        params["text"] = await asyncio.to_thread(worker_pool.normalize_text, params["text"]) or params["text"]
+    if not local:
+        for name in LOCAL_ONLY_PARAMS:
+            del params[name]
+    params["spk_audio_prompt"] = await asyncio.to_thread(hash_voice_file, params["spk_audio_prompt"])
+    if params["emo_audio_prompt"] is not None:
+        params["emo_audio_prompt"] = await asyncio.to_thread(hash_voice_file, params["emo_audio_prompt"])
+    if not params["use_emo_text"]:
+        params["emo_text"] = None
+    params["backend"] = backend_kind
+    params["model_version"] = TTS_MODEL_VERSION or (worker_pool.model_version if local and worker_pool else None)
+    return params
+
+async def backend_requests(speech_request, full_prompt_path):
+    """
+    为每种已配置的后端类型准备 (发给该类后端的 SpeechRequest, 缓存键)。
+    TTS_DETERMINISTIC_SEED=true 时，未指定 seed 的请求在本地后端使用由不含种子的缓存键导出的种子：
+    相同请求每次都得到相同的音频，缓存的结果与重新生成的一致。Gradio 后端不支持 seed，请求保持原样。
+    """
+    requests = {}
+    for kind in ("local", "gradio"):
+        if kind not in TTS_BACKENDS:
+            continue
+        params = await canonical_request_params(speech_request, full_prompt_path, kind)
+        kind_request = speech_request
+        if kind == "local" and params["seed"] is None and TTS_DETERMINISTIC_SEED:
+            params["seed"] = int(request_cache_key(params), 16) % 2 ** 32
+            kind_request = speech_request.model_copy(update={"seed": params["seed"]})
+        requests[kind] = (kind_request, request_cache_key(params))
+    return requests
+
+def request_cache_key(params):
+    canonical = json.dumps(params, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+async def run_single_flight(key, generate):
+    """
+    相同键的请求只执行一次 generate()：首个请求负责生成，并发的重复请求等待它的 Future 并共享同一份音频字节
+    （生成失败时共享同一个异常）。
+    """
+    future = in_flight_requests.get(key)
+    if future is not None:
+        request_stats["coalesced"] += 1
+        print(f"🔗 合并到正在进行的相同请求: {key}")
+        try:
+            return await asyncio.shield(future)  # 等待方被取消时不影响首个请求
+        except asyncio.CancelledError:
+            if future.cancelled():
+                raise HTTPException(status_code=503, detail="合并的相同请求已被取消，请重试。")
+            raise
+
+    future = asyncio.get_running_loop().create_future()
+    # 没有等待方时也取回异常，避免 "Future exception was never retrieved" 警告
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    in_flight_requests[key] = future
+    try:
+        audio_content = await generate()
+        future.set_result(audio_content)
+        return audio_content
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        in_flight_requests.pop(key, None)
+
+async def save_to_cache(cache_key, audio_content):
+    """缓存逻辑：把新生成的音频写入内存缓存和磁盘缓存（超出容量时按 LRU 淘汰）"""
+    await audio_cache.put(cache_key, audio_content)
+    print(f"💾 音频已加入缓存: {cache_key}, 当前内存缓存条目数: {len(audio_cache.memory)}")
+
+async def stream_audio(pcm_chunks, cache_key, response_format, backend):
+    """
+    逐段转发本地推理产出的 PCM 数据。完整生成后把整段音频写入缓存，
+    客户端中途断开时不缓存不完整的音频。
+    推理完成或出错时向负载均衡记录 backend 的结果；客户端中途断开不算后端的成功或失败。
+    """
+    if response_format == "wav":
+        yield streaming_wav_header(SAMPLING_RATE)
+    received = []
+    try:
+        async for chunk in pcm_chunks:
+            received.append(chunk)
+            yield chunk
+    except Exception as e:
+        balancer.record(backend, e)
+        raise
+    finally:
+        await pcm_chunks.aclose() # 通知工作线程停止剩余分段的推理
+    balancer.record(backend)
+    await save_to_cache(cache_key, encode_wav(np.frombuffer(b"".join(received), dtype=np.int16), SAMPLING_RATE))
+
+def queue_full_error():
+    """所有后端的推理队列都已满：快速返回 429，并按当前排队情况给出 Retry-After，让客户端稍后重试而不是等到超时。"""
+    return HTTPException(status_code=429, detail="推理队列已满，请稍后重试。",
+                         headers={"Retry-After": str(balancer.retry_after())})
+
+def submit_to_backend(voice_key, submit, stream=False, exclude=()):
+    """按负载、音色亲和与健康状态选择后端（跳过 exclude 中的后端）并提交，返回 (backend, submit 的返回值)。"""
+    try:
+        return balancer.submit(voice_key, submit, stream=stream, exclude=exclude)
+    except queue.Full:
+        raise queue_full_error()
+    except NoBackendAvailable as e:
+        raise HTTPException(status_code=503, detail=f"推理后端不可用: {e}")
 
+async def synthesize(requests, full_prompt_path, voice_key):
+    """
+    生成完整音频（本地推理或 Gradio 后端），写入所选后端类型的缓存键并返回 WAV 字节。
+    requests 见 backend_requests：选定后端后才确定发送的请求（是否带种子）和缓存键。
+    合成失败的后端记入负载均衡（连续失败会被摘除），随即改发尚未尝试过的其他后端，最多尝试 TTS_SYNTH_ATTEMPTS 个；
+    不在同一后端上等待重试，不占用其工作线程。客户端错误（4xx）不重试。
+    """
+    request_stats["generated"] += 1
+    failed = []
+    while True:
+        try:
+            backend, future = submit_to_backend(
+                voice_key, lambda b: b.submit(requests[b.kind][0], full_prompt_path), exclude=failed)
+        except HTTPException:
+            if failed:
+                raise last_error # 没有其他可用后端：返回最近一次合成的错误
+            raise
+        try:
+            audio_content = await future
+            break
+        except Exception as e:
+            balancer.record(backend, e)
+            if isinstance(e, HTTPException) and e.status_code < 500 or len(failed) + 1 >= TTS_SYNTH_ATTEMPTS:
+                raise
+            print(f"⚠️ 推理后端 {backend.name} 合成失败，改用其他后端重试: {e}")
+            failed.append(backend)
+            last_error = e
+    balancer.record(backend)
+    await save_to_cache(requests[backend.kind][1], audio_content)
+    return audio_content
+
+def gradio_synthesize(gradio_client, speech_request, full_prompt_path):
+    """调用 Gradio 后端生成音频并返回 WAV 字节。阻塞调用，在 GradioBackend 的线程池中执行。"""
+    file_data = handle_file(full_prompt_path)
+
+    # 使用与 api.md 兼容的参数调用 Gradio；失败时不在此原地重试，由 synthesize 记录失败并改用其他后端
+    result = gradio_client.predict(
+        emo_control_method=speech_request.emo_control_method,
+        prompt=file_data,
+        text=speech_request.input,
+        emo_ref_path=handle_file(full_prompt_path),  # 假设当方法为“与参考相同”时，可重用参考音频
+        emo_weight=speech_request.emo_weight,
+        vec1=speech_request.vec1,
+        vec2=speech_request.vec2,
+        vec3=speech_request.vec3,
+        vec4=speech_request.vec4,
+        vec5=speech_request.vec5,
+        vec6=speech_request.vec6,
+        vec7=speech_request.vec7,
+        vec8=speech_request.vec8,
+        emo_text=speech_request.emo_text,
+        emo_random=speech_request.emo_random,
+        max_text_tokens_per_sentence=speech_request.max_text_tokens_per_sentence,
+        param_16=speech_request.do_sample,
+        param_17=speech_request.top_p,
+        param_18=speech_request.top_k,
+        param_19=speech_request.temperature,
+        param_20=speech_request.length_penalty,
+        param_21=speech_request.num_beams,
+        param_22=speech_request.repetition_penalty,
+        param_23=speech_request.max_mel_tokens,
+        api_name="/gen_single"
+    )
+    
+    result_path = None
+    if isinstance(result, dict):
+        if 'value' in result:
+            result_path = result['value']
+        elif 'path' in result:
+            result_path = result['path']
+    elif isinstance(result, str):
+        result_path = result
+        
+    if result_path and os.path.exists(result_path):
+        with open(result_path, "rb") as audio_file:
+            audio_content = audio_file.read()
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-def call_gradio_with_retry(client, *args, **kwargs):
-    return client.predict(*args, **kwargs)
+        try:
+            os.remove(result_path)
+            print(f"🗑️ 成功删除临时音频文件: {result_path}")
+        except Exception as e:
+            print(f"⚠️ 删除临时音频文件失败 {result_path}: {e}")
+            pass # 不影响主流程
+            
+        return audio_content
+    else:
+        print(f"🚨 错误：Gradio 返回结果路径无效或文件不存在。Result: {result}")
+        raise HTTPException(status_code=500, detail="Gradio 返回结果路径无效或文件不存在。" )
 
 @app.post('/v1/audio/speech')
 async def create_speech(speech_request: SpeechRequest):
     try:
-        if not gradio_client:
-            raise HTTPException(status_code=503, detail="Gradio 后端服务未连接或初始化失败")
-        
-        # --- 内存缓存逻辑 ---
-        # 生成缓存键：使用模型名和输入文本的哈希值
-        cache_key_content = f"{speech_request.model}:{speech_request.input}"
-        cache_key = hashlib.md5(cache_key_content.encode()).hexdigest()
-
-        # 尝试从内存缓存获取
-        if cache_key in in_memory_cache:
-            # 将访问的键移动到 OrderedDict 的末尾，表示最近使用
-            in_memory_cache.move_to_end(cache_key)
-            print(f"🎯 命中内存缓存: {cache_key} (模型: {speech_request.model}, 文本长度: {len(speech_request.input)})")
-            return Response(content=in_memory_cache[cache_key], media_type="audio/wav")
-        # --- 缓存逻辑结束 ---
+        if not balancer or not balancer.available:
+            raise HTTPException(status_code=503, detail="没有可用的推理后端（尚未就绪、未连接或已被摘除）")
         
-        # 缓存未命中，继续生成新音频
+        # 参考语音（缓存键包含其内容哈希）
         prompt_file_path = MODEL_PROMPT_MAP.get(speech_request.model)
         if not prompt_file_path:
             prompt_file_path = DEFAULT_PROMPT_AUDIO_PATH
@@ -191,75 +504,52 @@ async def create_speech(speech_request: SpeechRequest):
             # 这个检查在上面已经做了一部分，这里可以更具体地提示
             raise HTTPException(status_code=500, detail=f"模型 '{speech_request.model}' 的参考语音文件 '{full_prompt_path}' 未找到。" )
         
-        file_data = handle_file(full_prompt_path)
+        # --- 缓存逻辑 ---
+        # 生成缓存键：每种后端类型一个，只覆盖该类后端实际使用的文本、参考音频内容、情感与生成参数、模型版本和种子
+        requests = await backend_requests(speech_request, full_prompt_path)
+
+        # 任一类后端生成的结果都可以返回；依次尝试内存缓存和磁盘缓存，磁盘命中的音频会提升到内存缓存
+        cached_audio = None
+        for _, cache_key in requests.values():
+            cached_audio = await audio_cache.get(cache_key)
+            if cached_audio is not None:
+                break
+        if cached_audio is not None:
+            print(f"🎯 命中缓存: {cache_key} (模型: {speech_request.model}, 文本长度: {len(speech_request.input)})")
+            request_stats["cache_hits"] += 1
+            if speech_request.stream and speech_request.response_format == "pcm":
+                # 缓存的是完整 WAV，与未命中时的流式输出保持一致：去掉 WAV 头，返回裸 PCM
+                pcm, sampling_rate = decode_wav_pcm(cached_audio)
+                return Response(content=pcm, media_type="audio/pcm", headers={"X-Sample-Rate": str(sampling_rate)})
+            return Response(content=cached_audio, media_type="audio/wav")
+        # --- 缓存逻辑结束 ---
         
+        # 缓存未命中，继续生成新音频
         print(f"📝 收到请求：要转换为语音的文本是: '{speech_request.input}'，模型是: '{speech_request.model}'")
-        print(f"🔄 内存缓存未命中，开始生成新音频...")
-
-        # 使用与 api.md 兼容的参数调用 Gradio
-        result = call_gradio_with_retry(
-            gradio_client,
-            emo_control_method=speech_request.emo_control_method,
-            prompt=file_data,
-            text=speech_request.input,
-            emo_ref_path=handle_file(full_prompt_path),  # 假设当方法为“与参考相同”时，可重用参考音频
-            emo_weight=speech_request.emo_weight,
-            vec1=speech_request.vec1,
-            vec2=speech_request.vec2,
-            vec3=speech_request.vec3,
-            vec4=speech_request.vec4,
-            vec5=speech_request.vec5,
-            vec6=speech_request.vec6,
-            vec7=speech_request.vec7,
-            vec8=speech_request.vec8,
-            emo_text=speech_request.emo_text,
-            emo_random=speech_request.emo_random,
-            max_text_tokens_per_sentence=speech_request.max_text_tokens_per_sentence,
-            param_16=speech_request.do_sample,
-            param_17=speech_request.top_p,
-            param_18=speech_request.top_k,
-            param_19=speech_request.temperature,
-            param_20=speech_request.length_penalty,
-            param_21=speech_request.num_beams,
-            param_22=speech_request.repetition_penalty,
-            param_23=speech_request.max_mel_tokens,
-            api_name="/gen_single"
+        print(f"🔄 缓存未命中，开始生成新音频...")
+
+        voice_key = await asyncio.to_thread(hash_voice_file, full_prompt_path) # 同一音色优先发往同一后端
+        if speech_request.stream and balancer.can_stream:
+            # 只有本地后端支持流式输出
+            local_request, local_cache_key = requests["local"]
+            backend, pcm_chunks = submit_to_backend(
+                voice_key, lambda b: b.submit_stream(local_request, full_prompt_path), stream=True)
+            request_stats["generated"] += 1
+            return StreamingResponse(
+                stream_audio(pcm_chunks, local_cache_key, speech_request.response_format, backend),
+                media_type="audio/wav" if speech_request.response_format == "wav" else "audio/pcm",
+                headers={"X-Sample-Rate": str(SAMPLING_RATE)},
+            )
+        if speech_request.stream:
+            print("⚠️ 没有可用的本地推理后端（Gradio 后端不支持流式输出），将在生成完成后一次性返回音频。")
+
+        # 非流式请求：相同请求并发到达时只推理一次（后端尚未选定，以各类后端的缓存键共同作为合并的键）
+        flight_key = request_cache_key({kind: cache_key for kind, (_, cache_key) in requests.items()})
+        audio_content = await run_single_flight(
+            flight_key,
+            lambda: synthesize(requests, full_prompt_path, voice_key),
         )
-        
-        result_path = None
-        if isinstance(result, dict):
-            if 'value' in result:
-                result_path = result['value']
-            elif 'path' in result:
-                result_path = result['path']
-        elif isinstance(result, str):
-            result_path = result
-            
-        if result_path and os.path.exists(result_path):
-            with open(result_path, "rb") as audio_file:
-                audio_content = audio_file.read()
-            
-            # --- 内存缓存逻辑：保存新生成的音频 ---
-            if len(in_memory_cache) >= MAX_CACHE_SIZE:
-                # 缓存达到上限，移除最旧的（LRU）
-                oldest_key, _ = in_memory_cache.popitem(last=False) # last=False 移除最旧的
-                print(f"🧹 内存缓存达到上限，移除最旧条目: {oldest_key}")
-            
-            in_memory_cache[cache_key] = audio_content
-            print(f"💾 音频已加入内存缓存: {cache_key}, 当前缓存条目数: {len(in_memory_cache)}")
-            # --- 缓存逻辑结束 ---
-
-            try:
-                os.remove(result_path)
-                print(f"🗑️ 成功删除临时音频文件: {result_path}")
-            except Exception as e:
-                print(f"⚠️ 删除临时音频文件失败 {result_path}: {e}")
-                pass # 不影响主流程
-                
-            return Response(content=audio_content, media_type="audio/wav")
-        else:
-            print(f"🚨 错误：Gradio 返回结果路径无效或文件不存在。Result: {result}")
-            raise HTTPException(status_code=500, detail="Gradio 返回结果路径无效或文件不存在。" )
+        return Response(content=audio_content, media_type="audio/wav")
     except HTTPException:
         raise # 重新抛出已处理的HTTPException
     except Exception as e:
@@ -269,15 +559,29 @@ async def create_speech(speech_request: SpeechRequest):
 @app.get('/health')
 def health_check():
     cache_info = {
-        "cache_type": "in_memory",
-        "current_entries": len(in_memory_cache),
-        "max_entries": MAX_CACHE_SIZE
+        "cache_type": "memory+disk" if audio_cache.disk else "in_memory",
+        "current_entries": len(audio_cache.memory),
+        "max_entries": MAX_CACHE_SIZE,
+        # 每级缓存的条目数、字节数、命中/未命中和淘汰次数
+        "tiers": audio_cache.stats(),
+        # 命中缓存、合并到正在进行的相同请求、实际推理的请求数，以及当前正在推理的不同请求数
+        **request_stats,
+        "in_flight": len(in_flight_requests),
     }
     
-    if gradio_client:
-        return {"status": "ok", "gradio_connected": True, "cache_info": cache_info, "message": "服务运行正常，Gradio 客户端已连接。"}
-    else:
-        return {"status": "degraded", "gradio_connected": False, "cache_info": cache_info, "message": "Gradio 客户端未连接，部分功能可能受限。"}
+    backends = balancer.backends if balancer else []
+    backend_info = {
+        "backend": TTS_BACKEND,
+        # 各后端的健康状态、摘除剩余时间、队列与未完成请求数、失败与摘除次数
+        "backends": balancer.stats() if balancer else [],
+    }
+    gradio_connected = any(b.kind == "gradio" and b.client is not None for b in backends)
+    available = [b.name for b in backends if b.available]
+    if available:
+        return {"status": "ok", "gradio_connected": gradio_connected, "backend_info": backend_info, "cache_info": cache_info,
+                "message": f"服务运行正常，可用推理后端: {', '.join(available)}。"}
+    return {"status": "degraded", "gradio_connected": gradio_connected, "backend_info": backend_info, "cache_info": cache_info,
+            "message": "没有可用的推理后端，部分功能可能受限。"}
 
 # --- 新增：服务活动监控 ---
 INACTIVITY_TIMEOUT = 1800  # 30分钟的秒数
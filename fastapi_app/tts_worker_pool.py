@@ -0,0 +1,453 @@
+import asyncio
+import io
+import math
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import wave
+
+import numpy as np
+
+# fastapi_app 通常在自身目录下启动，这里把仓库根目录加入 sys.path 以便导入 indextts
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+
+# IndexTTS2 输出音频的采样率
+SAMPLING_RATE = 22050
+
+# SpeechRequest.emo_control_method 与 webui 中情感控制模式下标的对应关系
+EMO_CONTROL_METHODS = {
+    "Same as the voice reference": 0,
+    "Use emotion reference audio": 1,
+    "Use emotion vector": 2,
+    "Use text description to control emotion": 3,
+}
+
+
+def normalize_emo_vec(emo_vec):
+    """与 webui.normalize_emo_vec 保持一致，保证两种后端生成的结果相同。"""
+    k_vec = [0.75, 0.70, 0.80, 0.80, 0.75, 0.75, 0.55, 0.45]
+    tmp = np.array(k_vec) * np.array(emo_vec)
+    if np.sum(tmp) > 0.8:
+        tmp = tmp * 0.8 / np.sum(tmp)
+    return tmp.tolist()
+
+
+def build_infer_kwargs(speech_request, prompt_path):
+    """
+    将 SpeechRequest 转换为 IndexTTS2.infer 的参数，映射规则与 webui.gen_single 相同。
+    """
+    emo_control_method = EMO_CONTROL_METHODS[speech_request.emo_control_method]
+    emo_ref_path = prompt_path  # 与 Gradio 后端一致：情感参考音频复用音色参考音频
+    emo_weight = speech_request.emo_weight
+    if emo_control_method == 0:  # emotion from speaker
+        emo_ref_path = None
+    if emo_control_method == 1:  # emotion from reference audio
+        emo_weight = emo_weight * 0.8
+    if emo_control_method == 2:  # emotion from custom vectors
+        vec = normalize_emo_vec([
+            speech_request.vec1, speech_request.vec2, speech_request.vec3, speech_request.vec4,
+            speech_request.vec5, speech_request.vec6, speech_request.vec7, speech_request.vec8,
+        ])
+    else:
+        vec = None
+    emo_text = speech_request.emo_text or None
+
+    return {
+        "spk_audio_prompt": prompt_path,
+        "text": speech_request.input,
+        "emo_audio_prompt": emo_ref_path,
+        "emo_alpha": emo_weight,
+        "emo_vector": vec,
+        "use_emo_text": emo_control_method == 3,
+        "emo_text": emo_text,
+        "use_random": speech_request.emo_random,
+        "max_text_tokens_per_segment": int(speech_request.max_text_tokens_per_sentence),
+        "do_sample": bool(speech_request.do_sample),
+        "top_p": float(speech_request.top_p),
+        "top_k": int(speech_request.top_k) if int(speech_request.top_k) > 0 else None,
+        "temperature": float(speech_request.temperature),
+        "length_penalty": float(speech_request.length_penalty),
+        "num_beams": int(speech_request.num_beams),
+        "repetition_penalty": float(speech_request.repetition_penalty),
+        "max_mel_tokens": int(speech_request.max_mel_tokens),
+        "diffusion_steps": int(speech_request.diffusion_steps),
+        "diffusion_solver": speech_request.diffusion_solver,
+        "diffusion_schedule": speech_request.diffusion_schedule,
+        "diffusion_cfg_interval": speech_request.diffusion_cfg_interval,
+        "diffusion_cfg_reuse_steps": int(speech_request.diffusion_cfg_reuse_steps),
+        "diffusion_window": int(speech_request.diffusion_window),
+        "diffusion_window_overlap": int(speech_request.diffusion_window_overlap),
+        "seed": speech_request.seed,
+    }
+
+
+def encode_wav(wav_data, sampling_rate):
+    """将 IndexTTS2.infer 返回的 int16 数组 (T, C) 编码为内存中的 WAV 字节。"""
+    wav_data = np.asarray(wav_data, dtype=np.int16)
+    if wav_data.ndim == 1:
+        wav_data = wav_data[:, None]
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(wav_data.shape[1])
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sampling_rate)
+        wav_file.writeframes(wav_data.tobytes())
+    return buffer.getvalue()
+
+
+def decode_wav_pcm(audio_content):
+    """从 WAV 字节中取出裸 PCM 数据，返回 (pcm 字节, 采样率)。"""
+    with wave.open(io.BytesIO(audio_content), "rb") as wav_file:
+        return wav_file.readframes(wav_file.getnframes()), wav_file.getframerate()
+
+
+def streaming_wav_header(sampling_rate, channels=1, sample_width=2):
+    """
+    生成用于流式传输的 WAV 头。总长度未知，RIFF 与 data 块大小填入 0xFFFFFFFF，
+    大多数播放器和解码器会一直读取到连接关闭。
+    """
+    byte_rate = sampling_rate * channels * sample_width
+    return b"".join([
+        b"RIFF", struct.pack("<I", 0xFFFFFFFF), b"WAVE",
+        b"fmt ", struct.pack("<IHHIIHH", 16, 1, channels, sampling_rate, byte_rate,
+                             channels * sample_width, sample_width * 8),
+        b"data", struct.pack("<I", 0xFFFFFFFF),
+    ])
+
+
+def _set_future_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_future_exception(future, exc):
+    if not future.done():
+        future.set_exception(exc)
+
+
+class QueueStats:
+    """
+    工作池的排队与处理时间统计（线程安全），用于 /health 和队列满时估算 Retry-After。
+    平均值是指数滑动平均，反映最近的负载。outstanding 是已提交、尚未完成（排队中或执行中）的任务数，
+    多个后端之间按它做最少未完成请求的负载均衡。
+    """
+
+    EWMA_WEIGHT = 0.2
+
+    def __init__(self, num_workers):
+        self.num_workers = num_workers
+        self._lock = threading.Lock()
+        self.outstanding = 0
+        self.started = 0
+        self.rejected = 0
+        self.wait_time_avg = None
+        self.wait_time_max = 0.0
+        self.service_time_avg = None
+
+    def _ewma(self, avg, value):
+        return value if avg is None else avg + self.EWMA_WEIGHT * (value - avg)
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.started += 1
+            self.wait_time_avg = self._ewma(self.wait_time_avg, seconds)
+            self.wait_time_max = max(self.wait_time_max, seconds)
+
+    def record_service(self, seconds):
+        with self._lock:
+            self.service_time_avg = self._ewma(self.service_time_avg, seconds)
+
+    def record_submitted(self):
+        with self._lock:
+            self.outstanding += 1
+
+    def record_finished(self):
+        with self._lock:
+            self.outstanding -= 1
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def retry_after(self, queue_depth, default=5, limit=300):
+        """按平均处理时间估算排在队尾的请求还要等多久（秒），尚无统计时返回 default。"""
+        if self.service_time_avg is None:
+            return default
+        return min(limit, max(1, math.ceil(self.service_time_avg * (queue_depth + 1) / self.num_workers)))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "outstanding": self.outstanding,
+                "started": self.started,
+                "rejected": self.rejected,
+                "wait_time_avg": None if self.wait_time_avg is None else round(self.wait_time_avg, 3),
+                "wait_time_max": round(self.wait_time_max, 3),
+                "service_time_avg": None if self.service_time_avg is None else round(self.service_time_avg, 3),
+            }
+
+
+class BlockingCallPool:
+    """
+    在专用线程中执行阻塞调用（如 Gradio 的 client.predict），避免阻塞事件循环。
+    与 TTSWorkerPool 相同：num_workers 个线程即最大并发数，等待的调用放在有界队列中，队列满时 submit 立即抛出 queue.Full。
+    """
+
+    def __init__(self, num_workers=1, max_queue_size=16, name="blocking-call"):
+        self.num_workers = max(1, num_workers)
+        self.name = name
+        self._queue = queue.Queue(maxsize=max(1, max_queue_size))
+        self._threads = []
+        self.stats = QueueStats(self.num_workers)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def max_queue_size(self):
+        return self._queue.maxsize
+
+    def start(self):
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+    def submit(self, fn, *args, **kwargs):
+        """提交 fn(*args, **kwargs)，返回 asyncio.Future。队列已满时抛出 queue.Full。"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            self._queue.put_nowait((fn, args, kwargs, future, loop, time.perf_counter()))
+        except queue.Full:
+            self.stats.record_rejected()
+            raise
+        self.stats.record_submitted()
+        return future
+
+    def _worker_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            fn, args, kwargs, future, loop, enqueued_at = item
+            if future.cancelled():
+                self.stats.record_finished()
+                continue
+            started_at = time.perf_counter()
+            self.stats.record_wait(started_at - enqueued_at)
+            try:
+                result = fn(*args, **kwargs)
+                loop.call_soon_threadsafe(_set_future_result, future, result)
+            except Exception as e:
+                loop.call_soon_threadsafe(_set_future_exception, future, e)
+            finally:
+                self.stats.record_service(time.perf_counter() - started_at)
+                self.stats.record_finished()
+
+
+class TTSWorkerPool:
+    """
+    进程内的 IndexTTS2 推理工作池。
+    - 每个工作线程独占一个 IndexTTS2 实例，互不共享模型状态。
+    - gpt_batch_size > 0 时只加载一个实例，由 num_workers 个线程共享，各请求的 GPT 解码
+      通过连续批处理合并执行（见 indextts.gpt.continuous_batching），s2mel 与声码器阶段由实例内的锁串行执行。
+    - 请求通过有界队列分发，队列满时 submit 立即抛出 queue.Full；排队与处理时间见 stats。
+    - 推理结果直接以内存中的 WAV 字节返回，不经过 Gradio 和临时文件。
+    """
+
+    def __init__(self, num_workers=1, max_queue_size=16, model_dir=None, cfg_path=None,
+                 use_fp16=False, device=None, use_cuda_kernel=None, use_deepspeed=False,
+                 cond_cache_entries=8, cond_cache_max_bytes=None, voice_store_dir=None, gpt_batch_size=0,
+                 capture_gpt_latent=False, use_static_kv_cache=False, compile_s2mel=False,
+                 vocoder_backend="torch", vocoder_threads=None, use_cpu_kernel=False):
+        self.num_workers = max(1, num_workers)
+        self.gpt_batch_size = max(0, gpt_batch_size)
+        self.model_dir = model_dir or os.path.join(ROOT_DIR, "checkpoints")
+        self.cfg_path = cfg_path or os.path.join(self.model_dir, "config.yaml")
+        self.model_kwargs = {
+            "use_fp16": use_fp16,
+            "device": device,
+            "use_cuda_kernel": use_cuda_kernel,
+            "use_deepspeed": use_deepspeed,
+            "cond_cache_entries": cond_cache_entries,
+            "cond_cache_max_bytes": cond_cache_max_bytes,
+            "voice_store_dir": voice_store_dir,
+            "capture_gpt_latent": capture_gpt_latent,
+            "use_static_kv_cache": use_static_kv_cache,
+            "compile_s2mel": compile_s2mel,
+            "vocoder_backend": vocoder_backend,
+            "vocoder_threads": vocoder_threads,
+            "use_cpu_kernel": use_cpu_kernel,
+        }
+        self._queue = queue.Queue(maxsize=max(1, max_queue_size))
+        self._threads = []
+        self._models = []
+        self.ready = False
+        self.stats = QueueStats(self.num_workers)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def max_queue_size(self):
+        return self._queue.maxsize
+
+    @property
+    def model_version(self):
+        """已加载模型的版本（config.yaml 中的 version），用于区分不同模型生成的缓存。"""
+        return self._models[0].model_version if self._models else None
+
+    def normalize_text(self, text):
+        """与 IndexTTS2 分词前相同的文本规范化，规范化后相同的文本合成结果相同。模型未加载时返回原文本。"""
+        if not self._models:
+            return text
+        return self._models[0].normalizer.normalize(text)
+
+    def cond_cache_stats(self):
+        """汇总各实例的参考音频条件特征缓存命中情况。"""
+        stats = {"speaker": {"entries": 0, "bytes": 0, "hits": 0, "misses": 0, "evictions": 0},
+                 "emotion": {"entries": 0, "bytes": 0, "hits": 0, "misses": 0, "evictions": 0}}
+        for tts in self._models:
+            for name, cache in (("speaker", tts.spk_cond_cache), ("emotion", tts.emo_cond_cache)):
+                for k, v in cache.stats().items():
+                    if k in stats[name]:
+                        stats[name][k] += v
+        return stats
+
+    def gpt_batching_stats(self):
+        """GPT 连续批处理的当前批大小与排队数，未启用时返回 None。"""
+        if not self._models or self._models[0].gpt_scheduler is None:
+            return None
+        scheduler = self._models[0].gpt_scheduler
+        return {
+            "max_batch_size": scheduler.max_batch_size,
+            "active": scheduler.active_count,
+            "pending": scheduler.pending_count,
+        }
+
+    def start(self):
+        """加载模型并启动工作线程。加载耗时较长，应在线程池中调用。"""
+        from indextts.infer_v2 import IndexTTS2
+
+        for i in range(self.num_workers):
+            if self.gpt_batch_size > 0 and self._models:
+                # 连续批处理模式下所有工作线程共享同一个实例
+                tts = self._models[0]
+            else:
+                print(f"🔧 正在加载第 {i + 1}/{self.num_workers} 个 IndexTTS2 实例...")
+                tts = IndexTTS2(cfg_path=self.cfg_path, model_dir=self.model_dir, **self.model_kwargs)
+                if self.gpt_batch_size > 0:
+                    tts.enable_continuous_batching(self.gpt_batch_size)
+                self._models.append(tts)
+            thread = threading.Thread(target=self._worker_loop, args=(tts,), name=f"tts-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.ready = True
+        print(f"✅ 本地推理工作池已就绪，工作线程数: {self.num_workers}，队列容量: {self.max_queue_size}")
+
+    def stop(self):
+        self.ready = False
+        for tts in self._models:
+            if tts.gpt_scheduler is not None:
+                tts.gpt_scheduler.stop()
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                # 队列已满时工作线程是守护线程，随进程退出即可
+                break
+
+    def submit(self, infer_kwargs):
+        """
+        提交一个推理任务，返回 asyncio.Future，其结果为 WAV 字节。
+        队列已满时抛出 queue.Full，由调用方决定如何响应。
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._put((infer_kwargs, future, loop, None, time.perf_counter()))
+        return future
+
+    def submit_stream(self, infer_kwargs):
+        """
+        提交一个流式推理任务，返回异步迭代器：每合成完一个文本分段就产出该段的 int16 PCM 字节
+        （段间静音一并产出）。队列已满时立即抛出 queue.Full。
+        客户端断开（迭代器被关闭）时会通知工作线程在下一个分段前停止。
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        cancel_event = threading.Event()
+        self._put((infer_kwargs, chunks, loop, cancel_event, time.perf_counter()))
+        return self._iter_stream(chunks, cancel_event)
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.stats.record_rejected()
+            raise
+        self.stats.record_submitted()
+
+    async def _iter_stream(self, chunks, cancel_event):
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            cancel_event.set()
+
+    def _worker_loop(self, tts):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            infer_kwargs, sink, loop, cancel_event, enqueued_at = item
+            if cancel_event is None and sink.cancelled():
+                self.stats.record_finished()
+                continue
+            started_at = time.perf_counter()
+            self.stats.record_wait(started_at - enqueued_at)
+            if cancel_event is not None:
+                self._run_stream(tts, infer_kwargs, sink, loop, cancel_event)
+            else:
+                try:
+                    sampling_rate, wav_data = tts.infer(output_path=None, **infer_kwargs)
+                    audio_content = encode_wav(wav_data, sampling_rate)
+                    loop.call_soon_threadsafe(_set_future_result, sink, audio_content)
+                except Exception as e:
+                    loop.call_soon_threadsafe(_set_future_exception, sink, e)
+            self.stats.record_service(time.perf_counter() - started_at)
+            self.stats.record_finished()
+
+    def _run_stream(self, tts, infer_kwargs, chunks, loop, cancel_event):
+        generator = tts.infer_stream(**infer_kwargs)
+        try:
+            for chunk in generator:
+                if cancel_event.is_set():
+                    print("⚠️ 客户端已断开，停止流式推理。")
+                    break
+                pcm = chunk["wav"].numpy().T.tobytes()
+                loop.call_soon_threadsafe(chunks.put_nowait, pcm)
+            loop.call_soon_threadsafe(chunks.put_nowait, None)
+        except Exception as e:
+            loop.call_soon_threadsafe(chunks.put_nowait, e)
+        finally:
+            generator.close()
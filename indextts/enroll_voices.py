@@ -0,0 +1,71 @@
+import os
+import sys
+import warnings
+# Suppress warnings from tensorflow and other libraries
+warnings.filterwarnings("ignore", category=UserWarning)
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+SUPPORTED_EXTENSIONS = (".wav", ".m4a")
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Precompute IndexTTS2 speaker/emotion conditioning of reference voices")
+    parser.add_argument("voices", type=str, nargs="+", help="Reference audio files or directories of them (.wav, .m4a)")
+    parser.add_argument("-o", "--output_dir", type=str, default="checkpoints/voice_store", help="Path to the voice store directory. Default is 'checkpoints/voice_store'")
+    parser.add_argument("-c", "--config", type=str, default="checkpoints/config.yaml", help="Path to the config file. Default is 'checkpoints/config.yaml'")
+    parser.add_argument("--model_dir", type=str, default="checkpoints", help="Path to the model directory. Default is 'checkpoints'")
+    parser.add_argument("-f", "--force", action="store_true", default=False, help="Re-enroll voices that are already in the store")
+    parser.add_argument("-d", "--device", type=str, default=None, help="Device to run the model on (cpu, cuda, mps, xpu)." )
+    args = parser.parse_args()
+    if not os.path.exists(args.config):
+        print(f"Config file {args.config} does not exist.")
+        parser.print_help()
+        sys.exit(1)
+
+    audio_paths = []
+    for voice in args.voices:
+        if os.path.isdir(voice):
+            for filename in sorted(os.listdir(voice)):
+                if filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                    audio_paths.append(os.path.join(voice, filename))
+        elif os.path.isfile(voice):
+            audio_paths.append(voice)
+        else:
+            print(f"Audio prompt file {voice} does not exist.")
+            sys.exit(1)
+    if not audio_paths:
+        print("ERROR: No reference audio found.")
+        sys.exit(1)
+
+    try:
+        import torch
+    except ImportError:
+        print("ERROR: PyTorch is not installed. Please install it first.")
+        sys.exit(1)
+
+    from indextts.infer_v2 import IndexTTS2
+    from indextts.utils.cond_cache import hash_audio_file
+    from indextts.utils.voice_store import VoiceStore, save_voice, VOICE_FILE_EXT
+
+    # caches are not needed: every voice is computed exactly once
+    tts = IndexTTS2(cfg_path=args.config, model_dir=args.model_dir, device=args.device, cond_cache_entries=0)
+    os.makedirs(args.output_dir, exist_ok=True)
+    enrolled = VoiceStore(args.output_dir, model_version=tts.model_version)
+
+    for audio_path in audio_paths:
+        name = os.path.splitext(os.path.basename(audio_path))[0]
+        audio_sha1 = hash_audio_file(audio_path)
+        if audio_sha1 in enrolled.voices and not args.force:
+            print(f">> skip {audio_path}: already enrolled as '{enrolled.voices[audio_sha1]['name']}'")
+            continue
+        spk_bundle = tts.get_speaker_conditioning(audio_path)
+        emo_bundle = tts.get_emotion_conditioning(audio_path)
+        output_path = os.path.join(args.output_dir, name + VOICE_FILE_EXT)
+        save_voice(output_path, spk_bundle, emo_bundle, audio_sha1,
+                   model_version=tts.model_version, source=os.path.basename(audio_path))
+        print(f">> enrolled {audio_path} -> {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+import torch
+import torch.nn.functional as F
+
+
+def sample_next_tokens(logits, sequences, seen):
+    """
+    Per-sequence logits processing, following the order of `generate` with sampling
+    (repetition penalty -> temperature -> top-k -> top-p).
+    Args:
+        logits: (b, vocab) next token logits
+        sequences: b objects with the sampling attributes of `_Sequence`
+        seen: (b, vocab) bool, tokens penalized by the repetition penalty
+    Returns:
+        (b,) next tokens
+    """
+    logits = logits.float()
+    device = logits.device
+    penalty = torch.tensor([s.repetition_penalty for s in sequences], device=device).unsqueeze(1)
+    penalized = torch.where(logits < 0, logits * penalty, logits / penalty)
+    logits = torch.where(seen, penalized, logits)
+    greedy = logits.argmax(dim=-1)
+    do_sample = torch.tensor([s.do_sample for s in sequences], device=device)
+    if not do_sample.any():
+        return greedy
+
+    temperature = torch.tensor([s.temperature for s in sequences], device=device).unsqueeze(1)
+    logits = logits / temperature
+
+    vocab_size = logits.shape[-1]
+    top_k = torch.tensor([s.top_k if 0 < s.top_k < vocab_size else vocab_size for s in sequences], device=device)
+    sorted_logits = torch.sort(logits, dim=-1, descending=True).values
+    kth = sorted_logits.gather(1, (top_k - 1).unsqueeze(1))
+    logits = logits.masked_fill(logits < kth, -float("inf"))
+
+    top_p = torch.tensor([s.top_p for s in sequences], device=device).unsqueeze(1)
+    sorted_logits, sorted_indices = torch.sort(logits, dim=-1, descending=False)
+    cumulative_probs = sorted_logits.softmax(dim=-1).cumsum(dim=-1)
+    sorted_to_remove = cumulative_probs <= (1 - top_p)
+    sorted_to_remove[:, -1] = False  # keep at least one token
+    to_remove = sorted_to_remove.scatter(1, sorted_indices, sorted_to_remove)
+    logits = logits.masked_fill(to_remove, -float("inf"))
+
+    probs = logits.softmax(dim=-1)
+    if all(s.generator is None for s in sequences):
+        sampled = torch.multinomial(probs, num_samples=1).squeeze(1)
+    else:
+        # a sequence with its own generator draws the same tokens whatever else is in the batch
+        sampled = torch.cat([torch.multinomial(p.unsqueeze(0), num_samples=1, generator=s.generator)[0]
+                             for p, s in zip(probs, sequences)])
+    return torch.where(do_sample, sampled, greedy)
+
+
+class _Sequence:
+    """State of one request inside the running decode batch."""
+
+    def __init__(self, inputs_embeds, future, do_sample=True, top_p=0.8, top_k=30, temperature=0.8,
+                 repetition_penalty=10.0, max_generate_length=1500, return_latent=False, generator=None):
+        self.inputs_embeds = inputs_embeds
+        self.future = future
+        self.do_sample = do_sample
+        self.top_p = 1.0 if top_p is None else float(top_p)
+        self.top_k = 0 if top_k is None else int(top_k)
+        self.temperature = 1.0 if temperature is None else float(temperature)
+        self.repetition_penalty = 1.0 if repetition_penalty is None else float(repetition_penalty)
+        self.max_generate_length = max_generate_length
+        self.return_latent = return_latent
+        self.generator = generator  # `torch.Generator` for sampling, the global RNG if None
+        self.tokens = []
+        self.latents = []  # (dim,) hidden state that predicted each token, if return_latent
+
+
+class ContinuousBatchingScheduler:
+    """
+    Cross-request continuous batching for `UnifiedVoice` mel token generation.
+
+    Every request keeps its own [conditioning][text] prefix (the `cached_mel_emb` of
+    `GPT2InferenceModel`) and sampling parameters. A background thread runs a single decode loop:
+    new requests are prefilled and merged into the running batch at token boundaries (their KV cache
+    is left-padded to the batch length), and sequences are retired as soon as they emit
+    `stop_mel_token` or reach `max_generate_length`.
+
+    The embeddings, mel positions and logits processing mirror `inference_speech` with
+    `num_beams=1` (repetition penalty -> temperature -> top-k -> top-p); beam search is not supported.
+    """
+
+    def __init__(self, gpt, max_batch_size=8):
+        self.gpt = gpt
+        self.max_batch_size = max(1, max_batch_size)
+        self.start_mel_token = gpt.start_mel_token
+        self.stop_mel_token = gpt.stop_mel_token
+
+        self._pending = queue.Queue()
+        self._ahead = []  # request taken from the queue while idle, admitted first
+        self._thread = None
+        self._running = False
+
+        # running batch
+        self._sequences = []
+        self._past = None  # tuple of (k, v) per layer, [B, H, L, D]
+        self._attention_mask = None  # [B, L]
+        self._last_tokens = None  # [B]
+        self._positions = None  # [B], mel position of the token fed next
+        self._seen = None  # [B, V], tokens penalized by the repetition penalty
+
+    @property
+    def active_count(self):
+        return len(self._sequences)
+
+    @property
+    def pending_count(self):
+        return self._pending.qsize()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, name="gpt-continuous-batching", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._pending.put(None)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, inputs_embeds, **sampling_kwargs):
+        """
+        Queue one sequence for generation.
+        Args:
+            inputs_embeds: (1, s, dim) prefix built by `UnifiedVoice.prepare_inference_inputs()`
+            sampling_kwargs: do_sample, top_p, top_k, temperature, repetition_penalty, max_generate_length,
+                return_latent, generator
+        Returns:
+            Future resolving to the generated codes (1, n), ending with `stop_mel_token` unless
+            `max_generate_length` was reached, like the output of `inference_speech`.
+            With `return_latent`, to `(codes, latent)` where latent (1, n, dim) is the final hidden state
+            that predicted each token, as `inference_speech(return_latent=True)`.
+        """
+        assert inputs_embeds.ndim == 3 and inputs_embeds.shape[0] == 1, "submit one sequence at a time"
+        future = Future()
+        seq = _Sequence(inputs_embeds, future, **sampling_kwargs)
+        if seq.max_generate_length is None:
+            seq.max_generate_length = self.gpt.max_mel_tokens - 1  # as `inference_speech`
+        self._pending.put(seq)
+        return future
+
+    def generate(self, inputs_embeds, **sampling_kwargs):
+        """Blocking variant of `submit()`."""
+        return self.submit(inputs_embeds, **sampling_kwargs).result()
+
+    def _loop(self):
+        while self._running:
+            if not self._sequences:
+                # idle: wait for the next request
+                seq = self._pending.get()
+                if seq is None:
+                    break
+                self._ahead.append(seq)
+            try:
+                self.step()
+            except Exception as e:
+                # the running batch is lost, and a request taken from the queue must not wait forever either
+                for seq in self._sequences + self._ahead:
+                    if not seq.future.done():
+                        seq.future.set_exception(e)
+                self._ahead = []
+                self._reset()
+        for seq in self._sequences + self._ahead:
+            if not seq.future.done():
+                seq.future.cancel()
+        self._ahead = []
+        self._reset()
+
+    def _reset(self):
+        self._sequences = []
+        self._past = None
+        self._attention_mask = None
+        self._last_tokens = None
+        self._positions = None
+        self._seen = None
+
+    @torch.no_grad()
+    def step(self):
+        """Admit pending requests, decode one token for every running sequence and retire finished ones."""
+        admitted = False
+        while len(self._sequences) < self.max_batch_size:
+            if self._ahead:
+                seq = self._ahead.pop(0)
+            else:
+                try:
+                    seq = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+            if seq is None:
+                self._running = False
+                break
+            if seq.future.set_running_or_notify_cancel():
+                try:
+                    self._admit(seq)
+                except Exception as e:
+                    # a failed prefill only fails its own request, the running batch carries on
+                    seq.future.set_exception(e)
+                    continue
+                admitted = True
+        if admitted:
+            # the first token of admitted sequences comes from their prefill
+            self._retire()
+        if not self._sequences:
+            return
+
+        gpt = self.gpt
+        emb = gpt.mel_embedding(self._last_tokens.unsqueeze(1)) + \
+            gpt.mel_pos_embedding.emb(self._positions).unsqueeze(1)
+        self._attention_mask = F.pad(self._attention_mask, (0, 1), value=1)
+        out = gpt.gpt(inputs_embeds=emb, past_key_values=self._past, attention_mask=self._attention_mask,
+                      use_cache=True, return_dict=True)
+        self._past = out.past_key_values
+        latents = gpt.final_norm(out.last_hidden_state[:, -1])
+        logits = gpt.mel_head(latents)
+        for seq, latent in zip(self._sequences, latents):
+            if seq.return_latent:
+                seq.latents.append(latent)
+        self._append(sample_next_tokens(logits, self._sequences, self._seen))
+        self._positions = self._positions + 1
+        self._retire()
+
+    def _admit(self, seq):
+        gpt = self.gpt
+        device = seq.inputs_embeds.device
+        start = torch.tensor([[self.start_mel_token]], device=device)
+        start_emb = gpt.mel_embedding(start) + gpt.mel_pos_embedding(start)
+        emb = torch.cat([seq.inputs_embeds, start_emb.to(seq.inputs_embeds.dtype)], dim=1)
+        out = gpt.gpt(inputs_embeds=emb, use_cache=True, return_dict=True)
+        latent = gpt.final_norm(out.last_hidden_state[:, -1])
+        logits = gpt.mel_head(latent)
+        if seq.return_latent:
+            seq.latents.append(latent[0])
+
+        # `inference_speech` feeds dummy ids (1) for the prefix, followed by start_mel_token;
+        # the repetition penalty of `generate` applies to them as well
+        seen = torch.zeros(1, logits.shape[-1], dtype=torch.bool, device=device)
+        seen[0, 1] = True
+        seen[0, self.start_mel_token] = True
+        token = sample_next_tokens(logits, [seq], seen)
+        seq.tokens.append(token.item())
+
+        past = out.past_key_values
+        length = emb.shape[1]
+        attention_mask = torch.ones(1, length, dtype=torch.long, device=device)
+        if self._sequences:
+            # left-pad the shorter of the running batch and the new sequence to a common length
+            batch_length = self._attention_mask.shape[1]
+            if batch_length > length:
+                past = self._pad_past(past, batch_length - length)
+                attention_mask = F.pad(attention_mask, (batch_length - length, 0), value=0)
+            elif length > batch_length:
+                self._past = self._pad_past(self._past, length - batch_length)
+                self._attention_mask = F.pad(self._attention_mask, (length - batch_length, 0), value=0)
+            past = tuple(
+                (torch.cat([k0, k1], dim=0), torch.cat([v0, v1], dim=0))
+                for (k0, v0), (k1, v1) in zip(self._past, past)
+            )
+            attention_mask = torch.cat([self._attention_mask, attention_mask], dim=0)
+            seen = torch.cat([self._seen, seen], dim=0)
+            last_tokens = torch.cat([self._last_tokens, token], dim=0)
+            # the first generated token is fed at mel position 2, see `GPT2InferenceModel.forward`
+            positions = torch.cat([self._positions, torch.full_like(token, 2)], dim=0)
+        else:
+            last_tokens = token
+            positions = torch.full_like(token, 2)
+        self._sequences.append(seq)
+        self._past = past
+        self._attention_mask = attention_mask
+        self._seen = seen
+        self._last_tokens = last_tokens
+        self._positions = positions
+        self._seen[-1, token] = True
+
+    @staticmethod
+    def _pad_past(past, pad):
+        return tuple((F.pad(k, (0, 0, pad, 0)), F.pad(v, (0, 0, pad, 0))) for k, v in past)
+
+    def _append(self, tokens):
+        self._last_tokens = tokens
+        self._seen[torch.arange(tokens.shape[0], device=tokens.device), tokens] = True
+        for seq, token in zip(self._sequences, tokens.tolist()):
+            seq.tokens.append(token)
+
+    def _retire(self):
+        keep = []
+        for i, seq in enumerate(self._sequences):
+            if seq.tokens[-1] == self.stop_mel_token or len(seq.tokens) >= seq.max_generate_length:
+                codes = torch.tensor([seq.tokens], dtype=torch.long, device=self._last_tokens.device)
+                if seq.return_latent:
+                    seq.future.set_result((codes, torch.stack(seq.latents).unsqueeze(0)))
+                else:
+                    seq.future.set_result(codes)
+            else:
+                keep.append(i)
+        if len(keep) == len(self._sequences):
+            return
+        if not keep:
+            self._reset()
+            return
+        index = torch.tensor(keep, device=self._last_tokens.device)
+        self._sequences = [self._sequences[i] for i in keep]
+        self._past = tuple((k.index_select(0, index), v.index_select(0, index)) for k, v in self._past)
+        self._attention_mask = self._attention_mask.index_select(0, index)
+        self._last_tokens = self._last_tokens.index_select(0, index)
+        self._positions = self._positions.index_select(0, index)
+        self._seen = self._seen.index_select(0, index)
+        # drop the left padding that no remaining sequence needs
+        offset = int((self._attention_mask.sum(dim=0) == 0).long().cumprod(dim=0).sum().item())
+        if offset > 0:
+            self._past = tuple((k[:, :, offset:], v[:, :, offset:]) for k, v in self._past)
+            self._attention_mask = self._attention_mask[:, offset:]
@@ -57,6 +57,9 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
         self.model_parallel = False
         self.device_map = None
         self.cached_mel_emb = None
+        # final (normed) hidden state of the last position at every decoding step, see `inference_speech(return_latent=True)`
+        self.capture_latent = False
+        self.captured_latents = []
 
     def parallelize(self, device_map=None):
         self.device_map = (
@@ -182,6 +185,8 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
                 torch.cuda.set_device(self.transformer.first_device)
             hidden_states = hidden_states.to(self.lm_head.weight.device)
 
+        if self.capture_latent:
+            self.captured_latents.append(self.final_norm(hidden_states[:, -1]))
         lm_logits = self.lm_head(hidden_states)
 
         if not return_dict:
@@ -552,7 +557,8 @@ class UnifiedVoice(nn.Module):
 
 
     def forward(self, speech_conditioning_latent, text_inputs, text_lengths, mel_codes, mel_codes_lengths, emo_speech_conditioning_latent,
-                cond_mel_lengths=None, emo_cond_mel_lengths=None, emo_vec=None, use_speed=None, do_spk_cond=False):
+                cond_mel_lengths=None, emo_cond_mel_lengths=None, emo_vec=None, use_speed=None, do_spk_cond=False,
+                conds_latent=None):
         """
         Forward pass that uses both text and voice in either text conditioning mode or voice conditioning mode
 
@@ -564,17 +570,19 @@ class UnifiedVoice(nn.Module):
 
         If return_attentions is specified, only logits are returned.
         If return_latent is specified, loss & logits are not computed or returned. Only the predicted latents are returned.
+        conds_latent: precomputed by `prepare_conditioning_latents()`, replaces the speech/emotion conditioning inputs
         """
 
-        if do_spk_cond:
-            speech_conditioning_latent = self.get_conditioning(speech_conditioning_latent.transpose(1,2), cond_mel_lengths)
-        else:
-            speech_conditioning_latent = speech_conditioning_latent
+        if conds_latent is None:
+            if do_spk_cond:
+                speech_conditioning_latent = self.get_conditioning(speech_conditioning_latent.transpose(1,2), cond_mel_lengths)
+            else:
+                speech_conditioning_latent = speech_conditioning_latent
 
-        if emo_vec is None:
-            emo_vec_syn_ori = self.get_emo_conditioning(emo_speech_conditioning_latent.transpose(1,2), emo_cond_mel_lengths)
-            emo_vec_syn = self.emovec_layer(emo_vec_syn_ori)
-            emo_vec = self.emo_layer(emo_vec_syn)
+            if emo_vec is None:
+                emo_vec_syn_ori = self.get_emo_conditioning(emo_speech_conditioning_latent.transpose(1,2), emo_cond_mel_lengths)
+                emo_vec_syn = self.emovec_layer(emo_vec_syn_ori)
+                emo_vec = self.emo_layer(emo_vec_syn)
 
         text_inputs = self.set_text_padding(text_inputs, text_lengths)
         text_inputs = F.pad(text_inputs, (0, 1), value=self.stop_text_token)
@@ -582,9 +590,12 @@ class UnifiedVoice(nn.Module):
         mel_codes = self.set_mel_padding(mel_codes, mel_codes_lengths)
         mel_codes = F.pad(mel_codes, (0, 1), value=self.stop_mel_token)
 
-        duration_emb = self.speed_emb(torch.zeros_like(use_speed))
-        duration_emb_half = self.speed_emb(torch.ones_like(use_speed))
-        conds = torch.cat((speech_conditioning_latent + emo_vec.unsqueeze(1), duration_emb_half.unsqueeze(1), duration_emb.unsqueeze(1)), 1)
+        if conds_latent is None:
+            duration_emb = self.speed_emb(torch.zeros_like(use_speed))
+            duration_emb_half = self.speed_emb(torch.ones_like(use_speed))
+            conds = torch.cat((speech_conditioning_latent + emo_vec.unsqueeze(1), duration_emb_half.unsqueeze(1), duration_emb.unsqueeze(1)), 1)
+        else:
+            conds = conds_latent.expand(text_inputs.shape[0], -1, -1)
         text_inputs, text_targets = self.build_aligned_inputs_and_targets(text_inputs, self.start_text_token, self.stop_text_token)
         text_emb = self.text_embedding(text_inputs) + self.text_pos_embedding(text_inputs)
         mel_codes, mel_targets = self.build_aligned_inputs_and_targets(mel_codes, self.start_mel_token, self.stop_mel_token)
@@ -660,18 +671,15 @@ class UnifiedVoice(nn.Module):
         fake_inputs[:, -1] = self.start_mel_token
         return fake_inputs, batched_mel_emb, attention_mask
 
-    def inference_speech(self, speech_condition, text_inputs, emo_speech_condition=None, cond_lengths=None, emo_cond_lengths=None, emo_vec=None, use_speed=False, input_tokens=None, num_return_sequences=1,
-                         max_generate_length=None, typical_sampling=False, typical_mass=.9, **hf_generate_kwargs):
+    def prepare_conditioning_latents(self, speech_condition, emo_speech_condition=None, cond_lengths=None,
+                                     emo_cond_lengths=None, emo_vec=None):
         """
-        Args:
-            speech_condition: (b, d, frames) or (d, frames)
-            text_inputs: (b, L)
-            cond_mel_lengths: lengths of the conditioning mel spectrograms in shape (b,) or (1,)
-            input_tokens: additional tokens for generation in shape (b, s) or (s,)
-            max_generate_length: limit the number of generated tokens
-            hf_generate_kwargs: kwargs for `GPT2InferenceModel.generate(**hf_generate_kwargs)`
+        The text independent part of the GPT prefix. Compute it once per request and pass it to
+        `inference_speech()` / `forward()` of every segment.
+        Returns:
+            speech_conditioning_latent: (b, 32, dim) output of `get_conditioning()`
+            conds_latent: (b, 34, dim) conditioning latent with the emotion vector and the speed embeddings
         """
-
         if speech_condition.ndim == 2:
             speech_condition = speech_condition.unsqueeze(0)
         if emo_speech_condition is None:
@@ -690,11 +698,50 @@ class UnifiedVoice(nn.Module):
         else:
             print('Use the specified emotion vector')
 
-        tmp = torch.zeros(text_inputs.size(0)).to(text_inputs.device)
+        tmp = torch.zeros(speech_conditioning_latent.size(0)).to(speech_condition.device)
         duration_emb =  self.speed_emb(torch.zeros_like(tmp).long())
         duration_emb_half = self.speed_emb(torch.ones_like(tmp).long())
         conds_latent = torch.cat((speech_conditioning_latent + emo_vec.unsqueeze(1), duration_emb_half.unsqueeze(1), duration_emb.unsqueeze(1)), 1)
+        return speech_conditioning_latent, conds_latent
+
+    def prepare_inference_inputs(self, speech_condition, text_inputs, emo_speech_condition=None, cond_lengths=None,
+                                 emo_cond_lengths=None, emo_vec=None, speech_conditioning_latent=None, conds_latent=None):
+        """
+        Build the [conditioning][text] prefix that mel token generation starts from.
+        Args:
+            speech_conditioning_latent, conds_latent: precomputed by `prepare_conditioning_latents()`,
+                the speech and emotion conditions are not encoded again when given
+        Returns:
+            input_ids, inputs_embeds, attention_mask: see `prepare_gpt_inputs()`
+            speech_conditioning_latent: (b, 32, dim) output of `get_conditioning()`
+        """
+        if conds_latent is None:
+            speech_conditioning_latent, conds_latent = self.prepare_conditioning_latents(
+                speech_condition, emo_speech_condition, cond_lengths, emo_cond_lengths, emo_vec)
         input_ids, inputs_embeds, attention_mask = self.prepare_gpt_inputs(conds_latent, text_inputs)
+        return input_ids, inputs_embeds, attention_mask, speech_conditioning_latent
+
+    def inference_speech(self, speech_condition, text_inputs, emo_speech_condition=None, cond_lengths=None, emo_cond_lengths=None, emo_vec=None, use_speed=False, input_tokens=None, num_return_sequences=1,
+                         max_generate_length=None, typical_sampling=False, typical_mass=.9, return_latent=False,
+                         speech_conditioning_latent=None, conds_latent=None, **hf_generate_kwargs):
+        """
+        Args:
+            speech_condition: (b, d, frames) or (d, frames)
+            text_inputs: (b, L)
+            cond_mel_lengths: lengths of the conditioning mel spectrograms in shape (b,) or (1,)
+            input_tokens: additional tokens for generation in shape (b, s) or (s,)
+            max_generate_length: limit the number of generated tokens
+            return_latent: also return the latent of the generated codes (b, n, dim), collected while decoding,
+                in place of a second `forward()` pass over them. The hidden states are those of the decoding steps,
+                where mel positions are shifted by one compared to `forward()` (see `GPT2InferenceModel.forward`),
+                so the latent is close to but not identical with the `forward()` output.
+            speech_conditioning_latent, conds_latent: precomputed by `prepare_conditioning_latents()`
+            hf_generate_kwargs: kwargs for `GPT2InferenceModel.generate(**hf_generate_kwargs)`
+        """
+
+        input_ids, inputs_embeds, attention_mask, speech_conditioning_latent = self.prepare_inference_inputs(
+            speech_condition, text_inputs, emo_speech_condition, cond_lengths, emo_cond_lengths, emo_vec,
+            speech_conditioning_latent=speech_conditioning_latent, conds_latent=conds_latent)
         self.inference_model.store_mel_emb(inputs_embeds)
         if input_tokens is None:
             inputs = input_ids
@@ -721,18 +768,55 @@ class UnifiedVoice(nn.Module):
             min_tokens_to_keep = 2 if hf_generate_kwargs.get("num_beams", 1) > 1 else 1
             logits_processor.append(TypicalLogitsWarper(mass=typical_mass, min_tokens_to_keep=min_tokens_to_keep))
         max_length = (trunc_index + self.max_mel_tokens - 1) if max_generate_length is None else trunc_index + max_generate_length
-        output = self.inference_model.generate(inputs, 
-                                            bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
-                                            eos_token_id=self.stop_mel_token, attention_mask=attention_mask,
-                                            max_length=max_length, logits_processor=logits_processor,
-                                            num_return_sequences=num_return_sequences,
-                                            **hf_generate_kwargs)
+        if return_latent:
+            hf_generate_kwargs["return_dict_in_generate"] = True
+            if hf_generate_kwargs.get("num_beams", 1) > 1:
+                # `beam_indices` (which row each kept token was decoded from) is only tracked along with the scores
+                hf_generate_kwargs["output_scores"] = True
+            self.inference_model.capture_latent = True
+            self.inference_model.captured_latents = []
+        try:
+            output = self.inference_model.generate(inputs,
+                                                bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
+                                                eos_token_id=self.stop_mel_token, attention_mask=attention_mask,
+                                                max_length=max_length, logits_processor=logits_processor,
+                                                num_return_sequences=num_return_sequences,
+                                                **hf_generate_kwargs)
+        finally:
+            captured_latents = self.inference_model.captured_latents
+            self.inference_model.capture_latent = False
+            self.inference_model.captured_latents = []
+        if return_latent:
+            codes = output.sequences[:, trunc_index:]
+            latent = self.gather_generation_latent(captured_latents, codes.shape[1],
+                                                   getattr(output, "beam_indices", None))
+            return codes, speech_conditioning_latent, latent
         if isinstance(output, torch.Tensor):
             return output[:, trunc_index:], speech_conditioning_latent
         # GenerateOutput
         output.sequences = output.sequences[:, trunc_index:]
         return output, speech_conditioning_latent
 
+    @staticmethod
+    def gather_generation_latent(captured_latents, length, beam_indices=None):
+        """
+        Assemble the latent of the generated codes from the hidden states captured at every decoding step.
+        Args:
+            captured_latents: list of (rows, dim), one per decoding step
+            length: number of generated tokens
+            beam_indices: (b, n) the row each token of the returned sequences was decoded from, for beam search
+        Returns:
+            (b, length, dim): the latent of each generated token, the hidden state that predicted it.
+                Not the latent of the teacher-forced `forward()`: the mel positions are shifted by one after
+                the first token (see `GPT2InferenceModel.forward`).
+        """
+        latents = torch.stack(captured_latents[:length], dim=1)  # [rows, n, dim]
+        if beam_indices is None:
+            return latents
+        beam_indices = beam_indices[:, :length].clamp(min=0)  # -1 after a finished beam's last token
+        steps = torch.arange(beam_indices.shape[1], device=latents.device)
+        return latents[beam_indices.to(latents.device), steps]
+
     def get_emovec(self, emo_speech_conditioning_latent, emo_cond_lengths):
         emo_vec_syn_ori = self.get_emo_conditioning(emo_speech_conditioning_latent.transpose(1,2), emo_cond_lengths)
         emo_vec_syn = self.emovec_layer(emo_vec_syn_ori)
@@ -0,0 +1,160 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from indextts.gpt.continuous_batching import _Sequence, sample_next_tokens
+
+
+class StaticKVCache(nn.Module):
+    """Preallocated key/value cache of one attention layer, like `s2mel/modules/gpt_fast/model.py::KVCache`."""
+
+    def __init__(self, max_batch_size, max_seq_length, n_heads, head_dim, dtype=torch.float32, device=None):
+        super().__init__()
+        cache_shape = (max_batch_size, n_heads, max_seq_length, head_dim)
+        self.register_buffer('k_cache', torch.zeros(cache_shape, dtype=dtype, device=device))
+        self.register_buffer('v_cache', torch.zeros(cache_shape, dtype=dtype, device=device))
+
+    def update(self, input_pos, k_val, v_val):
+        # input_pos: [S], k_val: [B, H, S, D]
+        assert input_pos.shape[0] == k_val.shape[2]
+
+        k_out = self.k_cache
+        v_out = self.v_cache
+        k_out[:, :, input_pos] = k_val
+        v_out[:, :, input_pos] = v_val
+
+        return k_out, v_out
+
+
+class StaticCacheDecoder:
+    """
+    Mel token decoding of `UnifiedVoice` (batch size 1, no beam search) on a preallocated KV cache.
+
+    The transformer blocks of `UnifiedVoice.gpt` are run directly: the prefix is prefilled once,
+    then every token is a fixed-shape single-token step (attention over the whole cache, masked by
+    position) that can be compiled with `torch.compile` ("reduce-overhead", i.e. CUDA graphs, on CUDA).
+    Embeddings, mel positions and logits processing are those of `inference_speech` with `num_beams=1`,
+    so the greedy output is the same.
+    """
+
+    def __init__(self, gpt, max_seq_length=None, compile=False):
+        """
+        Args:
+            gpt: UnifiedVoice
+            max_seq_length: cache length, defaults to the longest [conditioning][text][mel] sequence of the model
+                and grows if a request needs more
+            compile: compile the single-token step with `torch.compile`
+        """
+        self.gpt = gpt
+        self.blocks = gpt.gpt.h
+        self.ln_f = gpt.gpt.ln_f
+        self.embed_dim = gpt.model_dim
+        self.n_heads = gpt.heads
+        self.head_dim = gpt.model_dim // gpt.heads
+        self.scale_by_layer = getattr(gpt.gpt.config, "scale_attn_by_inverse_layer_idx", False)
+        # [conditioning latents][start_text, text, stop_text][start_mel, codes]
+        self.max_seq_length = max_seq_length or (gpt.max_conditioning_inputs * gpt.cond_num + 2 +
+                                                 gpt.max_text_tokens + 2 + gpt.max_mel_tokens + 1)
+        self.caches = None
+        self.compile = compile
+        self._compiled_step = None
+
+    def _setup_caches(self, seq_length, dtype, device):
+        if self.caches is not None and self.caches[0].k_cache.shape[2] >= seq_length \
+                and self.caches[0].k_cache.dtype == dtype and self.caches[0].k_cache.device == device:
+            return
+        self.max_seq_length = max(self.max_seq_length, seq_length)
+        self.caches = nn.ModuleList(
+            StaticKVCache(1, self.max_seq_length, self.n_heads, self.head_dim, dtype=dtype, device=device)
+            for _ in self.blocks
+        )
+        self.cache_positions = torch.arange(self.max_seq_length, device=device)
+        if self.compile:
+            if self._compiled_step is None:
+                mode = "reduce-overhead" if torch.device(device).type == "cuda" else None
+                self._compiled_step = torch.compile(self._decode_step, mode=mode, fullgraph=True, dynamic=False)
+
+    def _forward(self, x, input_pos, kv_length=None):
+        """
+        Transformer blocks over x (1, s, dim) at cache positions input_pos (s,), returns the final hidden states.
+        Attention covers the first `kv_length` cache entries, the whole cache if None (fixed shapes for compiling).
+        """
+        b, s, _ = x.shape
+        positions = self.cache_positions if kv_length is None else self.cache_positions[:kv_length]
+        # causal mask over the cache: position j is visible from input_pos[i] if j <= input_pos[i]
+        attn_mask = (positions.unsqueeze(0) <= input_pos.unsqueeze(1)).view(1, 1, s, -1)
+        for i, (block, cache) in enumerate(zip(self.blocks, self.caches)):
+            h = block.ln_1(x)
+            q, k, v = block.attn.c_attn(h).split(self.embed_dim, dim=2)
+            q = q.view(b, s, self.n_heads, self.head_dim).transpose(1, 2)
+            k = k.view(b, s, self.n_heads, self.head_dim).transpose(1, 2)
+            v = v.view(b, s, self.n_heads, self.head_dim).transpose(1, 2)
+            k, v = cache.update(input_pos, k, v)
+            if kv_length is not None:
+                k, v = k[:, :, :kv_length], v[:, :, :kv_length]
+            scale = self.head_dim ** -0.5
+            if self.scale_by_layer:
+                scale /= float(i + 1)
+            y = F.scaled_dot_product_attention(q, k.to(q.dtype), v.to(q.dtype), attn_mask=attn_mask, scale=scale)
+            y = y.transpose(1, 2).reshape(b, s, self.embed_dim)
+            x = x + block.attn.c_proj(y)
+            x = x + block.mlp(block.ln_2(x))
+        return self.ln_f(x)
+
+    def _decode_step(self, token, input_pos, mel_pos, kv_length=None):
+        gpt = self.gpt
+        emb = gpt.mel_embedding(token) + gpt.mel_pos_embedding.emb(mel_pos).unsqueeze(0)
+        latent = gpt.final_norm(self._forward(emb, input_pos, kv_length)[:, -1])
+        return latent, gpt.mel_head(latent)
+
+    @torch.no_grad()
+    def generate(self, inputs_embeds, **sampling_kwargs):
+        """
+        Args:
+            inputs_embeds: (1, s, dim) prefix built by `UnifiedVoice.prepare_inference_inputs()`
+            sampling_kwargs: do_sample, top_p, top_k, temperature, repetition_penalty, max_generate_length,
+                return_latent, generator, see `ContinuousBatchingScheduler.submit()`
+        Returns:
+            codes (1, n), or `(codes, latent)` with `return_latent`
+        """
+        assert inputs_embeds.ndim == 3 and inputs_embeds.shape[0] == 1, "one sequence at a time"
+        gpt = self.gpt
+        seq = _Sequence(inputs_embeds, None, **sampling_kwargs)
+        if seq.max_generate_length is None:
+            seq.max_generate_length = gpt.max_mel_tokens - 1  # as `inference_speech`
+        device = inputs_embeds.device
+        start = torch.tensor([[gpt.start_mel_token]], device=device)
+        start_emb = gpt.mel_embedding(start) + gpt.mel_pos_embedding(start)
+        emb = torch.cat([inputs_embeds, start_emb.to(inputs_embeds.dtype)], dim=1)
+        prefix_length = emb.shape[1]
+        self._setup_caches(prefix_length + seq.max_generate_length, gpt.mel_head.weight.dtype, device)
+
+        hidden_states = self._forward(emb, torch.arange(prefix_length, device=device), prefix_length)
+        latent = gpt.final_norm(hidden_states[:, -1])
+        logits = gpt.mel_head(latent)
+        # dummy ids (1) of the prefix and start_mel_token, as seen by the repetition penalty of `generate`
+        seen = torch.zeros(1, logits.shape[-1], dtype=torch.bool, device=device)
+        seen[0, 1] = True
+        seen[0, gpt.start_mel_token] = True
+        input_pos = torch.tensor([prefix_length], device=device)
+        mel_pos = torch.tensor([2], device=device)  # see `GPT2InferenceModel.forward`
+        while True:
+            if seq.return_latent:
+                seq.latents.append(latent[0].clone())
+            token = sample_next_tokens(logits, [seq], seen)
+            seq.tokens.append(token.item())
+            if seq.tokens[-1] == gpt.stop_mel_token or len(seq.tokens) >= seq.max_generate_length:
+                break
+            seen[0, token] = True
+            if self._compiled_step is not None:
+                latent, logits = self._compiled_step(token.view(1, 1), input_pos, mel_pos)
+            else:
+                # eager: attend to the filled part of the cache only
+                latent, logits = self._decode_step(token.view(1, 1), input_pos, mel_pos, input_pos.item() + 1)
+            input_pos += 1
+            mel_pos += 1
+
+        codes = torch.tensor([seq.tokens], dtype=torch.long, device=device)
+        if seq.return_latent:
+            return codes, torch.stack(seq.latents).unsqueeze(0)
+        return codes
@@ -3,8 +3,11 @@ from subprocess import CalledProcessError
 
 os.environ['HF_HUB_CACHE'] = './checkpoints/hf_cache'
 import json
+import math
 import re
+import threading
 import time
+from typing import Dict, List
 import librosa
 import torch
 import torchaudio
@@ -18,27 +21,36 @@ warnings.filterwarnings("ignore", category=UserWarning)
 from omegaconf import OmegaConf
 
 from indextts.gpt.model_v2 import UnifiedVoice
+from indextts.gpt.continuous_batching import ContinuousBatchingScheduler
+from indextts.gpt.static_cache import StaticCacheDecoder
 from indextts.utils.maskgct_utils import build_semantic_model, build_semantic_codec
 from indextts.utils.checkpoint import load_checkpoint
+from indextts.utils.cond_cache import ConditioningCache, hash_audio_file
+from indextts.utils.voice_store import VoiceStore
 from indextts.utils.front import TextNormalizer, TextTokenizer
+from indextts.utils.feature_extractors import SeamlessM4TFbankFeatures, ResamplerCache
 
 from indextts.s2mel.modules.commons import load_checkpoint2, MyModel
 from indextts.s2mel.modules.bigvgan import bigvgan
 from indextts.s2mel.modules.campplus.DTDNN import CAMPPlus
 from indextts.s2mel.modules.audio import mel_spectrogram
+from indextts.s2mel.modules.bucketed_estimator import BucketedEstimator
+from indextts.s2mel.modules.bigvgan.streaming import StreamingVocoder
+from indextts.s2mel.modules.bigvgan.onnx_vocoder import load_onnx_vocoder
 
 from transformers import AutoTokenizer
 from modelscope import AutoModelForCausalLM
 from huggingface_hub import hf_hub_download
 import safetensors
-from transformers import SeamlessM4TFeatureExtractor
 import random
 import torch.nn.functional as F
 
 class IndexTTS2:
     def __init__(
             self, cfg_path="checkpoints/config.yaml", model_dir="checkpoints", use_fp16=False, device=None,
-            use_cuda_kernel=None,use_deepspeed=False
+            use_cuda_kernel=None,use_deepspeed=False, cond_cache_entries=8, cond_cache_max_bytes=None,
+            voice_store_dir=None, capture_gpt_latent=False, use_static_kv_cache=False, compile_s2mel=False,
+            vocoder_backend="torch", vocoder_threads=None, use_cpu_kernel=False
     ):
         """
         Args:
@@ -48,6 +60,26 @@ class IndexTTS2:
             device (str): device to use (e.g., 'cuda:0', 'cpu'). If None, it will be set automatically based on the availability of CUDA or MPS.
             use_cuda_kernel (None | bool): whether to use BigVGan custom fused activation CUDA kernel, only for CUDA device.
             use_deepspeed (bool): whether to use DeepSpeed or not.
+            cond_cache_entries (int): number of reference voices whose conditioning is kept cached, 0 disables caching.
+            cond_cache_max_bytes (None | int): memory budget in bytes for the cached conditioning tensors, None for unlimited.
+            voice_store_dir (None | str): directory of voices enrolled with ``indextts/enroll_voices.py``. When set,
+                the w2v-BERT and CAMPPlus models are only loaded once a reference audio outside the store is used.
+            capture_gpt_latent (bool): take the GPT latent fed to s2mel from the hidden states collected while
+                generating the mel codes, instead of a second teacher-forced GPT forward pass over them. Off by
+                default: generation feeds the k-th mel token at mel position k+1 where the forward pass uses k,
+                so apart from the first token the latent differs from the one the s2mel model was trained on,
+                and no tolerance on that difference is guaranteed. ``tests/gpt_latent_parity_test.py`` reports it.
+            use_static_kv_cache (bool): decode mel tokens (``num_beams=1``) on a preallocated KV cache with a
+                ``torch.compile``-d single-token step instead of HF ``generate``, see ``StaticCacheDecoder``.
+            compile_s2mel (bool): pad the s2mel DiT input to a few length buckets and run a ``torch.compile``-d
+                estimator per bucket (CUDA graphs on CUDA), compiled at startup, see ``BucketedEstimator``.
+            vocoder_backend (str): "torch" runs BigVGAN eagerly on ``device``, "onnxruntime" runs it exported to ONNX
+                on CPU with ONNX Runtime (exported next to the checkpoints, again when the vocoder checkpoint
+                changes), see ``load_onnx_vocoder``.
+            vocoder_threads (None | int): intra-op threads of the ONNX Runtime vocoder, None for its default.
+            use_cpu_kernel (bool): whether to use the fused ``torch.compile``-d anti-aliased activation of BigVGAN
+                (``vocoder_backend="torch"``), only for CPU device. Needs a C++ compiler, the first synthesis
+                includes the compilation.
         """
         if device is not None:
             self.device = device
@@ -73,6 +105,8 @@ class IndexTTS2:
 
         self.cfg = OmegaConf.load(cfg_path)
         self.model_dir = model_dir
+        self.model_version = self.cfg.version if hasattr(self.cfg, "version") else None
+        self.capture_gpt_latent = capture_gpt_latent
         self.dtype = torch.float16 if self.use_fp16 else None
         self.stop_mel_token = self.cfg.gpt.stop_mel_token
 
@@ -87,6 +121,7 @@ class IndexTTS2:
         else:
             self.gpt.eval()
         print(">> GPT weights restored from:", self.gpt_path)
+        self.gpt_static_decoder = StaticCacheDecoder(self.gpt, compile=True) if use_static_kv_cache else None
 
         if use_deepspeed:
             try:
@@ -108,14 +143,6 @@ class IndexTTS2:
                 print(">> Failed to load custom CUDA kernel for BigVGAN. Falling back to torch.")
                 self.use_cuda_kernel = False
 
-        self.extract_features = SeamlessM4TFeatureExtractor.from_pretrained("facebook/w2v-bert-2.0")
-        self.semantic_model, self.semantic_mean, self.semantic_std = build_semantic_model(
-            os.path.join(self.model_dir, self.cfg.w2v_stat))
-        self.semantic_model = self.semantic_model.to(self.device)
-        self.semantic_model.eval()
-        self.semantic_mean = self.semantic_mean.to(self.device)
-        self.semantic_std = self.semantic_std.to(self.device)
-
         semantic_codec = build_semantic_codec(self.cfg.semantic_codec)
         semantic_code_ckpt = hf_hub_download("amphion/MaskGCT", filename="semantic_codec/model.safetensors")
         safetensors.torch.load_model(semantic_codec, semantic_code_ckpt)
@@ -134,26 +161,36 @@ class IndexTTS2:
             is_distributed=False,
         )
         self.s2mel = s2mel.to(self.device)
-        self.s2mel.models['cfm'].estimator.setup_caches(max_batch_size=1, max_seq_length=8192)
+        # longest [prompt mel][target mel] the DiT attends over, longer segments are windowed
+        self.s2mel_max_frames = 8192
+        self.s2mel.models['cfm'].estimator.setup_caches(max_batch_size=1, max_seq_length=self.s2mel_max_frames)
         self.s2mel.eval()
         print(">> s2mel weights restored from:", s2mel_path)
-
-        # load campplus_model
-        campplus_ckpt_path = hf_hub_download(
-            "funasr/campplus", filename="campplus_cn_common.bin"
-        )
-        campplus_model = CAMPPlus(feat_dim=80, embedding_size=192)
-        campplus_model.load_state_dict(torch.load(campplus_ckpt_path, map_location="cpu"))
-        self.campplus_model = campplus_model.to(self.device)
-        self.campplus_model.eval()
-        print(">> campplus_model weights restored from:", campplus_ckpt_path)
+        if compile_s2mel:
+            cfm = self.s2mel.models['cfm']
+            cfm.estimator = BucketedEstimator(cfm.estimator)
+            # one segment: batch of 2 with classifier-free guidance, 1 for the cond-only steps of a CFG schedule
+            timings = cfm.estimator.warmup(batch_sizes=(1, 2), dtype=next(cfm.parameters()).dtype)
+            print(">> s2mel estimator compiled for buckets", cfm.estimator.buckets,
+                  f"in {sum(timings.values()):.2f} seconds")
 
         bigvgan_name = self.cfg.vocoder.name
-        self.bigvgan = bigvgan.BigVGAN.from_pretrained(bigvgan_name, use_cuda_kernel=self.use_cuda_kernel)
-        self.bigvgan = self.bigvgan.to(self.device)
-        self.bigvgan.remove_weight_norm()
-        self.bigvgan.eval()
-        print(">> bigvgan weights restored from:", bigvgan_name)
+        if vocoder_backend == "onnxruntime":
+            onnx_path = os.path.join(self.model_dir, bigvgan_name.replace("/", "--") + ".onnx")
+            # exported on first use and again when the checkpoint changes, see `load_onnx_vocoder`
+            self.bigvgan, exported = load_onnx_vocoder(bigvgan_name, onnx_path, num_threads=vocoder_threads)
+            if exported:
+                print(">> bigvgan exported to:", onnx_path)
+            print(">> bigvgan onnxruntime session loaded from:", onnx_path)
+        elif vocoder_backend == "torch":
+            self.bigvgan = bigvgan.BigVGAN.from_pretrained(bigvgan_name, use_cuda_kernel=self.use_cuda_kernel,
+                                                           use_cpu_kernel=use_cpu_kernel and self.device == "cpu")
+            self.bigvgan = self.bigvgan.to(self.device)
+            self.bigvgan.remove_weight_norm()
+            self.bigvgan.eval()
+            print(">> bigvgan weights restored from:", bigvgan_name)
+        else:
+            raise ValueError(f"Unknown vocoder_backend: {vocoder_backend}, expected 'torch' or 'onnxruntime'")
 
         self.bpe_path = os.path.join(self.model_dir, self.cfg.dataset["bpe_model"])
         self.normalizer = TextNormalizer()
@@ -184,27 +221,47 @@ class IndexTTS2:
         }
         self.mel_fn = lambda x: mel_spectrogram(x, **mel_fn_args)
 
-        # 缓存参考音频：
-        self.cache_spk_cond = None
-        self.cache_s2mel_style = None
-        self.cache_s2mel_prompt = None
-        self.cache_spk_audio_prompt = None
-        self.cache_emo_cond = None
-        self.cache_emo_audio_prompt = None
-        self.cache_mel = None
+        # 缓存参考音频：按音频内容哈希缓存多个音色/情感参考的条件特征（LRU）
+        self.spk_cond_cache = ConditioningCache(cond_cache_entries, cond_cache_max_bytes)
+        self.emo_cond_cache = ConditioningCache(cond_cache_entries, cond_cache_max_bytes)
+
+        # 预先注册的音色：直接读取离线计算好的条件特征，无需在服务时加载 w2v-BERT 和 CAMPPlus
+        self.voice_store = None
+        if voice_store_dir:
+            self.voice_store = VoiceStore(voice_store_dir, model_version=self.model_version, device=self.device)
+        self.extract_features = None
+        # resampling kernels of the reference audio, built once per (sampling rate, device)
+        self.resample = ResamplerCache()
+        # w2v-BERT hidden state used as semantic feature, the layers after it are not loaded
+        self.semantic_layer = 17
+        self.semantic_model = None
+        self.semantic_mean = None
+        self.semantic_std = None
+        self.campplus_model = None
+        self._frontend_lock = threading.Lock()
+        if self.voice_store is None:
+            self._load_reference_frontend()
 
         # 进度引用显示（可选）
         self.gr_progress = None
-        self.model_version = self.cfg.version if hasattr(self.cfg, "version") else None
+        self.sampling_rate = 22050
+
+        # 跨请求的 GPT 连续批处理（可选，见 enable_continuous_batching）
+        self.gpt_scheduler = None
+        self._gpt_generate_lock = threading.Lock()
+        # threads sharing this instance (see enable_continuous_batching) run the s2mel CFM and the vocoder one
+        # at a time: the DiT KV cache, compiled graphs and vocoder are module state
+        self._s2mel_lock = threading.Lock()
+        self._vocoder_lock = threading.Lock()
 
     @torch.no_grad()
     def get_emb(self, input_features, attention_mask):
+        # the semantic model is truncated after `semantic_layer`, its last hidden state is the layer used
         vq_emb = self.semantic_model(
             input_features=input_features,
             attention_mask=attention_mask,
-            output_hidden_states=True,
         )
-        feat = vq_emb.hidden_states[17]  # (B, T, C)
+        feat = vq_emb.last_hidden_state  # (B, T, C)
         feat = (feat - self.semantic_mean) / self.semantic_std
         return feat
 
@@ -288,10 +345,165 @@ class IndexTTS2:
 
         return wavs_list
 
+    def bucket_segments(self, segments, bucket_max_size=4) -> List[List[Dict]]:
+        """
+        Segment data bucketing.
+        if ``bucket_max_size=1``, return all segments in one bucket.
+        """
+        outputs: List[Dict] = []
+        for idx, sent in enumerate(segments):
+            outputs.append({"idx": idx, "sent": sent, "len": len(sent)})
+
+        if len(outputs) > bucket_max_size:
+            # split segments into buckets by segment length
+            buckets: List[List[Dict]] = []
+            factor = 1.5
+            last_bucket = None
+            last_bucket_sent_len_median = 0
+
+            for sent in sorted(outputs, key=lambda x: x["len"]):
+                current_sent_len = sent["len"]
+                if current_sent_len == 0:
+                    print(">> skip empty segment")
+                    continue
+                if last_bucket is None \
+                        or current_sent_len >= int(last_bucket_sent_len_median * factor) \
+                        or len(last_bucket) >= bucket_max_size:
+                    # new bucket
+                    buckets.append([sent])
+                    last_bucket = buckets[-1]
+                    last_bucket_sent_len_median = current_sent_len
+                else:
+                    # current bucket can hold more segments
+                    last_bucket.append(sent)  # sorted
+                    mid = len(last_bucket) // 2
+                    last_bucket_sent_len_median = last_bucket[mid]["len"]
+            last_bucket = None
+            # merge all buckets with size 1
+            out_buckets: List[List[Dict]] = []
+            only_ones: List[Dict] = []
+            for b in buckets:
+                if len(b) == 1:
+                    only_ones.append(b[0])
+                else:
+                    out_buckets.append(b)
+            if len(only_ones) > 0:
+                # merge into previous buckets if possible
+                for i in range(len(out_buckets)):
+                    b = out_buckets[i]
+                    if len(b) < bucket_max_size:
+                        b.append(only_ones.pop(0))
+                        if len(only_ones) == 0:
+                            break
+                # combined all remaining sized 1 buckets
+                if len(only_ones) > 0:
+                    out_buckets.extend(
+                        [only_ones[i:i + bucket_max_size] for i in range(0, len(only_ones), bucket_max_size)])
+            return out_buckets
+        return [outputs]
+
+    def pad_tokens_cat(self, tokens: List[torch.Tensor]) -> torch.Tensor:
+        # 使用 stop_text_token 右侧填充到最大长度，prepare_gpt_inputs 会去掉填充并改为左侧对齐
+        # [1, N] -> [N,]
+        tokens = [t.squeeze(0) for t in tokens]
+        return pad_sequence(tokens, batch_first=True, padding_value=self.cfg.gpt.stop_text_token)
+
+    def torch_empty_cache(self):
+        try:
+            if "cuda" in str(self.device):
+                torch.cuda.empty_cache()
+            elif "mps" in str(self.device):
+                torch.mps.empty_cache()
+        except Exception as e:
+            pass
+
     def _set_gr_progress(self, value, desc):
         if self.gr_progress is not None:
             self.gr_progress(value, desc=desc)
 
+    def _make_generators(self, seed):
+        """
+        Random generators of one call, ``(rng, generator)``: ``rng`` draws the ``use_random`` emotion indices,
+        ``generator`` the GPT sampling and the CFM noise. With a ``seed`` they are a `random.Random` and a
+        `torch.Generator` on the inference device owned by the call, so calls running concurrently in other
+        threads (several workers, or continuous batching) don't consume them and the same inputs and ``seed``
+        give the same audio. Without one, the global `random` module and torch RNG (``generator`` is None).
+        """
+        if seed is None:
+            return random, None
+        return random.Random(seed), torch.Generator(device=self.device).manual_seed(seed)
+
+    def enable_continuous_batching(self, max_batch_size=8):
+        """
+        Generate mel tokens of concurrent ``infer``/``infer_stream`` calls (from several threads sharing
+        this instance) in one running decode batch, see ``ContinuousBatchingScheduler``.
+        Only used for ``num_beams=1``; beam search keeps running one request at a time.
+        The s2mel CFM and the vocoder of the calls still run one at a time.
+        """
+        if self.gpt_scheduler is None:
+            self.gpt_scheduler = ContinuousBatchingScheduler(self.gpt, max_batch_size=max_batch_size)
+            self.gpt_scheduler.start()
+            print(">> GPT continuous batching enabled, max batch size:", max_batch_size)
+
+    def _generate_mel_codes(self, speech_condition, text_inputs, emo_speech_condition, cond_lengths=None,
+                            emo_cond_lengths=None, emo_vec=None, do_sample=True, top_p=0.8, top_k=30,
+                            temperature=0.8, num_return_sequences=1, num_beams=3, repetition_penalty=10.0,
+                            max_generate_length=None, return_latent=False, speech_conditioning_latent=None,
+                            conds_latent=None, generator=None, **generation_kwargs):
+        """
+        ``UnifiedVoice.inference_speech``, routed through the continuous batching scheduler or the static
+        KV cache decoder when one is enabled and the request can be served by it.
+        Sampling draws from ``generator`` (a `torch.Generator`), the global torch RNG if None.
+        Returns ``(codes, speech_conditioning_latent, latent)``, ``latent`` is None unless ``return_latent``.
+        """
+        decoder = self.gpt_scheduler or self.gpt_static_decoder
+        if decoder is not None and num_beams == 1 and num_return_sequences == 1 \
+                and text_inputs.shape[0] == 1 and not {k for k in generation_kwargs if k != "length_penalty"}:
+            _, inputs_embeds, _, speech_conditioning_latent = self.gpt.prepare_inference_inputs(
+                speech_condition, text_inputs, emo_speech_condition, cond_lengths, emo_cond_lengths, emo_vec,
+                speech_conditioning_latent=speech_conditioning_latent, conds_latent=conds_latent)
+            sampling_kwargs = dict(do_sample=do_sample, top_p=top_p, top_k=top_k, temperature=temperature,
+                                   repetition_penalty=repetition_penalty, max_generate_length=max_generate_length,
+                                   return_latent=return_latent, generator=generator)
+            if decoder is self.gpt_scheduler:
+                result = decoder.generate(inputs_embeds, **sampling_kwargs)
+            else:
+                # a single preallocated cache, one caller at a time
+                with self._gpt_generate_lock:
+                    result = decoder.generate(inputs_embeds, **sampling_kwargs)
+            if return_latent:
+                codes, latent = result
+                return codes, speech_conditioning_latent, latent
+            return result, speech_conditioning_latent, None
+        # inference_speech keeps the prefix in the shared GPT2InferenceModel, one caller at a time
+        with self._gpt_generate_lock:
+            result = self.gpt.inference_speech(
+                speech_condition, text_inputs, emo_speech_condition,
+                cond_lengths=cond_lengths, emo_cond_lengths=emo_cond_lengths, emo_vec=emo_vec,
+                do_sample=do_sample, top_p=top_p, top_k=top_k, temperature=temperature,
+                num_return_sequences=num_return_sequences, num_beams=num_beams,
+                repetition_penalty=repetition_penalty, max_generate_length=max_generate_length,
+                return_latent=return_latent, speech_conditioning_latent=speech_conditioning_latent,
+                conds_latent=conds_latent, generator=generator, **generation_kwargs
+            )
+        return result if return_latent else (*result, None)
+
+    def _s2mel_window(self, ref_mel, diffusion_window):
+        """
+        Target frames per s2mel CFM window: `diffusion_window` if set, else what fits in the DiT
+        (`s2mel_max_frames` including the prompt), so segments longer than the DiT are windowed too.
+        """
+        max_window = self.s2mel_max_frames - ref_mel.size(-1)
+        return min(diffusion_window, max_window) if diffusion_window > 0 else max_window
+
+    @staticmethod
+    def _print_s2mel_stats(stats):
+        print(f">> s2mel {stats['solver']}/{stats['t_schedule']} {stats['n_timesteps']} steps",
+              f"x {stats.get('windows', 1)} windows:",
+              f"estimator calls: {stats['estimator_calls']} (cfg: {stats['cfg_evals']}, reuse: {stats['reuse_evals']},",
+              f"cond: {stats['cond_evals']}), rows: {stats['estimator_rows']},",
+              f"estimator time: {stats['estimator_time']:.2f} seconds")
+
     def _load_and_cut_audio(self,audio_path,max_audio_length_seconds,verbose=False,sr=None):
         if not sr:
             audio, sr = librosa.load(audio_path)
@@ -306,21 +518,119 @@ class IndexTTS2:
             audio = audio[:, :max_audio_samples]
         return audio, sr
 
-    # 原始推理模式
-    def infer(self, spk_audio_prompt, text, output_path,
-              emo_audio_prompt=None, emo_alpha=1.0,
-              emo_vector=None,
-              use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
-              verbose=False, max_text_tokens_per_segment=120, **generation_kwargs):
-        print(">> starting inference...")
-        self._set_gr_progress(0, "starting inference...")
-        if verbose:
-            print(f"origin text:{text}, spk_audio_prompt:{spk_audio_prompt}, "
-                  f"emo_audio_prompt:{emo_audio_prompt}, emo_alpha:{emo_alpha}, "
-                  f"emo_vector:{emo_vector}, use_emo_text:{use_emo_text}, "
-                  f"emo_text:{emo_text}")
-        start_time = time.perf_counter()
+    def _load_reference_frontend(self):
+        """
+        Load the models that are only needed to compute the conditioning of a new reference audio
+        (w2v-BERT feature extractor and model, CAMPPlus). Deferred when serving from a voice store.
+        Thread safe: ``campplus_model`` is assigned last, once everything else is ready, and tested again
+        under the lock so concurrent first calls load the models once.
+        """
+        if self.campplus_model is not None:
+            return
+        with self._frontend_lock:
+            if self.campplus_model is not None:
+                return
+            self.extract_features = SeamlessM4TFbankFeatures().to(self.device)
+            semantic_model, semantic_mean, semantic_std = build_semantic_model(
+                os.path.join(self.model_dir, self.cfg.w2v_stat), output_layer=self.semantic_layer)
+            self.semantic_model = semantic_model.to(self.device)
+            self.semantic_model.eval()
+            self.semantic_mean = semantic_mean.to(self.device)
+            self.semantic_std = semantic_std.to(self.device)
+
+            # load campplus_model
+            campplus_ckpt_path = hf_hub_download(
+                "funasr/campplus", filename="campplus_cn_common.bin"
+            )
+            campplus_model = CAMPPlus(feat_dim=80, embedding_size=192)
+            campplus_model.load_state_dict(torch.load(campplus_ckpt_path, map_location="cpu"))
+            campplus_model = campplus_model.to(self.device)
+            campplus_model.eval()
+            self.campplus_model = campplus_model
+            print(">> campplus_model weights restored from:", campplus_ckpt_path)
+
+    @torch.no_grad()
+    def get_speaker_conditioning(self, spk_audio_prompt, verbose=False):
+        """
+        Speaker conditioning of a reference audio: dict with ``spk_cond_emb``, ``style``,
+        ``prompt_condition`` and ``ref_mel``. Looked up in the voice store first, then in the LRU cache.
+        """
+        spk_cache_key = hash_audio_file(spk_audio_prompt)
+        if self.voice_store is not None:
+            spk_bundle = self.voice_store.get_speaker(spk_cache_key)
+            if spk_bundle is not None:
+                return spk_bundle
+        # 如果参考音频不在缓存中，才需要重新生成, 提升速度
+        spk_bundle = self.spk_cond_cache.get(spk_cache_key)
+        if spk_bundle is not None:
+            return spk_bundle
+
+        self._load_reference_frontend()
+        audio,sr = self._load_and_cut_audio(spk_audio_prompt,15,verbose)
+        audio = audio.to(self.device)
+        audio_22k = self.resample(audio, sr, 22050)
+        audio_16k = self.resample(audio, sr, 16000)
+
+        input_features, attention_mask = self.extract_features(audio_16k)
+        spk_cond_emb = self.get_emb(input_features, attention_mask)
+
+        _, S_ref = self.semantic_codec.quantize(spk_cond_emb)
+        ref_mel = self.mel_fn(audio_22k.to(spk_cond_emb.device).float())
+        ref_target_lengths = torch.LongTensor([ref_mel.size(2)]).to(ref_mel.device)
+        feat = torchaudio.compliance.kaldi.fbank(audio_16k.to(ref_mel.device),
+                                                 num_mel_bins=80,
+                                                 dither=0,
+                                                 sample_frequency=16000)
+        feat = feat - feat.mean(dim=0, keepdim=True)  # feat2另外一个滤波器能量组特征[922, 80]
+        style = self.campplus_model(feat.unsqueeze(0))  # 参考音频的全局style2[1,192]
+
+        prompt_condition = self.s2mel.models['length_regulator'](S_ref,
+                                                                 ylens=ref_target_lengths,
+                                                                 n_quantizers=3,
+                                                                 f0=None)[0]
+
+        spk_bundle = {
+            "spk_cond_emb": spk_cond_emb,
+            "style": style,
+            "prompt_condition": prompt_condition,
+            "ref_mel": ref_mel,
+        }
+        self.spk_cond_cache.put(spk_cache_key, spk_bundle)
+        return spk_bundle
 
+    @torch.no_grad()
+    def get_emotion_conditioning(self, emo_audio_prompt, verbose=False):
+        """
+        Emotion conditioning of a reference audio: dict with ``emo_cond_emb``.
+        Looked up in the voice store first, then in the LRU cache.
+        """
+        emo_cache_key = hash_audio_file(emo_audio_prompt)
+        if self.voice_store is not None:
+            emo_bundle = self.voice_store.get_emotion(emo_cache_key)
+            if emo_bundle is not None:
+                return emo_bundle
+        emo_bundle = self.emo_cond_cache.get(emo_cache_key)
+        if emo_bundle is not None:
+            return emo_bundle
+
+        self._load_reference_frontend()
+        emo_audio, _ = self._load_and_cut_audio(emo_audio_prompt,15,verbose,sr=16000)
+        emo_input_features, emo_attention_mask = self.extract_features(emo_audio.to(self.device))
+        emo_cond_emb = self.get_emb(emo_input_features, emo_attention_mask)
+
+        emo_bundle = {"emo_cond_emb": emo_cond_emb}
+        self.emo_cond_cache.put(emo_cache_key, emo_bundle)
+        return emo_bundle
+
+    def _prepare_conditioning(self, spk_audio_prompt, text, emo_audio_prompt=None, emo_alpha=1.0, emo_vector=None,
+                              use_emo_text=False, emo_text=None, use_random=False, verbose=False, rng=random):
+        """
+        Resolve the speaker and emotion conditioning of a request. The returned ``emovec`` is the
+        merged emotion vector fed to the GPT, ``speech_conditioning_latent`` and ``conds_latent`` the
+        text independent GPT prefix (see ``UnifiedVoice.prepare_conditioning_latents``); none of them
+        depend on the text, so they are computed once and shared by all segments.
+        ``use_random`` draws the emotion matrix rows from ``rng`` (`random` or a `random.Random`).
+        """
         if use_emo_text or emo_vector is not None:
             # we're using a text or emotion vector guidance; so we must remove
             # "emotion reference voice", to ensure we use correct emotion mixing!
@@ -352,49 +662,16 @@ class IndexTTS2:
             # must always use alpha=1.0 when we don't have an external reference voice
             emo_alpha = 1.0
 
-        # 如果参考音频改变了，才需要重新生成, 提升速度
-        if self.cache_spk_cond is None or self.cache_spk_audio_prompt != spk_audio_prompt:
-            audio,sr = self._load_and_cut_audio(spk_audio_prompt,15,verbose)
-            audio_22k = torchaudio.transforms.Resample(sr, 22050)(audio)
-            audio_16k = torchaudio.transforms.Resample(sr, 16000)(audio)
-
-            inputs = self.extract_features(audio_16k, sampling_rate=16000, return_tensors="pt")
-            input_features = inputs["input_features"]
-            attention_mask = inputs["attention_mask"]
-            input_features = input_features.to(self.device)
-            attention_mask = attention_mask.to(self.device)
-            spk_cond_emb = self.get_emb(input_features, attention_mask)
-
-            _, S_ref = self.semantic_codec.quantize(spk_cond_emb)
-            ref_mel = self.mel_fn(audio_22k.to(spk_cond_emb.device).float())
-            ref_target_lengths = torch.LongTensor([ref_mel.size(2)]).to(ref_mel.device)
-            feat = torchaudio.compliance.kaldi.fbank(audio_16k.to(ref_mel.device),
-                                                     num_mel_bins=80,
-                                                     dither=0,
-                                                     sample_frequency=16000)
-            feat = feat - feat.mean(dim=0, keepdim=True)  # feat2另外一个滤波器能量组特征[922, 80]
-            style = self.campplus_model(feat.unsqueeze(0))  # 参考音频的全局style2[1,192]
-
-            prompt_condition = self.s2mel.models['length_regulator'](S_ref,
-                                                                     ylens=ref_target_lengths,
-                                                                     n_quantizers=3,
-                                                                     f0=None)[0]
-
-            self.cache_spk_cond = spk_cond_emb
-            self.cache_s2mel_style = style
-            self.cache_s2mel_prompt = prompt_condition
-            self.cache_spk_audio_prompt = spk_audio_prompt
-            self.cache_mel = ref_mel
-        else:
-            style = self.cache_s2mel_style
-            prompt_condition = self.cache_s2mel_prompt
-            spk_cond_emb = self.cache_spk_cond
-            ref_mel = self.cache_mel
+        spk_cond = self.get_speaker_conditioning(spk_audio_prompt, verbose)
+        style = spk_cond["style"]
+        prompt_condition = spk_cond["prompt_condition"]
+        spk_cond_emb = spk_cond["spk_cond_emb"]
+        ref_mel = spk_cond["ref_mel"]
 
         if emo_vector is not None:
             weight_vector = torch.tensor(emo_vector).to(self.device)
             if use_random:
-                random_index = [random.randint(0, x - 1) for x in self.emo_num]
+                random_index = [rng.randint(0, x - 1) for x in self.emo_num]
             else:
                 random_index = [find_most_similar_cosine(style, tmp) for tmp in self.spk_matrix]
 
@@ -404,19 +681,125 @@ class IndexTTS2:
             emovec_mat = torch.sum(emovec_mat, 0)
             emovec_mat = emovec_mat.unsqueeze(0)
 
-        if self.cache_emo_cond is None or self.cache_emo_audio_prompt != emo_audio_prompt:
-            emo_audio, _ = self._load_and_cut_audio(emo_audio_prompt,15,verbose,sr=16000)
-            emo_inputs = self.extract_features(emo_audio, sampling_rate=16000, return_tensors="pt")
-            emo_input_features = emo_inputs["input_features"]
-            emo_attention_mask = emo_inputs["attention_mask"]
-            emo_input_features = emo_input_features.to(self.device)
-            emo_attention_mask = emo_attention_mask.to(self.device)
-            emo_cond_emb = self.get_emb(emo_input_features, emo_attention_mask)
-
-            self.cache_emo_cond = emo_cond_emb
-            self.cache_emo_audio_prompt = emo_audio_prompt
+        emo_cond_emb = self.get_emotion_conditioning(emo_audio_prompt, verbose)["emo_cond_emb"]
+
+        device = spk_cond_emb.device
+        with torch.no_grad():
+            with torch.amp.autocast(device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                emovec = self.gpt.merge_emovec(
+                    spk_cond_emb,
+                    emo_cond_emb,
+                    torch.tensor([spk_cond_emb.shape[-1]], device=device),
+                    torch.tensor([emo_cond_emb.shape[-1]], device=device),
+                    alpha=emo_alpha
+                )
+
+                if emo_vector is not None:
+                    emovec = emovec_mat + (1 - torch.sum(weight_vector)) * emovec
+                    # emovec = emovec_mat
+
+                speech_conditioning_latent, conds_latent = self.gpt.prepare_conditioning_latents(
+                    spk_cond_emb,
+                    emo_cond_emb,
+                    torch.tensor([spk_cond_emb.shape[-1]], device=device),
+                    torch.tensor([emo_cond_emb.shape[-1]], device=device),
+                    emo_vec=emovec
+                )
+
+        return {
+            "spk_cond_emb": spk_cond_emb,
+            "style": style,
+            "prompt_condition": prompt_condition,
+            "ref_mel": ref_mel,
+            "emo_cond_emb": emo_cond_emb,
+            "emovec": emovec,
+            "speech_conditioning_latent": speech_conditioning_latent,
+            "conds_latent": conds_latent,
+        }
+
+
+    # 原始推理模式
+    def infer(self, spk_audio_prompt, text, output_path,
+              emo_audio_prompt=None, emo_alpha=1.0,
+              emo_vector=None,
+              use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
+              verbose=False, max_text_tokens_per_segment=120, **generation_kwargs):
+        sampling_rate = self.sampling_rate
+        wavs = [chunk["wav"] for chunk in self.infer_stream(
+            spk_audio_prompt, text,
+            emo_audio_prompt=emo_audio_prompt, emo_alpha=emo_alpha,
+            emo_vector=emo_vector,
+            use_emo_text=use_emo_text, emo_text=emo_text, use_random=use_random,
+            interval_silence=interval_silence, verbose=verbose,
+            max_text_tokens_per_segment=max_text_tokens_per_segment, **generation_kwargs)]
+
+        self._set_gr_progress(0.9, "saving audio...")
+        wav = torch.cat(wavs, dim=1)
+
+        # save audio
+        if output_path:
+            # 直接保存音频到指定路径中
+            if os.path.isfile(output_path):
+                os.remove(output_path)
+                print(">> remove old wav file:", output_path)
+            if os.path.dirname(output_path) != "":
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            torchaudio.save(output_path, wav.type(torch.int16), sampling_rate)
+            print(">> wav file saved to:", output_path)
+            return output_path
         else:
-            emo_cond_emb = self.cache_emo_cond
+            # 返回以符合Gradio的格式要求
+            wav_data = wav.type(torch.int16)
+            wav_data = wav_data.numpy().T
+            return (sampling_rate, wav_data)
+
+    # 流式推理模式
+    def infer_stream(self, spk_audio_prompt, text,
+                     emo_audio_prompt=None, emo_alpha=1.0,
+                     emo_vector=None,
+                     use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
+                     verbose=False, max_text_tokens_per_segment=120, **generation_kwargs):
+        """
+        Generator variant of ``infer``: synthesizes ``text`` segment by segment and yields the
+        audio as soon as each segment has gone through GPT -> s2mel -> BigVGAN, so only one
+        segment is held in memory at a time.
+
+        Yields dicts with:
+            wav (torch.Tensor): int16 PCM on cpu, shape [1, T].
+            sampling_rate (int): sampling rate of ``wav``.
+            is_silence (bool): True for the ``interval_silence`` chunk inserted between segments.
+            segment_idx (int), segments_count (int): position of the chunk in the text.
+            chunk_idx (int): position of the chunk in its segment, a segment is one chunk unless
+                ``vocoder_chunk_frames`` is set.
+            text_tokens (int): number of text tokens of the segment (0 for silence).
+            gpt_gen_time, gpt_forward_time, s2mel_time, bigvgan_time (float): per-segment
+                stage timings in seconds (0 for silence).
+            s2mel_stats (dict): estimator calls of the CFM, see `CFGSchedule.stats()` (None for silence).
+            audio_length (float): duration of ``wav`` in seconds.
+
+        ``seed`` (in ``generation_kwargs``, default None): sample from random generators seeded with it and
+        owned by the call, for reproducible output, see ``_make_generators``.
+        """
+        print(">> starting inference...")
+        self._set_gr_progress(0, "starting inference...")
+        if verbose:
+            print(f"origin text:{text}, spk_audio_prompt:{spk_audio_prompt}, "
+                  f"emo_audio_prompt:{emo_audio_prompt}, emo_alpha:{emo_alpha}, "
+                  f"emo_vector:{emo_vector}, use_emo_text:{use_emo_text}, "
+                  f"emo_text:{emo_text}")
+        start_time = time.perf_counter()
+        rng, generator = self._make_generators(generation_kwargs.pop("seed", None))
+
+        cond = self._prepare_conditioning(spk_audio_prompt, text, emo_audio_prompt, emo_alpha, emo_vector,
+                                          use_emo_text, emo_text, use_random, verbose, rng)
+        spk_cond_emb = cond["spk_cond_emb"]
+        style = cond["style"]
+        prompt_condition = cond["prompt_condition"]
+        ref_mel = cond["ref_mel"]
+        emo_cond_emb = cond["emo_cond_emb"]
+        emovec = cond["emovec"]
+        spk_cond_latent = cond["speech_conditioning_latent"]
+        conds_latent = cond["conds_latent"]
 
         self._set_gr_progress(0.1, "text processing...")
         text_tokens_list = self.tokenizer.tokenize(text)
@@ -436,9 +819,24 @@ class IndexTTS2:
         num_beams = generation_kwargs.pop("num_beams", 3)
         repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
         max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 1500)
-        sampling_rate = 22050
+        # s2mel CFM sampling, see `s2mel.modules.flow_matching.SOLVERS` and `T_SCHEDULES`
+        diffusion_steps = generation_kwargs.pop("diffusion_steps", 25)
+        diffusion_solver = generation_kwargs.pop("diffusion_solver", "euler")
+        diffusion_schedule = generation_kwargs.pop("diffusion_schedule", "linear")
+        # classifier-free guidance schedule of the CFM, see `s2mel.modules.flow_matching.CFGSchedule`
+        diffusion_cfg_interval = generation_kwargs.pop("diffusion_cfg_interval", None)
+        diffusion_cfg_reuse_steps = generation_kwargs.pop("diffusion_cfg_reuse_steps", 1)
+        # windowed s2mel for long segments: target mel frames per CFM window (0 = whole segment), see
+        # `s2mel.modules.flow_matching.BASECFM.inference_windowed`
+        diffusion_window = generation_kwargs.pop("diffusion_window", 0)
+        diffusion_window_overlap = generation_kwargs.pop("diffusion_window_overlap", 64)
+        # vocode the segment mel in chunks of this many frames and yield each as soon as it is ready
+        # (``infer_stream`` only, 0 = one BigVGAN call per segment), see `StreamingVocoder`
+        vocoder_chunk_frames = generation_kwargs.pop("vocoder_chunk_frames", 0)
+        sampling_rate = self.sampling_rate
+        sil_dur = int(sampling_rate * interval_silence / 1000.0)
 
-        wavs = []
+        wav_samples = 0
         gpt_gen_time = 0
         gpt_forward_time = 0
         s2mel_time = 0
@@ -460,19 +858,7 @@ class IndexTTS2:
             m_start_time = time.perf_counter()
             with torch.no_grad():
                 with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                    emovec = self.gpt.merge_emovec(
-                        spk_cond_emb,
-                        emo_cond_emb,
-                        torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
-                        alpha=emo_alpha
-                    )
-
-                    if emo_vector is not None:
-                        emovec = emovec_mat + (1 - torch.sum(weight_vector)) * emovec
-                        # emovec = emovec_mat
-
-                    codes, speech_conditioning_latent = self.gpt.inference_speech(
+                    codes, speech_conditioning_latent, generation_latent = self._generate_mel_codes(
                         spk_cond_emb,
                         text_tokens,
                         emo_cond_emb,
@@ -488,10 +874,15 @@ class IndexTTS2:
                         num_beams=num_beams,
                         repetition_penalty=repetition_penalty,
                         max_generate_length=max_mel_tokens,
+                        return_latent=self.capture_gpt_latent,
+                        speech_conditioning_latent=spk_cond_latent,
+                        conds_latent=conds_latent,
+                        generator=generator,
                         **generation_kwargs
                     )
 
-                gpt_gen_time += time.perf_counter() - m_start_time
+                seg_gpt_gen_time = time.perf_counter() - m_start_time
+                gpt_gen_time += seg_gpt_gen_time
                 if not has_warned and (codes[:, -1] != self.stop_mel_token).any():
                     warnings.warn(
                         f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
@@ -525,26 +916,31 @@ class IndexTTS2:
                     print(f"code len: {code_lens}")
 
                 m_start_time = time.perf_counter()
-                use_speed = torch.zeros(spk_cond_emb.size(0)).to(spk_cond_emb.device).long()
-                with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                    latent = self.gpt(
-                        speech_conditioning_latent,
-                        text_tokens,
-                        torch.tensor([text_tokens.shape[-1]], device=text_tokens.device),
-                        codes,
-                        torch.tensor([codes.shape[-1]], device=text_tokens.device),
-                        emo_cond_emb,
-                        cond_mel_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_cond_mel_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_vec=emovec,
-                        use_speed=use_speed,
-                    )
-                    gpt_forward_time += time.perf_counter() - m_start_time
+                if generation_latent is not None:
+                    # hidden states collected during generation, no second pass over the codes
+                    latent = generation_latent[:, :code_len]
+                else:
+                    use_speed = torch.zeros(spk_cond_emb.size(0)).to(spk_cond_emb.device).long()
+                    with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                        latent = self.gpt(
+                            speech_conditioning_latent,
+                            text_tokens,
+                            torch.tensor([text_tokens.shape[-1]], device=text_tokens.device),
+                            codes,
+                            torch.tensor([codes.shape[-1]], device=text_tokens.device),
+                            emo_cond_emb,
+                            cond_mel_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
+                            emo_cond_mel_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
+                            emo_vec=emovec,
+                            use_speed=use_speed,
+                            conds_latent=conds_latent,
+                        )
+                seg_gpt_forward_time = time.perf_counter() - m_start_time
+                gpt_forward_time += seg_gpt_forward_time
 
                 dtype = None
                 with torch.amp.autocast(text_tokens.device.type, enabled=dtype is not None, dtype=dtype):
                     m_start_time = time.perf_counter()
-                    diffusion_steps = 25
                     inference_cfg_rate = 0.7
                     latent = self.s2mel.models['gpt_layer'](latent)
                     S_infer = self.semantic_codec.quantizer.vq2emb(codes.unsqueeze(1))
@@ -557,28 +953,329 @@ class IndexTTS2:
                                                                  n_quantizers=3,
                                                                  f0=None)[0]
                     cat_condition = torch.cat([prompt_condition, cond], dim=1)
-                    vc_target = self.s2mel.models['cfm'].inference(cat_condition,
-                                                                   torch.LongTensor([cat_condition.size(1)]).to(
-                                                                       cond.device),
-                                                                   ref_mel, style, None, diffusion_steps,
-                                                                   inference_cfg_rate=inference_cfg_rate)
+                    with self._s2mel_lock:
+                        vc_target, seg_s2mel_stats = self.s2mel.models['cfm'].inference_windowed(cat_condition,
+                                                                       torch.LongTensor([cat_condition.size(1)]).to(
+                                                                           cond.device),
+                                                                       ref_mel, style, None, diffusion_steps,
+                                                                       self._s2mel_window(ref_mel, diffusion_window),
+                                                                       diffusion_window_overlap,
+                                                                       inference_cfg_rate=inference_cfg_rate,
+                                                                       solver=diffusion_solver,
+                                                                       t_schedule=diffusion_schedule,
+                                                                       cfg_interval=diffusion_cfg_interval,
+                                                                       cfg_reuse_steps=diffusion_cfg_reuse_steps,
+                                                                       generator=generator,
+                                                                       return_stats=True)
                     vc_target = vc_target[:, :, ref_mel.size(-1):]
-                    s2mel_time += time.perf_counter() - m_start_time
-
-                    m_start_time = time.perf_counter()
-                    wav = self.bigvgan(vc_target.float()).squeeze().unsqueeze(0)
-                    print(wav.shape)
-                    bigvgan_time += time.perf_counter() - m_start_time
-                    wav = wav.squeeze(1)
+                    seg_s2mel_time = time.perf_counter() - m_start_time
+                    s2mel_time += seg_s2mel_time
+                    if verbose:
+                        self._print_s2mel_stats(seg_s2mel_stats)
+
+                    if vocoder_chunk_frames > 0:
+                        wav_chunks = StreamingVocoder(self.bigvgan, chunk_frames=vocoder_chunk_frames).stream(
+                            vc_target.float())
+                    else:
+                        wav_chunks = map(self.bigvgan, [vc_target.float()])
 
+            chunk_idx = 0
+            channels = 1
+            while True:
+                # with `vocoder_chunk_frames` the chunks are vocoded one by one as they are consumed
+                m_start_time = time.perf_counter()
+                with torch.no_grad(), self._vocoder_lock:
+                    wav = next(wav_chunks, None)
+                if wav is None:
+                    break
+                seg_bigvgan_time = time.perf_counter() - m_start_time
+                bigvgan_time += seg_bigvgan_time
+                wav = wav.squeeze(1)
                 wav = torch.clamp(32767 * wav, -32767.0, 32767.0)
                 if verbose:
                     print(f"wav shape: {wav.shape}", "min:", wav.min(), "max:", wav.max())
-                # wavs.append(wav[:, :-512])
-                wavs.append(wav.cpu())  # to cpu before saving
+                wav = wav.cpu().type(torch.int16)  # to cpu before saving
+                wav_samples += wav.shape[-1]
+                channels = wav.size(0)  # `wav` is None once the chunks are exhausted
+                # stage timings of the segment are reported with its first chunk
+                first = chunk_idx == 0
+                yield {
+                    "wav": wav,
+                    "sampling_rate": sampling_rate,
+                    "is_silence": False,
+                    "segment_idx": seg_idx,
+                    "segments_count": segments_count,
+                    "chunk_idx": chunk_idx,
+                    "text_tokens": text_tokens.shape[-1] if first else 0,
+                    "gpt_gen_time": seg_gpt_gen_time if first else 0.0,
+                    "gpt_forward_time": seg_gpt_forward_time if first else 0.0,
+                    "s2mel_time": seg_s2mel_time if first else 0.0,
+                    "s2mel_stats": seg_s2mel_stats if first else None,
+                    "bigvgan_time": seg_bigvgan_time,
+                    "audio_length": wav.shape[-1] / sampling_rate,
+                }
+                chunk_idx += 1
+            if sil_dur > 0 and seg_idx < segments_count - 1:
+                # insert silences between generated segments
+                wav_samples += sil_dur
+                yield {
+                    "wav": torch.zeros(channels, sil_dur, dtype=torch.int16),
+                    "sampling_rate": sampling_rate,
+                    "is_silence": True,
+                    "segment_idx": seg_idx,
+                    "segments_count": segments_count,
+                    "chunk_idx": 0,
+                    "text_tokens": 0,
+                    "gpt_gen_time": 0.0,
+                    "gpt_forward_time": 0.0,
+                    "s2mel_time": 0.0,
+                    "s2mel_stats": None,
+                    "bigvgan_time": 0.0,
+                    "audio_length": sil_dur / sampling_rate,
+                }
         end_time = time.perf_counter()
 
+        wav_length = wav_samples / sampling_rate
+        print(f">> gpt_gen_time: {gpt_gen_time:.2f} seconds")
+        print(f">> gpt_forward_time: {gpt_forward_time:.2f} seconds")
+        print(f">> s2mel_time: {s2mel_time:.2f} seconds")
+        print(f">> bigvgan_time: {bigvgan_time:.2f} seconds")
+        print(f">> Total inference time: {end_time - start_time:.2f} seconds")
+        print(f">> Generated audio length: {wav_length:.2f} seconds")
+        print(f">> RTF: {(end_time - start_time) / wav_length:.4f}")
+
+    # 快速推理：按分句长度分桶，每个桶内的分句批量经过 GPT、s2mel 和 BigVGAN
+    def infer_fast(self, spk_audio_prompt, text, output_path,
+                   emo_audio_prompt=None, emo_alpha=1.0,
+                   emo_vector=None,
+                   use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
+                   verbose=False, max_text_tokens_per_segment=120, segments_bucket_max_size=4,
+                   **generation_kwargs):
+        """
+        Args:
+            ``max_text_tokens_per_segment``: 分句的最大token数，默认``120``，可以根据GPU硬件情况调整
+                - 越小，batch 越多，推理速度越*快*，占用内存更多，可能影响质量
+                - 越大，batch 越少，推理速度越*慢*，占用内存和质量更接近于非快速推理
+            ``segments_bucket_max_size``: 分句分桶的最大容量，默认``4``，可以根据GPU内存调整
+                - 越大，bucket数量越少，batch越多，推理速度越*快*，占用内存更多，可能影响质量
+                - 越小，bucket数量越多，batch越少，推理速度越*慢*，占用内存和质量更接近于非快速推理
+            ``seed``（在 ``generation_kwargs`` 中，默认 None）: 使用以它为种子、本次调用独占的随机数发生器采样，结果可复现，见 ``_make_generators``
+        """
+        print(">> starting fast inference...")
+        self._set_gr_progress(0, "starting fast inference...")
+        if verbose:
+            print(f"origin text:{text}, spk_audio_prompt:{spk_audio_prompt}, "
+                  f"emo_audio_prompt:{emo_audio_prompt}, emo_alpha:{emo_alpha}, "
+                  f"emo_vector:{emo_vector}, use_emo_text:{use_emo_text}, "
+                  f"emo_text:{emo_text}")
+        start_time = time.perf_counter()
+        rng, generator = self._make_generators(generation_kwargs.pop("seed", None))
+
+        cond = self._prepare_conditioning(spk_audio_prompt, text, emo_audio_prompt, emo_alpha, emo_vector,
+                                          use_emo_text, emo_text, use_random, verbose, rng)
+        spk_cond_emb = cond["spk_cond_emb"]
+        style = cond["style"]
+        prompt_condition = cond["prompt_condition"]
+        ref_mel = cond["ref_mel"]
+        emo_cond_emb = cond["emo_cond_emb"]
+        emovec = cond["emovec"]
+        spk_cond_latent = cond["speech_conditioning_latent"]
+        conds_latent = cond["conds_latent"]
+
+        self._set_gr_progress(0.1, "text processing...")
+        text_tokens_list = self.tokenizer.tokenize(text)
+        segments = self.tokenizer.split_segments(text_tokens_list, max_text_tokens_per_segment)
+        segments_count = len(segments)
+        if verbose:
+            print(">> text token count:", len(text_tokens_list))
+            print("   segments count:", segments_count)
+            print("   max_text_tokens_per_segment:", max_text_tokens_per_segment)
+            print(*segments, sep="\n")
+        do_sample = generation_kwargs.pop("do_sample", True)
+        top_p = generation_kwargs.pop("top_p", 0.8)
+        top_k = generation_kwargs.pop("top_k", 30)
+        temperature = generation_kwargs.pop("temperature", 0.8)
+        autoregressive_batch_size = 1
+        length_penalty = generation_kwargs.pop("length_penalty", 0.0)
+        num_beams = generation_kwargs.pop("num_beams", 3)
+        repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
+        max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 1500)
+        # s2mel CFM sampling, see `s2mel.modules.flow_matching.SOLVERS` and `T_SCHEDULES`
+        diffusion_steps = generation_kwargs.pop("diffusion_steps", 25)
+        diffusion_solver = generation_kwargs.pop("diffusion_solver", "euler")
+        diffusion_schedule = generation_kwargs.pop("diffusion_schedule", "linear")
+        # classifier-free guidance schedule of the CFM, see `s2mel.modules.flow_matching.CFGSchedule`
+        diffusion_cfg_interval = generation_kwargs.pop("diffusion_cfg_interval", None)
+        diffusion_cfg_reuse_steps = generation_kwargs.pop("diffusion_cfg_reuse_steps", 1)
+        # windowed s2mel for long segments: target mel frames per CFM window (0 = whole segment), see
+        # `s2mel.modules.flow_matching.BASECFM.inference_windowed`
+        diffusion_window = generation_kwargs.pop("diffusion_window", 0)
+        diffusion_window_overlap = generation_kwargs.pop("diffusion_window_overlap", 64)
+        # chunked vocoding only applies to ``infer_stream``, the segments here are vocoded as a batch
+        generation_kwargs.pop("vocoder_chunk_frames", None)
+        sampling_rate = self.sampling_rate
+        inference_cfg_rate = 0.7
+        # log-mel of silence, used to pad shorter mels in a BigVGAN batch
+        mel_pad_value = math.log(1e-5)
+        device = torch.device(self.device)
+
+        gpt_gen_time = 0
+        gpt_forward_time = 0
+        s2mel_time = 0
+        bigvgan_time = 0
+        has_warned = False
+
+        bucket_max_size = segments_bucket_max_size if device.type != "cpu" else 1
+        all_segments = self.bucket_segments(segments, bucket_max_size=bucket_max_size)
+        bucket_count = len(all_segments)
+        if verbose:
+            print(">> segments bucket_count:", bucket_count,
+                  "bucket sizes:", [(len(s), [t["idx"] for t in s]) for s in all_segments],
+                  "bucket_max_size:", bucket_max_size)
+
+        wavs = [None] * segments_count
+        processed_num = 0
+        for bucket in all_segments:
+            batch_num = len(bucket)
+            item_tokens = [
+                torch.tensor(self.tokenizer.convert_tokens_to_ids(item["sent"]), dtype=torch.int32,
+                             device=device).unsqueeze(0)
+                for item in bucket
+            ]
+            batch_text_tokens = self.pad_tokens_cat(item_tokens) if batch_num > 1 else item_tokens[0]
+            self._set_gr_progress(0.2 + 0.7 * processed_num / segments_count,
+                                  f"speech synthesis {processed_num + 1}-{processed_num + batch_num}/{segments_count}...")
+            processed_num += batch_num
+
+            # gpt speech: one generate call for the whole bucket
+            m_start_time = time.perf_counter()
+            with torch.no_grad():
+                with torch.amp.autocast(device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    batch_codes, _, batch_generation_latent = self._generate_mel_codes(
+                        spk_cond_emb.expand(batch_num, -1, -1),
+                        batch_text_tokens,
+                        emo_cond_emb.expand(batch_num, -1, -1),
+                        cond_lengths=torch.tensor([spk_cond_emb.shape[-1]] * batch_num, device=device),
+                        emo_cond_lengths=torch.tensor([emo_cond_emb.shape[-1]] * batch_num, device=device),
+                        emo_vec=emovec.expand(batch_num, -1),
+                        do_sample=True,
+                        top_p=top_p,
+                        top_k=top_k,
+                        temperature=temperature,
+                        num_return_sequences=autoregressive_batch_size,
+                        length_penalty=length_penalty,
+                        num_beams=num_beams,
+                        repetition_penalty=repetition_penalty,
+                        max_generate_length=max_mel_tokens,
+                        return_latent=self.capture_gpt_latent,
+                        speech_conditioning_latent=spk_cond_latent,
+                        conds_latent=conds_latent,
+                        generator=generator,
+                        **generation_kwargs
+                    )
+            gpt_gen_time += time.perf_counter() - m_start_time
+
+            # gpt latent + semantic condition, per segment (the latent forward has no padding mask)
+            conds = []
+            for i, text_tokens in enumerate(item_tokens):
+                codes = batch_codes[i:i + 1]
+                if not has_warned and (codes[:, -1] != self.stop_mel_token).any():
+                    warnings.warn(
+                        f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
+                        f"Input text tokens: {text_tokens.shape[1]}. "
+                        f"Consider reducing `max_text_tokens_per_segment`({max_text_tokens_per_segment}) or increasing `max_mel_tokens`.",
+                        category=RuntimeWarning
+                    )
+                    has_warned = True
+                stop_idx = (codes[0] == self.stop_mel_token).nonzero(as_tuple=False)
+                code_len = stop_idx[0].item() if len(stop_idx) > 0 else codes.shape[-1]
+                codes = codes[:, :code_len]
+                code_lens = torch.tensor([code_len], dtype=torch.long, device=device)
+                if verbose:
+                    print(f"segment {bucket[i]['idx']} codes shape: {codes.shape}")
+
+                m_start_time = time.perf_counter()
+                with torch.no_grad():
+                    with torch.amp.autocast(device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                        if batch_generation_latent is not None:
+                            latent = batch_generation_latent[i:i + 1, :code_len]
+                        else:
+                            latent = self.gpt(
+                                spk_cond_latent,
+                                text_tokens,
+                                torch.tensor([text_tokens.shape[-1]], device=device),
+                                codes,
+                                torch.tensor([codes.shape[-1]], device=device),
+                                emo_cond_emb,
+                                cond_mel_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=device),
+                                emo_cond_mel_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=device),
+                                emo_vec=emovec,
+                                use_speed=torch.zeros(1, device=device).long(),
+                                conds_latent=conds_latent,
+                            )
+                    gpt_forward_time += time.perf_counter() - m_start_time
+
+                    m_start_time = time.perf_counter()
+                    latent = self.s2mel.models['gpt_layer'](latent)
+                    S_infer = self.semantic_codec.quantizer.vq2emb(codes.unsqueeze(1))
+                    S_infer = S_infer.transpose(1, 2)
+                    S_infer = S_infer + latent
+                    target_lengths = (code_lens * 1.72).long()
+                    cond = self.s2mel.models['length_regulator'](S_infer,
+                                                                 ylens=target_lengths,
+                                                                 n_quantizers=3,
+                                                                 f0=None)[0]
+                    conds.append(torch.cat([prompt_condition, cond], dim=1))
+                    s2mel_time += time.perf_counter() - m_start_time
+
+            # s2mel: padded batch through the CFM, x_lens masks the padding
+            with torch.no_grad():
+                m_start_time = time.perf_counter()
+                x_lens = torch.LongTensor([c.size(1) for c in conds]).to(device)
+                cat_condition = pad_sequence([c.squeeze(0) for c in conds], batch_first=True)
+                with self._s2mel_lock:
+                    vc_target, s2mel_stats = self.s2mel.models['cfm'].inference_windowed(cat_condition, x_lens,
+                                                                   ref_mel.expand(batch_num, -1, -1),
+                                                                   style.expand(batch_num, -1),
+                                                                   None, diffusion_steps,
+                                                                   self._s2mel_window(ref_mel, diffusion_window),
+                                                                   diffusion_window_overlap,
+                                                                   inference_cfg_rate=inference_cfg_rate,
+                                                                   solver=diffusion_solver,
+                                                                   t_schedule=diffusion_schedule,
+                                                                   cfg_interval=diffusion_cfg_interval,
+                                                                   cfg_reuse_steps=diffusion_cfg_reuse_steps,
+                                                                   generator=generator,
+                                                                   return_stats=True)
+                prompt_len = ref_mel.size(-1)
+                mel_lens = x_lens - prompt_len
+                vc_target = vc_target[:, :, prompt_len:]
+                if verbose:
+                    self._print_s2mel_stats(s2mel_stats)
+                # pad the tail of shorter mels with silence instead of the CFM output on padding
+                mel_mask = torch.arange(vc_target.size(-1), device=device)[None, :] < mel_lens[:, None]
+                vc_target = vc_target.masked_fill(~mel_mask.unsqueeze(1), mel_pad_value)
+                s2mel_time += time.perf_counter() - m_start_time
+
+                m_start_time = time.perf_counter()
+                with self._vocoder_lock:
+                    batch_wav = self.bigvgan(vc_target.float()).squeeze(1)
+                bigvgan_time += time.perf_counter() - m_start_time
+                hop_length = batch_wav.size(-1) // vc_target.size(-1)
+                batch_wav = torch.clamp(32767 * batch_wav, -32767.0, 32767.0)
+
+            for i, item in enumerate(bucket):
+                wavs[item["idx"]] = batch_wav[i:i + 1, :mel_lens[i].item() * hop_length].cpu()
+            if verbose:
+                print(f"bucket {[item['idx'] for item in bucket]} wav lengths:",
+                      [mel_lens[i].item() * hop_length for i in range(batch_num)])
+
+        end_time = time.perf_counter()
+        self.torch_empty_cache()
+
+        # wav audio output
         self._set_gr_progress(0.9, "saving audio...")
+        wavs = [wav for wav in wavs if wav is not None]
         wavs = self.insert_interval_silence(wavs, sampling_rate=sampling_rate, interval_silence=interval_silence)
         wav = torch.cat(wavs, dim=1)
         wav_length = wav.shape[-1] / sampling_rate
@@ -586,12 +1283,13 @@ class IndexTTS2:
         print(f">> gpt_forward_time: {gpt_forward_time:.2f} seconds")
         print(f">> s2mel_time: {s2mel_time:.2f} seconds")
         print(f">> bigvgan_time: {bigvgan_time:.2f} seconds")
-        print(f">> Total inference time: {end_time - start_time:.2f} seconds")
+        print(f">> Total fast inference time: {end_time - start_time:.2f} seconds")
         print(f">> Generated audio length: {wav_length:.2f} seconds")
-        print(f">> RTF: {(end_time - start_time) / wav_length:.4f}")
+        print(f">> [fast] batch_num: {segments_count} bucket_max_size: {bucket_max_size}",
+              f"bucket_count: {bucket_count}" if bucket_max_size > 1 else "")
+        print(f">> [fast] RTF: {(end_time - start_time) / wav_length:.4f}")
 
         # save audio
-        wav = wav.cpu()  # to cpu
         if output_path:
             # 直接保存音频到指定路径中
             if os.path.isfile(output_path):
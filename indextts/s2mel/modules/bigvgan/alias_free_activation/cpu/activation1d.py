@@ -0,0 +1,161 @@
+import torch
+import torch.nn as nn
+from torch.nn import functional as F
+
+from ..torch.resample import UpSample1d, DownSample1d
+
+
+def polyphase_filter(up_filter, ratio, pad_left):
+    """
+    Rewrite the transposed convolution of `UpSample1d` as one correlation per output phase.
+
+    Output sample `ratio * q + s` of `UpSample1d` (after its cropping) is the correlation of the replicate-padded
+    input from `q + offset` on with `filters[s]`.
+
+    Returns: filters (ratio, width), offset
+    """
+    taps = up_filter.view(-1)
+    num_taps = taps.numel() // ratio  # taps of one phase
+    phases, offsets = [], []
+    for s in range(ratio):
+        a, r = divmod(pad_left + s, ratio)
+        # y[ratio * m + r] = ratio * sum_j x_padded[m - j] * f[ratio * j + r], flipped into a correlation
+        phases.append(ratio * taps[r::ratio].flip(0))
+        offsets.append(a - (num_taps - 1))
+    offset = min(offsets)
+    width = num_taps + max(offsets) - offset
+    filters = torch.zeros(ratio, width, dtype=taps.dtype)
+    for s, (phase, o) in enumerate(zip(phases, offsets)):
+        filters[s, o - offset:o - offset + num_taps] = phase
+    return filters, offset
+
+
+def anti_alias_plan(up_filter, up_ratio, up_pad_left, down_filter, down_ratio, down_pad_left):
+    """
+    Slices of `anti_alias_snake` for the filters of `UpSample1d` and `DownSample1d` (same ratio).
+
+    Returns (up, down, margin):
+        up: per phase of the upsampled signal, (start, tap) pairs on the replicate-padded input
+        down: (phase, start, tap) triples on the phases padded by `margin` samples on each side
+    """
+    if up_ratio != down_ratio:
+        raise ValueError("up_ratio and down_ratio must be equal")
+    filters, offset = polyphase_filter(up_filter, up_ratio, up_pad_left)
+    up = tuple(
+        tuple((offset + k, tap) for k, tap in enumerate(phase.tolist()) if tap != 0.0)
+        for phase in filters
+    )
+    down_taps = down_filter.view(-1).tolist()
+    margin = -(-len(down_taps) // down_ratio) + 1
+    down = []
+    for k, tap in enumerate(down_taps):
+        # sample ratio * t + k of the padded signal is sample ratio * (t + shift) + phase of the upsampled one
+        shift, phase = divmod(k - down_pad_left, down_ratio)
+        down.append((phase, margin + shift, tap))
+    return up, tuple(down), margin
+
+
+def anti_alias_snake(x, alpha, inv_beta, up_pad, up, down, margin):
+    """
+    Upsample -> x + inv_beta * sin^2(alpha * x) -> downsample on the phases of the upsampled signal: the filters
+    are unrolled into shifted slices (`anti_alias_plan`) so the whole op is elementwise and `torch.compile` fuses
+    it into a few loops without materializing the zero-stuffed / padded upsampled intermediates.
+
+    Args:
+        x: [B,C,T]
+        alpha, inv_beta: [1,C,1]
+        up_pad: replicate padding of the input (`UpSample1d.pad`)
+        up, down, margin: see `anti_alias_plan`
+    """
+    B, C, T = x.shape
+    xp = F.pad(x, (up_pad, up_pad), mode="replicate")
+    phases = []
+    for taps in up:
+        y = None
+        for start, tap in taps:
+            term = xp[..., start:start + T] * tap
+            y = term if y is None else y + term
+        phases.append(y + inv_beta * torch.sin(y * alpha).pow(2))
+
+    # the replicate padding of the upsampled signal is its first sample (phase 0) on the left and its last sample
+    # (last phase) on the right, for every phase
+    first = phases[0][..., :1].expand(B, C, margin)
+    last = phases[-1][..., -1:].expand(B, C, margin)
+    phases = [torch.cat([first, p, last], dim=-1) for p in phases]
+    out = None
+    for phase, start, tap in down:
+        term = phases[phase][..., start:start + T] * tap
+        out = term if out is None else out + term
+    return out
+
+
+_compiled = {}
+
+
+def compiled_anti_alias_snake(up_pad, up, down, margin):
+    """
+    `anti_alias_snake` compiled for one set of filters, shared by all activations using them. The slices and taps
+    are closed over rather than passed as arguments, so they are constants of the compiled loops.
+    """
+    key = (up_pad, up, down, margin)
+    if key not in _compiled:
+        def fn(x, alpha, inv_beta):
+            return anti_alias_snake(x, alpha, inv_beta, up_pad, up, down, margin)
+
+        # recompiled with dynamic sizes once a second shape is seen
+        _compiled[key] = torch.compile(fn)
+    return _compiled[key]
+
+
+class Activation1d(nn.Module):
+    """
+    `Activation1d` (upsample -> Snake/SnakeBeta -> downsample) for CPU, see `anti_alias_snake`.
+
+    The depthwise `conv_transpose1d` / strided `conv1d` of the torch version allocate the padded, zero-stuffed and
+    upsampled signals for every activation. Here the anti-aliasing filters, which are the same for all channels,
+    are applied as shifted slices on the phases of the upsampled signal, and with `compile=True` the op is
+    compiled (once per filter set) into fused loops.
+    The output equals the torch version up to float rounding, the parameters and buffers are the same.
+    """
+
+    def __init__(
+        self,
+        activation,
+        up_ratio: int = 2,
+        down_ratio: int = 2,
+        up_kernel_size: int = 12,
+        down_kernel_size: int = 12,
+        compile: bool = True,
+    ):
+        super().__init__()
+        if up_kernel_size % up_ratio != 0:
+            raise ValueError("up_kernel_size must be a multiple of up_ratio")
+        self.up_ratio = up_ratio
+        self.down_ratio = down_ratio
+        self.act = activation
+        self.upsample = UpSample1d(up_ratio, up_kernel_size)
+        self.downsample = DownSample1d(down_ratio, down_kernel_size)
+        self.compile = compile
+
+        # the filters are fixed (and identical to the checkpoint buffers), the plan holds them as python floats
+        self.plan = (self.upsample.pad,) + anti_alias_plan(
+            self.upsample.filter, up_ratio, self.upsample.pad_left,
+            self.downsample.lowpass.filter, down_ratio, self.downsample.lowpass.pad_left,
+        )
+
+    def _snake_params(self):
+        alpha = self.act.alpha.view(1, -1, 1)
+        # Snake uses the same parameter for the frequency and the magnitude
+        beta = self.act.beta.view(1, -1, 1) if hasattr(self.act, "beta") else alpha
+        if self.act.alpha_logscale:
+            alpha = torch.exp(alpha)
+            beta = torch.exp(beta)
+        return alpha, 1.0 / (beta + self.act.no_div_by_zero)
+
+    # x: [B,C,T]
+    def forward(self, x):
+        alpha, inv_beta = self._snake_params()
+        alpha, inv_beta = alpha.to(x.dtype), inv_beta.to(x.dtype)
+        if self.compile:
+            return compiled_anti_alias_snake(*self.plan)(x, alpha, inv_beta)
+        return anti_alias_snake(x, alpha, inv_beta, *self.plan)
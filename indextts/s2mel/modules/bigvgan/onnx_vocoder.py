@@ -0,0 +1,131 @@
+import hashlib
+import os
+
+import torch
+from huggingface_hub import hf_hub_download
+
+from .bigvgan import BigVGAN, load_hparams_from_json
+
+# bump when `export_onnx` changes the exported graph, so existing exports are redone
+EXPORT_VERSION = 1
+# ONNX metadata entry holding the `export_key` of the export
+EXPORT_KEY_PROP = "indextts_export_key"
+
+
+def pretrained_files(model_id):
+    """Local paths of the config and the generator checkpoint of a pretrained BigVGAN, as `BigVGAN.from_pretrained`."""
+    if os.path.isdir(model_id):
+        return os.path.join(model_id, "config.json"), os.path.join(model_id, "bigvgan_generator.pt")
+    return (hf_hub_download(repo_id=model_id, filename="config.json"),
+            hf_hub_download(repo_id=model_id, filename="bigvgan_generator.pt"))
+
+
+def export_key(config_file, checkpoint_file):
+    """
+    Identity of the export of a BigVGAN checkpoint: `EXPORT_VERSION`, the config and the checkpoint file.
+    The checkpoint is identified by its resolved path, size and modification time, hashing its content on every
+    start would cost about as much as loading it.
+    """
+    stat = os.stat(checkpoint_file)
+    digest = hashlib.sha256(
+        f"{EXPORT_VERSION}:{os.path.realpath(checkpoint_file)}:{stat.st_size}:{stat.st_mtime_ns}:".encode())
+    with open(config_file, "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def export_onnx(vocoder, path, opset_version=17, key=None):
+    """
+    Export a BigVGAN to ONNX with a dynamic batch and time axis: "mel" (B, num_mels, frames) -> "wav" (B, 1, samples).
+
+    The vocoder must use the torch anti-aliased activations (`use_cuda_kernel=False`, `use_cpu_kernel=False`) and have
+    its weight norm removed, the export is traced on CPU in float32.
+    `key` (see `export_key`) is stored in the metadata of the model (requires the onnx package), `OnnxVocoder.key`.
+    """
+    if vocoder.h.get("use_cuda_kernel", False) or vocoder.h.get("use_cpu_kernel", False):
+        raise ValueError("BigVGAN with fused activations can not be exported, "
+                         "load it with use_cuda_kernel=False and use_cpu_kernel=False")
+    vocoder = vocoder.float().cpu().eval()
+    if os.path.dirname(path) != "":
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # export to a temporary file first, so an interrupted export never leaves a broken model behind
+    tmp_path = f"{path}.tmp"
+    mel = torch.randn(1, vocoder.h.num_mels, 100)
+    with torch.no_grad():
+        torch.onnx.export(
+            vocoder,
+            (mel,),
+            tmp_path,
+            input_names=["mel"],
+            output_names=["wav"],
+            dynamic_axes={"mel": {0: "batch", 2: "frames"}, "wav": {0: "batch", 2: "samples"}},
+            opset_version=opset_version,
+            dynamo=False,
+        )
+    if key is not None:
+        import onnx
+
+        model = onnx.load(tmp_path)
+        onnx.helper.set_model_props(model, {EXPORT_KEY_PROP: key})
+        onnx.save(model, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_onnx_vocoder(model_id, path, num_threads=None):
+    """
+    `OnnxVocoder` of the pretrained BigVGAN `model_id` (a hub id or a local directory), exported to `path`.
+
+    The export is (re)done when `path` is missing or was made from another checkpoint, config or `EXPORT_VERSION`
+    (its key differs from `export_key`). A valid export only reads the config, the torch BigVGAN is not loaded.
+    Returns:
+        (vocoder, exported), `exported` is True if the model was exported by this call
+    """
+    config_file, checkpoint_file = pretrained_files(model_id)
+    key = export_key(config_file, checkpoint_file)
+    h = load_hparams_from_json(config_file)
+    if os.path.isfile(path):
+        vocoder = OnnxVocoder(path, h, num_threads=num_threads)
+        if vocoder.key == key:
+            return vocoder, False
+        del vocoder
+    torch_vocoder = BigVGAN.from_pretrained(model_id, use_cuda_kernel=False)
+    torch_vocoder.remove_weight_norm()
+    export_onnx(torch_vocoder, path, key=key)
+    del torch_vocoder
+    return OnnxVocoder(path, h, num_threads=num_threads), True
+
+
+class OnnxVocoder:
+    """
+    BigVGAN exported with `export_onnx`, run by ONNX Runtime on CPU.
+
+    Called like `BigVGAN`: takes a mel tensor (B, num_mels, frames) and returns the waveform (B, 1, samples)
+    as a float32 tensor on the device of the mel, so it can replace `IndexTTS2.bigvgan` (also in `StreamingVocoder`).
+    """
+
+    def __init__(self, path, h, num_threads=None):
+        """
+        Args:
+            path: ONNX model from `export_onnx`
+            h: hyperparameters of the exported BigVGAN (`BigVGAN.h`)
+            num_threads: intra-op threads of ONNX Runtime, None for its default (one per physical core)
+        """
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("vocoder_backend='onnxruntime' requires the onnxruntime package, "
+                              "install it with `pip install onnxruntime`") from e
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.path = path
+        self.h = h
+        # `export_key` the model was exported with, None if it has none
+        self.key = self.session.get_modelmeta().custom_metadata_map.get(EXPORT_KEY_PROP)
+
+    def __call__(self, mel):
+        wav = self.session.run(["wav"], {"mel": mel.detach().float().cpu().numpy()})[0]
+        return torch.from_numpy(wav).to(mel.device)
@@ -0,0 +1,85 @@
+import torch
+
+
+class StreamingVocoder:
+    """
+    Chunked BigVGAN vocoding of a mel that arrives (or is consumed) piece by piece.
+
+    Each chunk of frames is vocoded together with `left_context` frames before and `right_context`
+    frames after it, and only the samples of the chunk itself are kept. With contexts covering the
+    receptive field of the vocoder the chunks join into the waveform of a one-shot `vocoder(mel)` call
+    (up to float rounding, see `tests/bigvgan_streaming_test.py`), while at most
+    left_context + chunk + right_context frames go through the vocoder at a time.
+
+    Usage:
+        stream = StreamingVocoder(bigvgan)
+        for mel_chunk in mel_chunks:
+            for wav in stream.push(mel_chunk):
+                ...
+        for wav in stream.flush():
+            ...
+    or `for wav in stream.stream(mel)` for a mel that is already complete.
+    """
+
+    def __init__(self, vocoder, chunk_frames=64, left_context=32, right_context=32):
+        """
+        Args:
+            vocoder: BigVGAN, (B, num_mels, frames) -> (B, 1, frames * hop_size)
+            chunk_frames: frames vocoded (and samples emitted) per step, the last one can be shorter
+            left_context, right_context: frames of context on each side of a chunk
+        """
+        self.vocoder = vocoder
+        self.hop_size = vocoder.h.hop_size if hasattr(vocoder, "h") else 256
+        self.chunk_frames = chunk_frames
+        self.left_context = left_context
+        self.right_context = right_context
+        self.reset()
+
+    def reset(self):
+        self._mel = None  # buffered frames, from `_mel_start` on
+        self._mel_start = 0
+        self._emitted = 0  # frames whose samples were returned
+        self._total = 0  # frames pushed
+
+    @torch.inference_mode()
+    def _vocode(self, end):
+        """Samples of frames [_emitted, end), the buffer must hold the contexts around them."""
+        start = self._emitted
+        left = max(start - self.left_context, self._mel_start)
+        right = min(end + self.right_context, self._total)
+        mel = self._mel[:, :, left - self._mel_start:right - self._mel_start]
+        wav = self.vocoder(mel)
+        offset = (start - left) * self.hop_size
+        wav = wav[..., offset:offset + (end - start) * self.hop_size]
+        self._emitted = end
+        # drop the frames no later chunk needs as left context
+        keep_from = max(self._emitted - self.left_context, self._mel_start)
+        self._mel = self._mel[:, :, keep_from - self._mel_start:]
+        self._mel_start = keep_from
+        return wav
+
+    def push(self, mel):
+        """
+        Add mel frames (B, num_mels, n), returns the list of waveform chunks (B, 1, samples) that
+        became final, i.e. whose right context is available.
+        """
+        self._mel = mel if self._mel is None else torch.cat([self._mel, mel], dim=-1)
+        self._total += mel.size(-1)
+        wavs = []
+        while self._total - self.right_context - self._emitted >= self.chunk_frames:
+            wavs.append(self._vocode(self._emitted + self.chunk_frames))
+        return wavs
+
+    def flush(self):
+        """Waveform chunks of the remaining frames, at the end of the mel (no more right context)."""
+        wavs = []
+        while self._emitted < self._total:
+            wavs.append(self._vocode(min(self._emitted + self.chunk_frames, self._total)))
+        self.reset()
+        return wavs
+
+    def stream(self, mel):
+        """Generator of the waveform chunks of a complete mel (B, num_mels, frames)."""
+        for i in range(0, mel.size(-1), self.chunk_frames):
+            yield from self.push(mel[:, :, i:i + self.chunk_frames])
+        yield from self.flush()
@@ -0,0 +1,107 @@
+import bisect
+import time
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+
+class BucketedEstimator(nn.Module):
+    """
+    Fixed-shape wrapper of the CFM estimator (`DiT`) for `torch.compile`.
+
+    Every call pads the mel length up to the next of a few length buckets, so the compiled transformer
+    (CUDA graphs with "reduce-overhead" on CUDA) only sees one shape per (batch size, bucket) and the
+    25 x 2 calls of a segment replay the same graph. Padded frames are masked out of the attention and
+    cut from its output. The final layers (reflect-padded wavenet convolutions, which would see the
+    padding) run eagerly on the real length, so the result does not change.
+    Lengths above the largest bucket run the eager estimator.
+    """
+
+    def __init__(self, estimator, buckets=(256, 384, 512, 768, 1024, 1536, 2048, 3072, 4096), compile=True):
+        """
+        Args:
+            estimator: DiT, after `setup_caches`
+            buckets: padded mel lengths, at most `max_seq_length` of `setup_caches` (minus style/time tokens)
+            compile: compile the estimator with `torch.compile`, False only pads (for checking)
+        """
+        super().__init__()
+        self.estimator = estimator
+        self.buckets = sorted(buckets)
+        self.compile = compile
+        self._compiled = None
+
+    def setup_caches(self, max_batch_size, max_seq_length):
+        self.estimator.setup_caches(max_batch_size, max_seq_length)
+
+    def prepare_context(self, prompt_x, x_lens, style, cond):
+        return self.estimator.prepare_context(prompt_x, x_lens, style, cond)
+
+    def bucket_length(self, length):
+        i = bisect.bisect_left(self.buckets, length)
+        return self.buckets[i] if i < len(self.buckets) else None
+
+    def _compiled_transformer(self, device):
+        if self._compiled is None:
+            mode = "reduce-overhead" if torch.device(device).type == "cuda" else None
+            # one graph per (batch size, bucket), the default limit of 8 would fall back to eager
+            torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 64)
+            self._compiled = torch.compile(self.estimator.forward_transformer, mode=mode, fullgraph=True,
+                                           dynamic=False)
+        return self._compiled
+
+    @staticmethod
+    def _pad_context(context, pad):
+        padded = dict(context)
+        padded["cond_x"] = F.pad(context["cond_x"], (0, 0, 0, pad))
+        # padded frames are not valid keys
+        padded["x_mask"] = F.pad(context["x_mask"], (0, pad), value=False)
+        if "attn_mask" in context:
+            padded["attn_mask"] = F.pad(context["attn_mask"], (0, pad), value=False)
+        return padded
+
+    def forward(self, x, prompt_x, x_lens, t, style, cond, context=None):
+        """Same arguments and output as `DiT.forward` at inference."""
+        T = x.size(-1)
+        bucket = self.bucket_length(T)
+        if bucket is None or self.estimator.training:
+            return self.estimator(x, prompt_x, x_lens, t, style, cond, context=context)
+        if context is None:
+            context = self.estimator.prepare_context(prompt_x, x_lens, style, cond)
+        pad = bucket - T
+        padded_x, padded_context = x, context
+        if pad > 0:
+            padded_x = F.pad(x, (0, pad))
+            padded_context = self._pad_context(context, pad)
+        transformer = self._compiled_transformer(x.device) if self.compile else self.estimator.forward_transformer
+        x_res, t1 = transformer(padded_x, t, padded_context)
+        # a slice of the CUDA graph output, copied before the next replay overwrites it
+        x_res = x_res[:, :T].clone()
+        return self.estimator.forward_head(x_res, x, t, t1.clone(), context["x_mask"])
+
+    @torch.inference_mode()
+    def warmup(self, batch_sizes=(1, 2), style_dim=192, dtype=torch.float32, device=None):
+        """
+        Run (and compile) every bucket once for the given estimator batch sizes: 2 * segments for a guided
+        evaluation, segments alone for a cond-only one (outside `cfg_interval`, or reusing the null prediction).
+        Returns the seconds spent per (batch size, bucket).
+        """
+        device = device or next(self.estimator.parameters()).device
+        in_channels = self.estimator.in_channels
+        timings = {}
+        for batch_size in batch_sizes:
+            for bucket in self.buckets:
+                start_time = time.perf_counter()
+                x = torch.randn(batch_size, in_channels, bucket, dtype=dtype, device=device)
+                prompt_x = torch.zeros_like(x)
+                x_lens = torch.full((batch_size,), bucket, dtype=torch.long, device=device)
+                style = torch.zeros(batch_size, style_dim, dtype=dtype, device=device)
+                cond = torch.zeros(batch_size, bucket, self.estimator.content_dim, dtype=dtype, device=device)
+                t = torch.zeros(batch_size, dtype=dtype, device=device)
+                # twice: CUDA graphs are recorded on the second call of a shape
+                for _ in range(2):
+                    self(x, prompt_x, x_lens, t, style, cond)
+                if torch.device(device).type == "cuda":
+                    torch.cuda.synchronize(device)
+                timings[(batch_size, bucket)] = time.perf_counter() - start_time
+        return timings
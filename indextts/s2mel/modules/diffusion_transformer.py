@@ -1,5 +1,6 @@
 import torch
 from torch import nn
+import torch.nn.functional as F
 import math
 
 from indextts.s2mel.modules.gpt_fast.model import ModelArgs, Transformer
@@ -182,8 +183,32 @@ class DiT(torch.nn.Module):
 
     def setup_caches(self, max_batch_size, max_seq_length):
         self.transformer.setup_caches(max_batch_size, max_seq_length, use_kv_cache=False)
-        
-    def forward(self, x, prompt_x, x_lens, t, style, cond, mask_content=False):
+
+    def prepare_context(self, prompt_x, x_lens, style, cond):
+        """
+        Inputs of `forward` that do not depend on x or t, computed once for all diffusion steps:
+        the prompt/cond/style share of `cond_x_merge_linear` (and its bias) and the masks.
+        Args: see `forward`
+        Returns:
+            dict of batch-first tensors, rows can be sliced to get the context of a sub-batch
+        """
+        B, _, T = prompt_x.size()
+        feats = [prompt_x.transpose(1, 2), self.cond_projection(cond)]
+        if self.transformer_style_condition and not self.style_as_token:
+            feats.append(style[:, None, :].expand(B, T, -1))
+        # cond_x_merge_linear(cat([x, prompt_x, cond, style])) = x @ W_x^T + (cat([prompt_x, cond, style]) @ W_c^T + b)
+        cond_x = F.linear(torch.cat(feats, dim=-1), self.cond_x_merge_linear.weight[:, self.in_channels:],
+                          self.cond_x_merge_linear.bias)
+        x_mask = sequence_mask(x_lens + self.style_as_token + self.time_as_token).to(prompt_x.device).unsqueeze(1)
+        context = {"cond_x": cond_x, "x_mask": x_mask}
+        if self.style_as_token:
+            context["style_token"] = self.style_in(style).unsqueeze(1)
+        if not self.is_causal:
+            # (B, 1, 1, L), broadcast over the queries by scaled_dot_product_attention instead of a (B, 1, L, L) copy
+            context["attn_mask"] = x_mask[:, None, :]
+        return context
+
+    def forward(self, x, prompt_x, x_lens, t, style, cond, mask_content=False, context=None):
         """
             x (torch.Tensor): random noise
             prompt_x (torch.Tensor): reference mel + zero mel
@@ -196,8 +221,12 @@ class DiT(torch.nn.Module):
                 shape: (batch_size, 192)
             cond (torch.Tensor): semantic info of reference audio and altered audio
                 shape: (batch_size, mel_timesteps(795+1069), 512)
+            context (dict, optional): `prepare_context(prompt_x, x_lens, style, cond)`, prompt_x, x_lens, style
+                and cond are not used when given (inference only)
         
         """
+        if context is not None and not self.training and not mask_content:
+            return self._forward_with_context(x, t, context)
         class_dropout = False
         if self.training and torch.rand(1) < self.class_dropout_prob:
             class_dropout = True
@@ -244,7 +273,7 @@ class DiT(torch.nn.Module):
             x_res = self.skip_linear(torch.cat([x_res, x], dim=-1))
         if self.final_layer_type == 'wavenet':
             x = self.conv1(x_res)
-            x = x.transpose(1, 2)
+            x = x.transpose(1, 2) * x_mask  # keep padded frames of a batch out of the convolutions
             t2 = self.t_embedder2(t)
             x = self.wavenet(x, x_mask, g=t2.unsqueeze(2)).transpose(1, 2) + self.res_projection(
                 x_res)  # long residual connection
@@ -255,3 +284,40 @@ class DiT(torch.nn.Module):
             x = x.transpose(1, 2)
         # x [2,80,1863]
         return x
+
+    def _forward_with_context(self, x, t, context):
+        """`forward` of the noisy mel and timestep only, the rest comes from `prepare_context`."""
+        x_res, t1 = self.forward_transformer(x, t, context)
+        return self.forward_head(x_res, x, t, t1, context["x_mask"])
+
+    def forward_transformer(self, x, t, context):
+        """Transformer part of `forward` with a `prepare_context` context, returns (x_res, t1)."""
+        t1 = self.t_embedder(t)
+        x = x.transpose(1, 2)
+        x_in = F.linear(x, self.cond_x_merge_linear.weight[:, :self.in_channels]) + context["cond_x"]
+        if self.style_as_token:
+            x_in = torch.cat([context["style_token"], x_in], dim=1)
+        if self.time_as_token:
+            x_in = torch.cat([t1.unsqueeze(1), x_in], dim=1)
+        input_pos = self.input_pos[:x_in.size(1)]
+        x_res = self.transformer(x_in, t1.unsqueeze(1), input_pos, context.get("attn_mask"))
+        x_res = x_res[:, 1:] if self.time_as_token else x_res
+        x_res = x_res[:, 1:] if self.style_as_token else x_res
+        return x_res, t1
+
+    def forward_head(self, x_res, x, t, t1, x_mask):
+        """Long skip connection and final layers of `forward`, x (B, C, T) is the noisy mel."""
+        x = x.transpose(1, 2)
+        if self.long_skip_connection:
+            x_res = self.skip_linear(torch.cat([x_res, x], dim=-1))
+        if self.final_layer_type == 'wavenet':
+            x = self.conv1(x_res)
+            x = x.transpose(1, 2) * x_mask
+            t2 = self.t_embedder2(t)
+            x = self.wavenet(x, x_mask, g=t2.unsqueeze(2)).transpose(1, 2) + self.res_projection(x_res)
+            x = self.final_layer(x, t1).transpose(1, 2)
+            x = self.conv2(x)
+        else:
+            x = self.final_mlp(x_res)
+            x = x.transpose(1, 2)
+        return x
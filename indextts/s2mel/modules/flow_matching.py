@@ -1,3 +1,4 @@
+import time
 from abc import ABC
 
 import torch
@@ -8,6 +9,92 @@ from indextts.s2mel.modules.commons import sequence_mask
 
 from tqdm import tqdm
 
+
+def linear_t_span(n_timesteps, device=None):
+    return torch.linspace(0, 1, n_timesteps + 1, device=device)
+
+
+def cosine_t_span(n_timesteps, device=None):
+    """Denser steps near t=0, where the flow changes fastest: t' = 1 - cos(pi / 2 * t)."""
+    t_span = linear_t_span(n_timesteps, device)
+    return t_span + (-1) * (torch.cos(torch.pi / 2 * t_span) - 1 + t_span)
+
+
+def sway_t_span(n_timesteps, device=None, coef=-0.5):
+    """Sway sampling, t' = t + coef * (cos(pi / 2 * t) - 1 + t); coef=-1 is the cosine schedule."""
+    t_span = linear_t_span(n_timesteps, device)
+    return t_span + coef * (torch.cos(torch.pi / 2 * t_span) - 1 + t_span)
+
+
+# timestep schedules of `CFM.inference`, name -> fn(n_timesteps, device) returning (n_timesteps + 1,) in [0, 1]
+T_SCHEDULES = {
+    "linear": linear_t_span,
+    "cosine": cosine_t_span,
+    "sway": sway_t_span,
+}
+
+# ODE solvers of `CFM.inference`, name -> (method of BASECFM, estimator calls per step)
+SOLVERS = {
+    "euler": ("solve_euler", 1),
+    "midpoint": ("solve_midpoint", 2),
+    "heun": ("solve_heun", 2),
+    "multistep": ("solve_multistep", 1),
+}
+
+
+class CFGSchedule:
+    """
+    When and how classifier-free guidance is evaluated during one `CFM.inference` call.
+
+    A guided evaluation doubles the estimator batch (conditional + null inputs). To make it cheaper:
+      interval: (t_start, t_end), guidance is only applied for t_start <= t <= t_end, outside of it the
+          conditional prediction alone is used. None guides every step.
+      reuse_steps: compute the null prediction on every `reuse_steps`-th guided evaluation only and reuse
+          the last one in between (conditional batch only). 1 recomputes it every time.
+    Per-evaluation statistics are collected in `records` and summarized by `stats()`.
+    `context` holds the step-invariant estimator inputs of the call (see `DiT.prepare_context`), built on
+    the first evaluation for the stacked conditional + null batch when guidance is on.
+    """
+
+    def __init__(self, inference_cfg_rate, interval=None, reuse_steps=1):
+        if reuse_steps < 1:
+            raise ValueError(f"reuse_steps must be >= 1, got {reuse_steps}")
+        self.rate = inference_cfg_rate
+        self.interval = tuple(interval) if interval is not None else None
+        self.reuse_steps = reuse_steps
+        self.null_dphi_dt = None
+        self.guided_evals = 0
+        self.records = []
+        self.context = None
+
+    def mode(self, t):
+        """"cond" (conditional only), "cfg" (conditional + null batch) or "reuse" (cached null prediction)."""
+        if self.rate <= 0:
+            return "cond"
+        if self.interval is not None and not (self.interval[0] <= float(t) <= self.interval[1]):
+            return "cond"
+        if self.null_dphi_dt is not None and self.guided_evals % self.reuse_steps != 0:
+            return "reuse"
+        return "cfg"
+
+    def record(self, t, mode, rows, seconds):
+        if mode != "cond":
+            self.guided_evals += 1
+        self.records.append({"t": float(t), "mode": mode, "rows": rows, "time": seconds})
+
+    def stats(self):
+        modes = [r["mode"] for r in self.records]
+        return {
+            "estimator_calls": len(self.records),
+            "estimator_rows": sum(r["rows"] for r in self.records),
+            "cfg_evals": modes.count("cfg"),
+            "reuse_evals": modes.count("reuse"),
+            "cond_evals": modes.count("cond"),
+            "estimator_time": sum(r["time"] for r in self.records),
+            "steps": self.records,
+        }
+
+
 class BASECFM(torch.nn.Module, ABC):
     def __init__(
         self,
@@ -28,7 +115,9 @@ class BASECFM(torch.nn.Module, ABC):
             self.zero_prompt_speech_token = False
 
     @torch.inference_mode()
-    def inference(self, mu, x_lens, prompt, style, f0, n_timesteps, temperature=1.0, inference_cfg_rate=0.5):
+    def inference(self, mu, x_lens, prompt, style, f0, n_timesteps, temperature=1.0, inference_cfg_rate=0.5,
+                  solver="euler", t_schedule="linear", cfg_interval=None, cfg_reuse_steps=1, z=None,
+                  generator=None, return_stats=False):
         """Forward diffusion
 
         Args:
@@ -43,18 +132,175 @@ class BASECFM(torch.nn.Module, ABC):
             f0: None
             n_timesteps (int): number of diffusion steps
             temperature (float, optional): temperature for scaling noise. Defaults to 1.0.
+            solver (str): ODE solver, one of `SOLVERS`. "midpoint" and "heun" call the estimator twice per step.
+            t_schedule (str): timestep schedule, one of `T_SCHEDULES`.
+            cfg_interval (tuple, optional): (t_start, t_end) to apply classifier-free guidance in, see `CFGSchedule`.
+            cfg_reuse_steps (int): recompute the null (unconditional) prediction every `cfg_reuse_steps`
+                guided evaluations, see `CFGSchedule`.
+            z (torch.Tensor, optional): initial noise (batch_size, 80, mel_timesteps), drawn if None
+            generator (torch.Generator, optional): generator the noise is drawn from, the global RNG if None
+            return_stats (bool): also return the estimator calls of this call, see `CFGSchedule.stats()`
 
         Returns:
             sample: generated mel-spectrogram
                 shape: (batch_size, 80, mel_timesteps)
+            stats (dict): if `return_stats`, `CFGSchedule.stats()` with solver, t_schedule and n_timesteps
         """
         B, T = mu.size(0), mu.size(1)
-        z = torch.randn([B, self.in_channels, T], device=mu.device) * temperature
-        t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device)
-        # t_span = t_span + (-1) * (torch.cos(torch.pi / 2 * t_span) - 1 + t_span)
-        return self.solve_euler(z, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate)
+        if z is None:
+            z = torch.randn([B, self.in_channels, T], device=mu.device, generator=generator) * temperature
+        if solver not in SOLVERS:
+            raise ValueError(f"Unknown solver '{solver}', expected one of {list(SOLVERS)}")
+        if t_schedule not in T_SCHEDULES:
+            raise ValueError(f"Unknown t_schedule '{t_schedule}', expected one of {list(T_SCHEDULES)}")
+        t_span = T_SCHEDULES[t_schedule](n_timesteps, device=mu.device)
+        solve = getattr(self, SOLVERS[solver][0])
+        guidance = CFGSchedule(inference_cfg_rate, interval=cfg_interval, reuse_steps=cfg_reuse_steps)
+        out = solve(z, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate, guidance=guidance)
+        if return_stats:
+            return out, dict(guidance.stats(), solver=solver, t_schedule=t_schedule, n_timesteps=n_timesteps)
+        return out
+
+    @torch.inference_mode()
+    def inference_windowed(self, mu, x_lens, prompt, style, f0, n_timesteps, window_size, window_overlap=64,
+                           return_stats=False, **kwargs):
+        """
+        `inference` over overlapping windows of the target frames, each prefixed with the prompt, so the
+        estimator never sees more than prompt + `window_size` frames whatever the segment length.
+        Overlapping frames of neighbouring windows are linearly cross-faded.
+
+        Args:
+            see `inference`, and
+            window_size (int): target frames per window
+            window_overlap (int): frames shared by neighbouring windows, less than `window_size`
+            return_stats (bool): also return the stats of `inference` summed over the windows, with `windows`
+            kwargs: temperature, inference_cfg_rate, solver, generator, ... of `inference`
+        Returns:
+            same as `inference`, the prompt frames come from the first window
+        """
+        if not 0 <= window_overlap < window_size:
+            raise ValueError(f"window_overlap must be in [0, {window_size}), got {window_overlap}")
+        prompt_len = prompt.size(-1)
+        target_len = mu.size(1) - prompt_len
+        if target_len <= window_size:
+            return self.inference(mu, x_lens, prompt, style, f0, n_timesteps, return_stats=return_stats, **kwargs)
+
+        hop = window_size - window_overlap
+        starts = list(range(0, target_len - window_overlap, hop))
+        B = mu.size(0)
+        # one noise draw for the whole segment: overlapping frames of neighbouring windows start the same
+        temperature = kwargs.pop("temperature", 1.0)
+        generator = kwargs.pop("generator", None)
+        z = torch.randn([B, self.in_channels, prompt_len + target_len], device=mu.device,
+                        generator=generator) * temperature
+        out = torch.zeros(B, self.in_channels, prompt_len + target_len, device=mu.device, dtype=mu.dtype)
+        weight = torch.zeros(prompt_len + target_len, device=mu.device, dtype=mu.dtype)
+        window_stats = []
+        for i, start in enumerate(starts):
+            end = min(start + window_size, target_len)
+            mu_w = torch.cat([mu[:, :prompt_len], mu[:, prompt_len + start:prompt_len + end]], dim=1)
+            # rows of a padded batch keep their own length
+            lens_w = prompt_len + (x_lens - prompt_len - start).clamp(0, end - start)
+            z_w = torch.cat([z[:, :, :prompt_len], z[:, :, prompt_len + start:prompt_len + end]], dim=-1)
+            y, stats = self.inference(mu_w, lens_w, prompt, style, f0, n_timesteps, z=z_w, return_stats=True,
+                                      **kwargs)
+            window_stats.append(stats)
+            # linear fade in over the overlap with the previous window, fade out over the next one
+            w = torch.ones(end - start, device=mu.device, dtype=mu.dtype)
+            fade = torch.linspace(0, 1, window_overlap + 2, device=mu.device, dtype=mu.dtype)[1:-1]
+            if i > 0 and window_overlap > 0:
+                w[:window_overlap] = fade
+            if i < len(starts) - 1 and window_overlap > 0:
+                w[-window_overlap:] = w[-window_overlap:] * fade.flip(0)
+            out[:, :, prompt_len + start:prompt_len + end] += y[:, :, prompt_len:] * w
+            weight[prompt_len + start:prompt_len + end] += w
+            if i == 0:
+                out[:, :, :prompt_len] = y[:, :, :prompt_len]
+                weight[:prompt_len] = 1
+        out = out / weight
+        if not return_stats:
+            return out
+        stats = dict(window_stats[0])
+        for key in ("estimator_calls", "estimator_rows", "cfg_evals", "reuse_evals", "cond_evals", "estimator_time"):
+            stats[key] = sum(s[key] for s in window_stats)
+        stats["steps"] = [step for s in window_stats for step in s["steps"]]
+        stats["windows"] = len(window_stats)
+        return out, stats
+
+    def _prepare_prompt(self, x, prompt, mu):
+        """Zero the prompt part of the noise (and of mu), return the prompt mel in a tensor shaped like x."""
+        prompt_len = prompt.size(-1)
+        prompt_x = torch.zeros_like(x)
+        prompt_x[..., :prompt_len] = prompt[..., :prompt_len]
+        x[..., :prompt_len] = 0
+        if self.zero_prompt_speech_token:
+            mu[..., :prompt_len] = 0
+        return prompt_x
+
+    def _velocity(self, x, t, x_lens, prompt_x, style, mu, inference_cfg_rate, guidance=None):
+        """
+        Estimated dphi/dt at time t (0-dim tensor), with classifier-free guidance if inference_cfg_rate > 0.
+        `guidance` (CFGSchedule) decides whether this evaluation is guided and records it, None guides it.
+        """
+        mode = guidance.mode(t) if guidance is not None else ("cfg" if inference_cfg_rate > 0 else "cond")
+        start_time = time.perf_counter()
+        context = self._estimator_context(guidance, x_lens, prompt_x, style, mu, inference_cfg_rate)
+        if context is not None:
+            # prompt_x, x_lens, style and mu are already in the context
+            if mode == "cfg":
+                dphi_dt, cfg_dphi_dt = self.estimator(torch.cat([x, x], dim=0), None, None, t.repeat(2 * x.size(0)),
+                                                      None, None, context=context).chunk(2, dim=0)
+                guidance.null_dphi_dt = cfg_dphi_dt
+            else:
+                # the conditional rows come first in a stacked context
+                context = {k: v[:x.size(0)] for k, v in context.items()}
+                dphi_dt = self.estimator(x, None, None, t.repeat(x.size(0)), None, None, context=context)
+                if mode == "reuse":
+                    cfg_dphi_dt = guidance.null_dphi_dt
+        elif mode == "cfg":
+            # Stack original and CFG (null) inputs for batched processing
+            stacked_prompt_x = torch.cat([prompt_x, torch.zeros_like(prompt_x)], dim=0)
+            stacked_style = torch.cat([style, torch.zeros_like(style)], dim=0)
+            stacked_mu = torch.cat([mu, torch.zeros_like(mu)], dim=0)
+            stacked_x = torch.cat([x, x], dim=0)
+            stacked_t = t.repeat(stacked_x.size(0))
+            stacked_x_lens = torch.cat([x_lens, x_lens], dim=0)
+
+            # Perform a single forward pass for both original and CFG inputs
+            stacked_dphi_dt = self.estimator(
+                stacked_x, stacked_prompt_x, stacked_x_lens, stacked_t, stacked_style, stacked_mu,
+            )
 
-    def solve_euler(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5):
+            # Split the output back into the original and CFG components
+            dphi_dt, cfg_dphi_dt = stacked_dphi_dt.chunk(2, dim=0)
+
+            if guidance is not None:
+                guidance.null_dphi_dt = cfg_dphi_dt
+        else:
+            dphi_dt = self.estimator(x, prompt_x, x_lens, t.repeat(x.size(0)), style, mu)
+            if mode == "reuse":
+                cfg_dphi_dt = guidance.null_dphi_dt
+        if guidance is not None:
+            guidance.record(t, mode, x.size(0) * (2 if mode == "cfg" else 1), time.perf_counter() - start_time)
+        if mode == "cond":
+            return dphi_dt
+        # Apply CFG formula
+        return (1.0 + inference_cfg_rate) * dphi_dt - inference_cfg_rate * cfg_dphi_dt
+
+    def _estimator_context(self, guidance, x_lens, prompt_x, style, mu, inference_cfg_rate):
+        """Step-invariant estimator inputs of this inference call, cached on `guidance`; None if unsupported."""
+        if guidance is None or not hasattr(self.estimator, "prepare_context"):
+            return None
+        if guidance.context is None:
+            if inference_cfg_rate > 0:
+                prompt_x = torch.cat([prompt_x, torch.zeros_like(prompt_x)], dim=0)
+                style = torch.cat([style, torch.zeros_like(style)], dim=0)
+                mu = torch.cat([mu, torch.zeros_like(mu)], dim=0)
+                x_lens = torch.cat([x_lens, x_lens], dim=0)
+            guidance.context = self.estimator.prepare_context(prompt_x, x_lens, style, mu)
+        return guidance.context
+
+    def solve_euler(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5, guidance=None):
         """
         Fixed euler solver for ODEs.
         Args:
@@ -69,6 +315,7 @@ class BASECFM(torch.nn.Module, ABC):
                 shape: (batch_size, 80, 795)
             style (torch.Tensor): reference global style
                 shape: (batch_size, 192)
+            guidance (CFGSchedule, optional): classifier-free guidance schedule, guides every step if None
         """
         t, _, _ = t_span[0], t_span[-1], t_span[1] - t_span[0]
 
@@ -77,33 +324,10 @@ class BASECFM(torch.nn.Module, ABC):
         sol = []
         # apply prompt
         prompt_len = prompt.size(-1)
-        prompt_x = torch.zeros_like(x)
-        prompt_x[..., :prompt_len] = prompt[..., :prompt_len]
-        x[..., :prompt_len] = 0
-        if self.zero_prompt_speech_token:
-            mu[..., :prompt_len] = 0
+        prompt_x = self._prepare_prompt(x, prompt, mu)
         for step in tqdm(range(1, len(t_span))):
             dt = t_span[step] - t_span[step - 1]
-            if inference_cfg_rate > 0:
-                # Stack original and CFG (null) inputs for batched processing
-                stacked_prompt_x = torch.cat([prompt_x, torch.zeros_like(prompt_x)], dim=0)
-                stacked_style = torch.cat([style, torch.zeros_like(style)], dim=0)
-                stacked_mu = torch.cat([mu, torch.zeros_like(mu)], dim=0)
-                stacked_x = torch.cat([x, x], dim=0)
-                stacked_t = torch.cat([t.unsqueeze(0), t.unsqueeze(0)], dim=0)
-
-                # Perform a single forward pass for both original and CFG inputs
-                stacked_dphi_dt = self.estimator(
-                    stacked_x, stacked_prompt_x, x_lens, stacked_t, stacked_style, stacked_mu,
-                )
-
-                # Split the output back into the original and CFG components
-                dphi_dt, cfg_dphi_dt = stacked_dphi_dt.chunk(2, dim=0)
-
-                # Apply CFG formula
-                dphi_dt = (1.0 + inference_cfg_rate) * dphi_dt - inference_cfg_rate * cfg_dphi_dt
-            else:
-                dphi_dt = self.estimator(x, prompt_x, x_lens, t.unsqueeze(0), style, mu)
+            dphi_dt = self._velocity(x, t, x_lens, prompt_x, style, mu, inference_cfg_rate, guidance)
 
             x = x + dt * dphi_dt
             t = t + dt
@@ -113,6 +337,62 @@ class BASECFM(torch.nn.Module, ABC):
             x[:, :, :prompt_len] = 0
 
         return sol[-1]
+
+    def solve_midpoint(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5, guidance=None):
+        """
+        Explicit midpoint (second order Runge-Kutta) solver, two estimator calls per step.
+        Args: see `solve_euler`
+        """
+        prompt_len = prompt.size(-1)
+        prompt_x = self._prepare_prompt(x, prompt, mu)
+        for step in tqdm(range(1, len(t_span))):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            k1 = self._velocity(x, t, x_lens, prompt_x, style, mu, inference_cfg_rate, guidance)
+            x_mid = x + 0.5 * dt * k1
+            x_mid[:, :, :prompt_len] = 0
+            k2 = self._velocity(x_mid, t + 0.5 * dt, x_lens, prompt_x, style, mu, inference_cfg_rate, guidance)
+            x = x + dt * k2
+            x[:, :, :prompt_len] = 0
+        return x
+
+    def solve_heun(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5, guidance=None):
+        """
+        Heun (trapezoidal second order Runge-Kutta) solver, two estimator calls per step.
+        Args: see `solve_euler`
+        """
+        prompt_len = prompt.size(-1)
+        prompt_x = self._prepare_prompt(x, prompt, mu)
+        for step in tqdm(range(1, len(t_span))):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            k1 = self._velocity(x, t, x_lens, prompt_x, style, mu, inference_cfg_rate, guidance)
+            x_pred = x + dt * k1
+            x_pred[:, :, :prompt_len] = 0
+            k2 = self._velocity(x_pred, t_span[step], x_lens, prompt_x, style, mu, inference_cfg_rate, guidance)
+            x = x + 0.5 * dt * (k1 + k2)
+            x[:, :, :prompt_len] = 0
+        return x
+
+    def solve_multistep(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5, guidance=None):
+        """
+        Second order multistep (DPM-Solver++(2M) style Adams-Bashforth) solver: reuses the velocity of the
+        previous step, so it costs one estimator call per step like Euler. The first step is an Euler step.
+        Args: see `solve_euler`
+        """
+        prompt_len = prompt.size(-1)
+        prompt_x = self._prepare_prompt(x, prompt, mu)
+        prev_dphi_dt, prev_dt = None, None
+        for step in tqdm(range(1, len(t_span))):
+            t, dt = t_span[step - 1], t_span[step] - t_span[step - 1]
+            dphi_dt = self._velocity(x, t, x_lens, prompt_x, style, mu, inference_cfg_rate, guidance)
+            if prev_dphi_dt is None:
+                x = x + dt * dphi_dt
+            else:
+                # linear extrapolation of the velocity over [t, t + dt] for non-uniform steps
+                x = x + dt * (dphi_dt + 0.5 * dt / prev_dt * (dphi_dt - prev_dphi_dt))
+            x[:, :, :prompt_len] = 0
+            prev_dphi_dt, prev_dt = dphi_dt, dt
+        return x
+
     def forward(self, x1, x_lens, prompt_lens, mu, style):
         """Computes diffusion loss
 
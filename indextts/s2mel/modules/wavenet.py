@@ -150,10 +150,15 @@ class WN(torch.nn.Module):
             else:
                 g_l = torch.zeros_like(x_in)
 
-            acts = commons.fused_add_tanh_sigmoid_multiply(
-                x_in,
-                g_l,
-                n_channels_tensor)
+            if torch.compiler.is_compiling():
+                # the scripted helper slices with a tensor, which breaks the torch.compile graph
+                in_act = x_in + g_l
+                acts = torch.tanh(in_act[:, :self.hidden_channels]) * torch.sigmoid(in_act[:, self.hidden_channels:])
+            else:
+                acts = commons.fused_add_tanh_sigmoid_multiply(
+                    x_in,
+                    g_l,
+                    n_channels_tensor)
             acts = self.drop(acts)
 
             res_skip_acts = self.res_skip_layers[i](acts)
@@ -0,0 +1,96 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def hash_audio_file(audio_path, chunk_size=1 << 20):
+    """
+    Content hash of a reference audio file, so the same voice is recognized even when it is
+    uploaded under a different (e.g. temporary) file name.
+    """
+    h = hashlib.sha1()
+    with open(audio_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _bundle_nbytes(bundle):
+    nbytes = 0
+    for value in bundle.values():
+        if isinstance(value, torch.Tensor):
+            nbytes += value.numel() * value.element_size()
+    return nbytes
+
+
+class ConditioningCache:
+    """
+    Bounded LRU cache of conditioning bundles (dicts of tensors computed from a reference audio).
+
+    Args:
+        max_entries (int): maximum number of cached bundles, <= 0 disables the cache.
+        max_bytes (int | None): budget for the total size of the cached tensors; None means unlimited.
+            The most recently inserted bundle is always kept, even if it alone exceeds the budget.
+    """
+
+    def __init__(self, max_entries=8, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            bundle = self._entries.get(key)
+            if bundle is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return bundle
+
+    def put(self, key, bundle):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= _bundle_nbytes(self._entries.pop(key))
+            self._entries[key] = bundle
+            self.nbytes += _bundle_nbytes(bundle)
+            while len(self._entries) > 1 and (
+                    len(self._entries) > self.max_entries
+                    or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= _bundle_nbytes(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
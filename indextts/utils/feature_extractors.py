@@ -1,6 +1,9 @@
+import threading
+
 import torch
 import torchaudio
 from torch import nn
+from torch.nn.utils.rnn import pad_sequence
 from indextts.utils.common import safe_log
 
 
@@ -48,3 +51,114 @@ class MelSpectrogramFeatures(FeatureExtractor):
         mel = self.mel_spec(audio)
         mel = safe_log(mel)
         return mel
+
+
+class SeamlessM4TFbankFeatures(nn.Module):
+    """
+    Torch port of `transformers.SeamlessM4TFeatureExtractor` (the w2v-BERT 2.0 input features) that runs on the
+    device of the audio and featurizes a batch of clips at once.
+
+    Kaldi-style log-mel filter banks (25ms povey window, 10ms hop, preemphasis, DC removal) normalized per clip
+    and mel bin, padded to an even number of frames and stacked by `stride` frames, as the HF extractor.
+    The spectrum is computed in float64 like the HF (numpy) version, so the features match it to float32 rounding.
+    """
+
+    def __init__(self, sampling_rate=16000, num_mel_bins=80, stride=2, padding_value=0.0):
+        super().__init__()
+        from transformers.audio_utils import mel_filter_bank, window_function
+
+        self.sampling_rate = sampling_rate
+        self.stride = stride
+        self.padding_value = padding_value
+        self.frame_length = 400
+        self.hop_length = 160
+        self.fft_length = 512
+        self.preemphasis = 0.97
+        self.mel_floor = 1.192092955078125e-07
+        # the same filters and window as the HF extractor
+        mel_filters = mel_filter_bank(
+            num_frequency_bins=self.fft_length // 2 + 1,
+            num_mel_filters=num_mel_bins,
+            min_frequency=20,
+            max_frequency=sampling_rate // 2,
+            sampling_rate=sampling_rate,
+            norm=None,
+            mel_scale="kaldi",
+            triangularize_in_mel_space=True,
+        )
+        window = window_function(self.frame_length, "povey", periodic=False)
+        self.register_buffer("mel_filters", torch.from_numpy(mel_filters).double(), persistent=False)
+        self.register_buffer("window", torch.from_numpy(window).double(), persistent=False)
+
+    def num_frames(self, num_samples):
+        return (num_samples - self.frame_length) // self.hop_length + 1
+
+    def _log_mel(self, audio):
+        # audio: [B, N] float64 -> [B, frames, num_mel_bins]
+        frames = audio.unfold(-1, self.frame_length, self.hop_length) * (2 ** 15)  # Kaldi compliance: int16 range
+        frames = frames - frames.mean(dim=-1, keepdim=True)
+        frames = torch.cat([frames[..., :1] * (1 - self.preemphasis),
+                            frames[..., 1:] - self.preemphasis * frames[..., :-1]], dim=-1)
+        spectrum = torch.fft.rfft(frames * self.window, n=self.fft_length)
+        # the HF extractor stores the spectrum as complex64
+        power = spectrum.to(torch.complex64).abs().double() ** 2
+        return torch.log(torch.clamp(power @ self.mel_filters, min=self.mel_floor))
+
+    @torch.no_grad()
+    def forward(self, audio, lengths=None):
+        """
+        Args:
+            audio: 16kHz waveforms, a list of 1D tensors or a [B, N] tensor (with `lengths`, [B], if padded)
+        Returns:
+            input_features [B, frames // stride, num_mel_bins * stride] float32,
+            attention_mask [B, frames // stride] int32
+        """
+        if isinstance(audio, (list, tuple)):
+            lengths = torch.tensor([clip.shape[-1] for clip in audio])
+            audio = pad_sequence([clip.reshape(-1) for clip in audio], batch_first=True)
+        elif audio.dim() == 1:
+            audio = audio.unsqueeze(0)
+        if lengths is None:
+            lengths = torch.full((audio.size(0),), audio.size(-1))
+        device = audio.device
+        # float64 is not available on MPS
+        compute_device = torch.device("cpu") if device.type == "mps" else device
+        feats = self._log_mel(audio.to(compute_device, torch.float64)).float()
+        num_frames = self.num_frames(lengths.to(compute_device))
+        batch_size, max_frames, num_mel_bins = feats.shape
+
+        # zero mean, unit variance (ddof=1) per clip and mel bin over its own frames
+        mask = torch.arange(max_frames, device=compute_device)[None, :] < num_frames[:, None]
+        count = num_frames[:, None, None].float()
+        feats = feats.masked_fill(~mask[..., None], 0.0)
+        mean = feats.sum(dim=1, keepdim=True) / count
+        var = ((feats - mean).masked_fill(~mask[..., None], 0.0) ** 2).sum(dim=1, keepdim=True) / (count - 1)
+        feats = (feats - mean) / torch.sqrt(var + 1e-7)
+        feats = feats.masked_fill(~mask[..., None], self.padding_value)
+
+        # pad to a multiple of the stride, then stack `stride` consecutive frames
+        padded_frames = -(-max_frames // self.stride) * self.stride
+        feats = torch.nn.functional.pad(feats, (0, 0, 0, padded_frames - max_frames), value=self.padding_value)
+        mask = torch.nn.functional.pad(mask, (0, padded_frames - max_frames), value=False)
+        input_features = feats.reshape(batch_size, padded_frames // self.stride, num_mel_bins * self.stride)
+        attention_mask = mask[:, self.stride - 1::self.stride].to(torch.int32)
+        return input_features.to(device), attention_mask.to(device)
+
+
+class ResamplerCache:
+    """`torchaudio.transforms.Resample` kernels kept per (orig_freq, new_freq, device) instead of rebuilt per call."""
+
+    def __init__(self):
+        self._resamplers = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, audio, orig_freq, new_freq):
+        if orig_freq == new_freq:
+            return audio
+        key = (orig_freq, new_freq, audio.device)
+        with self._lock:
+            resampler = self._resamplers.get(key)
+            if resampler is None:
+                resampler = torchaudio.transforms.Resample(orig_freq, new_freq).to(audio.device)
+                self._resamplers[key] = resampler
+        return resampler(audio)
@@ -84,8 +84,23 @@ class JsonHParams:
         return self.__dict__.__repr__()
 
 
-def build_semantic_model(path_='./models/tts/maskgct/ckpt/wav2vec2bert_stats.pt'):
-    semantic_model = Wav2Vec2BertModel.from_pretrained("facebook/w2v-bert-2.0")
+def build_semantic_model(path_='./models/tts/maskgct/ckpt/wav2vec2bert_stats.pt', output_layer=None):
+    """
+    Args:
+        path_: mean / var statistics of the semantic features
+        output_layer: if set, keep only the first `output_layer` encoder layers (and load only their weights),
+            so that `last_hidden_state` is `hidden_states[output_layer]` of the full model
+    """
+    if output_layer is None:
+        semantic_model = Wav2Vec2BertModel.from_pretrained("facebook/w2v-bert-2.0")
+    else:
+        # the adapter / intermediate ffn run after the last layer, they must not touch the truncated output
+        semantic_model = Wav2Vec2BertModel.from_pretrained(
+            "facebook/w2v-bert-2.0",
+            num_hidden_layers=output_layer,
+            add_adapter=False,
+            use_intermediate_ffn_before_adapter=False,
+        )
     semantic_model.eval()
     stat_mean_var = torch.load(path_)
     semantic_mean = stat_mean_var["mean"]
@@ -0,0 +1,95 @@
+import os
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+# bump when the layout or the meaning of the stored tensors changes
+VOICE_STORE_VERSION = "1"
+VOICE_FILE_EXT = ".safetensors"
+
+SPK_PREFIX = "spk."
+EMO_PREFIX = "emo."
+
+
+def save_voice(path, spk_bundle, emo_bundle, audio_sha1, model_version=None, source=None):
+    """
+    Save the precomputed speaker conditioning (``spk_cond_emb``, ``style``, ``prompt_condition``,
+    ``ref_mel``) and emotion conditioning (``emo_cond_emb``) of one reference audio.
+    """
+    tensors = {}
+    for prefix, bundle in ((SPK_PREFIX, spk_bundle), (EMO_PREFIX, emo_bundle)):
+        for k, v in bundle.items():
+            tensors[prefix + k] = v.detach().float().cpu().contiguous()
+    metadata = {
+        "format_version": VOICE_STORE_VERSION,
+        "model_version": str(model_version),
+        "audio_sha1": audio_sha1,
+        "source": source or "",
+    }
+    tmp_path = path + ".tmp"
+    save_file(tensors, tmp_path, metadata=metadata)
+    os.replace(tmp_path, path)
+
+
+class VoiceStore:
+    """
+    Directory of enrolled voices (one safetensors file per voice, see ``indextts/enroll_voices.py``),
+    indexed by the SHA-1 of the reference audio bytes so that lookups match ``hash_audio_file``.
+
+    Files written for another store format or model version are skipped with a warning.
+    """
+
+    def __init__(self, store_dir, model_version=None, device="cpu", dtype=None):
+        self.store_dir = store_dir
+        self.model_version = str(model_version)
+        self.voices = {}
+        if not os.path.isdir(store_dir):
+            print(f">> Voice store {store_dir} does not exist, no enrolled voices loaded.")
+            return
+        for filename in sorted(os.listdir(store_dir)):
+            if not filename.endswith(VOICE_FILE_EXT):
+                continue
+            path = os.path.join(store_dir, filename)
+            voice = self._load(path, device, dtype)
+            if voice is not None:
+                self.voices[voice["audio_sha1"]] = voice
+        print(f">> {len(self.voices)} enrolled voices loaded from: {store_dir}")
+
+    def _load(self, path, device, dtype):
+        spk_bundle, emo_bundle = {}, {}
+        with safe_open(path, framework="pt", device="cpu") as f:
+            metadata = f.metadata() or {}
+            if metadata.get("format_version") != VOICE_STORE_VERSION:
+                print(f">> Skip {path}: voice store format {metadata.get('format_version')} "
+                      f"!= {VOICE_STORE_VERSION}, please re-enroll.")
+                return None
+            if metadata.get("model_version") != self.model_version:
+                print(f">> Skip {path}: enrolled with model version {metadata.get('model_version')} "
+                      f"!= {self.model_version}, please re-enroll.")
+                return None
+            for key in f.keys():
+                tensor = f.get_tensor(key).to(device)
+                if dtype is not None:
+                    tensor = tensor.to(dtype)
+                if key.startswith(SPK_PREFIX):
+                    spk_bundle[key[len(SPK_PREFIX):]] = tensor
+                elif key.startswith(EMO_PREFIX):
+                    emo_bundle[key[len(EMO_PREFIX):]] = tensor
+        return {
+            "name": os.path.splitext(os.path.basename(path))[0],
+            "audio_sha1": metadata["audio_sha1"],
+            "spk": spk_bundle,
+            "emo": emo_bundle,
+        }
+
+    def __len__(self):
+        return len(self.voices)
+
+    def get_speaker(self, audio_sha1):
+        voice = self.voices.get(audio_sha1)
+        return voice["spk"] if voice is not None else None
+
+    def get_emotion(self, audio_sha1):
+        voice = self.voices.get(audio_sha1)
+        return voice["emo"] if voice is not None else None
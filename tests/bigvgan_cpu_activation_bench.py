@@ -0,0 +1,64 @@
+import sys
+import time
+
+import torch
+from omegaconf import OmegaConf
+
+from indextts.s2mel.modules.bigvgan import bigvgan
+
+if __name__ == "__main__":
+    """
+    BigVGAN on CPU: the torch anti-aliased activations vs the fused CPU ones (`use_cpu_kernel=True`,
+    `alias_free_activation/cpu`). Checks that both give the same waveform and prints the RTF of each.
+    ```
+    python tests/bigvgan_cpu_activation_bench.py checkpoints 4
+    ```
+    The second argument is the torch thread count (default: torch's default).
+    """
+    sys.path.append("..")
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    if len(sys.argv) > 2:
+        torch.set_num_threads(int(sys.argv[2]))
+    torch.manual_seed(42)
+    cfg = OmegaConf.load(f"{model_dir}/config.yaml")
+    vocoder = bigvgan.BigVGAN.from_pretrained(cfg.vocoder.name, use_cuda_kernel=False)
+    vocoder.remove_weight_norm()
+    vocoder.eval()
+    fused_vocoder = bigvgan.BigVGAN(vocoder.h, use_cuda_kernel=False, use_cpu_kernel=True)
+    fused_vocoder.remove_weight_norm()
+    fused_vocoder.load_state_dict(vocoder.state_dict())
+    fused_vocoder.eval()
+    h = vocoder.h
+
+    def run(fn, mel, repeats=3):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            wav = fn(mel)
+        return wav, (time.perf_counter() - start) / repeats
+
+    print(f"threads: {torch.get_num_threads()}")
+    with torch.inference_mode():
+        start = time.perf_counter()
+        fused_vocoder(torch.randn(1, h.num_mels, 50))
+        print(f"warmup (compile): {time.perf_counter() - start:.2f}s")
+
+        failed = []
+        for seconds in (2, 8, 20):
+            frames = int(seconds * h.sampling_rate / h.hop_size)
+            # a log-mel in the usual range, the comparison does not need speech
+            mel = torch.randn(1, h.num_mels, frames) - 5.0
+            fused_vocoder(mel)  # shapes of a new length can trigger a recompile
+            eager, eager_time = run(vocoder, mel)
+            fused, fused_time = run(fused_vocoder, mel)
+            diff = (eager - fused).abs().max().item()
+            print(f"{seconds}s audio: torch RTF {eager_time / seconds:.3f}, fused RTF {fused_time / seconds:.3f}, "
+                  f"speedup {eager_time / fused_time:.2f}x, max abs diff {diff:.2e}")
+            if eager.shape != fused.shape or diff > 1e-3:
+                failed.append(seconds)
+
+    print("--" * 10)
+    if failed:
+        print("mismatch:", failed)
+    else:
+        print("all matched")
+    print("Test finished.")
@@ -0,0 +1,75 @@
+import os
+import sys
+import tempfile
+import time
+
+import librosa
+import torch
+from omegaconf import OmegaConf
+
+from indextts.s2mel.modules.audio import mel_spectrogram
+from indextts.s2mel.modules.bigvgan import bigvgan
+from indextts.s2mel.modules.bigvgan.onnx_vocoder import OnnxVocoder, export_onnx
+
+if __name__ == "__main__":
+    """
+    BigVGAN on CPU: eager PyTorch vs the ONNX export run by ONNX Runtime (`IndexTTS2(vocoder_backend="onnxruntime")`).
+    Checks that both give the same waveform and prints the RTF (vocoder time / audio length) of each.
+    ```
+    python tests/bigvgan_onnx_bench.py checkpoints 4
+    ```
+    The second argument is the thread count of both backends (default: torch's default).
+    """
+    sys.path.append("..")
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    num_threads = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    audio_prompt = "tests/sample_prompt.wav"
+    cfg = OmegaConf.load(f"{model_dir}/config.yaml")
+    vocoder = bigvgan.BigVGAN.from_pretrained(cfg.vocoder.name, use_cuda_kernel=False)
+    vocoder.remove_weight_norm()
+    vocoder.eval()
+
+    spect_params = cfg.s2mel['preprocess_params']['spect_params']
+    sr = cfg.s2mel["preprocess_params"]["sr"]
+    audio, _ = librosa.load(audio_prompt, sr=sr)
+    audio = torch.tensor(audio).unsqueeze(0)
+    mel = mel_spectrogram(audio, n_fft=spect_params['n_fft'], num_mels=spect_params['n_mels'], sampling_rate=sr,
+                          hop_size=spect_params['hop_length'], win_size=spect_params['win_length'],
+                          fmin=spect_params.get('fmin', 0), fmax=None, center=False)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        onnx_path = export_onnx(vocoder, os.path.join(tmp_dir, "bigvgan.onnx"))
+        print(f"export: {time.perf_counter() - start:.2f}s, {os.path.getsize(onnx_path) / 2 ** 20:.1f} MB")
+        onnx_vocoder = OnnxVocoder(onnx_path, vocoder.h, num_threads=num_threads)
+
+    def run(fn, mel, repeats=3):
+        fn(mel)  # warm up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            wav = fn(mel)
+        return wav, (time.perf_counter() - start) / repeats
+
+    print(f"threads: {num_threads or torch.get_num_threads()}")
+    failed = []
+    # the sample prompt, a shorter cut and a longer (repeated) mel: the time axis of the export is dynamic
+    for frames in (mel.shape[-1] // 4, mel.shape[-1], mel.shape[-1] * 3):
+        m = mel.repeat(1, 1, 3)[:, :, :frames]
+        length = frames * vocoder.h.hop_size / vocoder.h.sampling_rate
+        with torch.inference_mode():
+            eager, eager_time = run(vocoder, m)
+        onnx, onnx_time = run(onnx_vocoder, m)
+        diff = (eager - onnx).abs().max().item()
+        print(f"{length:.1f}s audio: torch RTF {eager_time / length:.3f}, onnxruntime RTF {onnx_time / length:.3f}, "
+              f"speedup {eager_time / onnx_time:.2f}x, max abs diff {diff:.2e}")
+        if eager.shape != onnx.shape or diff > 1e-3:
+            failed.append(frames)
+
+    print("--" * 10)
+    if failed:
+        print("mismatch:", failed)
+    else:
+        print("all matched")
+    print("Test finished.")
@@ -0,0 +1,65 @@
+import sys
+import time
+
+import librosa
+import torch
+from omegaconf import OmegaConf
+
+from indextts.s2mel.modules.audio import mel_spectrogram
+from indextts.s2mel.modules.bigvgan import bigvgan
+from indextts.s2mel.modules.bigvgan.streaming import StreamingVocoder
+
+if __name__ == "__main__":
+    """
+    Compare the waveform of `StreamingVocoder` (chunked BigVGAN with left/right context) with the
+    one-shot `bigvgan(mel)` of the same mel, for several context sizes, and the time to the first chunk.
+    ```
+    python tests/bigvgan_streaming_test.py checkpoints
+    ```
+    With enough context (the default 32 frames) the chunks must match the one-shot output within float tolerance.
+    """
+    sys.path.append("..")
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    audio_prompt = "tests/sample_prompt.wav"
+    device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    cfg = OmegaConf.load(f"{model_dir}/config.yaml")
+    vocoder = bigvgan.BigVGAN.from_pretrained(cfg.vocoder.name, use_cuda_kernel=False).to(device)
+    vocoder.remove_weight_norm()
+    vocoder.eval()
+
+    spect_params = cfg.s2mel['preprocess_params']['spect_params']
+    sr = cfg.s2mel["preprocess_params"]["sr"]
+    audio, _ = librosa.load(audio_prompt, sr=sr)
+    audio = torch.tensor(audio, device=device).unsqueeze(0)
+    mel = mel_spectrogram(audio, n_fft=spect_params['n_fft'], num_mels=spect_params['n_mels'], sampling_rate=sr,
+                          hop_size=spect_params['hop_length'], win_size=spect_params['win_length'],
+                          fmin=spect_params.get('fmin', 0), fmax=None, center=False)
+
+    with torch.inference_mode():
+        start = time.perf_counter()
+        reference = vocoder(mel)
+        print(f"one-shot: {mel.shape[-1]} frames in {time.perf_counter() - start:.2f}s")
+
+    failed = []
+    for context in (8, 16, 32):
+        stream = StreamingVocoder(vocoder, chunk_frames=64, left_context=context, right_context=context)
+        start = time.perf_counter()
+        chunks = []
+        for wav in stream.stream(mel):
+            if not chunks:
+                first_chunk_time = time.perf_counter() - start
+            chunks.append(wav)
+        total_time = time.perf_counter() - start
+        wav = torch.cat(chunks, dim=-1)
+        diff = (wav - reference).abs().max().item()
+        print(f"context {context}: {len(chunks)} chunks, max abs diff {diff:.2e}, "
+              f"first chunk {first_chunk_time:.2f}s, total {total_time:.2f}s")
+        if wav.shape != reference.shape or (context >= 32 and diff > 1e-4):
+            failed.append(context)
+
+    print("--" * 10)
+    if failed:
+        print("mismatch:", failed)
+    else:
+        print("all matched")
+    print("Test finished.")
@@ -0,0 +1,103 @@
+import sys
+
+import torch
+import torch.nn.functional as F
+
+from indextts.infer_v2 import IndexTTS2
+
+if __name__ == "__main__":
+    """
+    Compare the GPT latent collected during generation (`inference_speech(return_latent=True)`)
+    with the latent of the second, teacher-forced `UnifiedVoice.forward()` pass.
+    ```
+    python tests/gpt_latent_parity_test.py checkpoints
+    ```
+    Generation feeds the k-th mel token at position k+1 while `forward()` uses position k, so the two
+    latents differ slightly; the "aligned" run moves the generation positions onto those of `forward()`
+    and must then match within float tolerance (checks the capture and the beam reordering).
+    """
+    import transformers
+    transformers.set_seed(42)
+    sys.path.append("..")
+    if len(sys.argv) > 1:
+        model_dir = sys.argv[1]
+    else:
+        model_dir = "checkpoints"
+    audio_prompt = "tests/sample_prompt.wav"
+    tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, use_fp16=False, use_cuda_kernel=False)
+    gpt = tts.gpt
+    text = "大家好，我现在正在bilibili 体验 ai 科技，说实话，来之前我绝对想不到！"
+    text_tokens = tts.tokenizer.convert_tokens_to_ids(tts.tokenizer.tokenize(text))
+    text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=tts.device).unsqueeze(0)
+
+    spk_cond_emb = tts.get_speaker_conditioning(audio_prompt)["spk_cond_emb"]
+    emo_cond_emb = tts.get_emotion_conditioning(audio_prompt)["emo_cond_emb"]
+    cond_lengths = torch.tensor([spk_cond_emb.shape[-1]], device=tts.device)
+    emo_cond_lengths = torch.tensor([emo_cond_emb.shape[-1]], device=tts.device)
+
+    def two_pass_latent(speech_conditioning_latent, emovec, codes):
+        return gpt(
+            speech_conditioning_latent,
+            text_tokens,
+            torch.tensor([text_tokens.shape[-1]], device=tts.device),
+            codes,
+            torch.tensor([codes.shape[-1]], device=tts.device),
+            emo_cond_emb,
+            cond_mel_lengths=cond_lengths,
+            emo_cond_mel_lengths=emo_cond_lengths,
+            emo_vec=emovec,
+            use_speed=torch.zeros(1, device=tts.device).long(),
+        )
+
+    def compare(name, **kwargs):
+        transformers.set_seed(42)
+        codes, speech_conditioning_latent, latent = gpt.inference_speech(
+            spk_cond_emb, text_tokens, emo_cond_emb, cond_lengths=cond_lengths, emo_cond_lengths=emo_cond_lengths,
+            emo_vec=emovec, return_latent=True, max_generate_length=600, **kwargs)
+        stop_idx = (codes[0] == gpt.stop_mel_token).nonzero(as_tuple=False)
+        code_len = stop_idx[0].item() if len(stop_idx) > 0 else codes.shape[-1]
+        codes, latent = codes[:, :code_len], latent[:1, :code_len]
+        reference = two_pass_latent(speech_conditioning_latent, emovec, codes)
+        diff = (latent - reference).abs()
+        cos = F.cosine_similarity(latent.float(), reference.float(), dim=-1)
+        print(f"{name}: codes {code_len}, max abs diff {diff.max().item():.4e}, "
+              f"first token diff {diff[:, 0].max().item():.4e}, cosine min {cos.min().item():.4f} mean {cos.mean().item():.4f}")
+        return diff
+
+    settings = {
+        "greedy": {"do_sample": False, "num_beams": 1, "repetition_penalty": 10.0},
+        "sampling": {"do_sample": True, "top_p": 0.8, "top_k": 30, "temperature": 0.8, "num_beams": 1,
+                     "repetition_penalty": 10.0},
+        "beam search": {"do_sample": True, "top_p": 0.8, "top_k": 30, "temperature": 0.8, "num_beams": 3,
+                        "length_penalty": 0.0, "repetition_penalty": 10.0},
+    }
+    failed = []
+    with torch.no_grad():
+        emovec = gpt.merge_emovec(spk_cond_emb, emo_cond_emb, cond_lengths, emo_cond_lengths, alpha=1.0)
+        print("--" * 10)
+        print("generation latent vs two-pass latent:")
+        for name, kwargs in settings.items():
+            diff = compare(name, **kwargs)
+            # the first latent comes from the start_mel_token, at the same position in both passes
+            if diff[:, 0].max().item() > 1e-3:
+                failed.append(name)
+
+        print("--" * 10)
+        print("aligned mel positions:")
+        pos_emb = gpt.inference_model.text_pos_embedding
+        get_fixed_embedding = pos_emb.get_fixed_embedding
+        pos_emb.get_fixed_embedding = lambda ind, dev: get_fixed_embedding(ind - 1, dev)
+        try:
+            for name, kwargs in settings.items():
+                diff = compare(f"{name} (aligned)", **kwargs)
+                if diff.max().item() > 1e-3:
+                    failed.append(f"{name} (aligned)")
+        finally:
+            pos_emb.get_fixed_embedding = get_fixed_embedding
+
+    print("--" * 10)
+    if failed:
+        print("mismatch:", failed)
+    else:
+        print("all matched")
+    print("Test finished.")
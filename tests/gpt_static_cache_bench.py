@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+
+import torch
+from omegaconf import OmegaConf
+
+from indextts.gpt.model_v2 import UnifiedVoice
+from indextts.gpt.static_cache import StaticCacheDecoder
+from indextts.utils.checkpoint import load_checkpoint
+
+if __name__ == "__main__":
+    """
+    Mel token decoding speed (tokens/sec) on CPU: HF `generate` (`inference_speech`) vs `StaticCacheDecoder`,
+    eager and compiled, with sampling disabled. Also checks that all of them produce the same codes.
+    ```
+    python tests/gpt_static_cache_bench.py checkpoints 200
+    ```
+    Without `gpt.pth` in the model directory the GPT is randomly initialized, which is enough for timing.
+    """
+    sys.path.append("..")
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    num_tokens = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    torch.manual_seed(42)
+    cfg = OmegaConf.load(f"{model_dir}/config.yaml")
+    gpt = UnifiedVoice(**cfg.gpt)
+    gpt_path = os.path.join(model_dir, cfg.gpt_checkpoint)
+    if os.path.exists(gpt_path):
+        load_checkpoint(gpt, gpt_path)
+    else:
+        print(f">> {gpt_path} not found, timing a randomly initialized GPT")
+    gpt.eval()
+    gpt.post_init_gpt2_config(kv_cache=True)
+
+    # decoding speed does not depend on the conditioning content, random features are used
+    spk_cond_emb = torch.randn(1, 200, 1024)
+    text_tokens = torch.randint(0, 1000, (1, 60), dtype=torch.int32)
+    sampling_kwargs = {"do_sample": False, "repetition_penalty": 10.0, "max_generate_length": num_tokens}
+
+    def timed(name, fn, runs=2):
+        # the first run includes compilation / allocation
+        for i in range(runs):
+            start = time.perf_counter()
+            codes = fn()
+            elapsed = time.perf_counter() - start
+            print(f"{name} run {i}: {codes.shape[-1]} tokens in {elapsed:.2f}s, {codes.shape[-1] / elapsed:.2f} tokens/s")
+        return codes
+
+    with torch.no_grad():
+        speech_conditioning_latent, conds_latent = gpt.prepare_conditioning_latents(spk_cond_emb)
+        _, inputs_embeds, _, _ = gpt.prepare_inference_inputs(
+            spk_cond_emb, text_tokens, speech_conditioning_latent=speech_conditioning_latent, conds_latent=conds_latent)
+        print(f"threads: {torch.get_num_threads()}, prefix length: {inputs_embeds.shape[1] + 1}, tokens: {num_tokens}")
+        baseline = timed("hf generate", lambda: gpt.inference_speech(
+            spk_cond_emb, text_tokens, num_beams=1, speech_conditioning_latent=speech_conditioning_latent,
+            conds_latent=conds_latent, **sampling_kwargs)[0])
+        outputs = {}
+        for compile in (False, True):
+            decoder = StaticCacheDecoder(gpt, compile=compile)
+            name = "static cache" + (" (compiled)" if compile else "")
+            outputs[name] = timed(name, lambda: decoder.generate(inputs_embeds, **sampling_kwargs))
+
+    print("--" * 10)
+    mismatch = [name for name, codes in outputs.items() if not baseline.equal(codes)]
+    if mismatch:
+        print("mismatch:", mismatch)
+    else:
+        print("all matched")
+    print("Test finished.")
@@ -0,0 +1,48 @@
+import sys
+
+import torch
+
+from indextts.infer_v2 import IndexTTS2
+
+if __name__ == "__main__":
+    """
+    `IndexTTS2.infer_stream` / `infer` on a text split into several segments: checks the silence chunks
+    inserted between segments and that `infer` returns the concatenated stream.
+    ```
+    python tests/infer_stream_test.py checkpoints
+    ```
+    """
+    sys.path.append("..")
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    audio_prompt = "tests/sample_prompt.wav"
+    tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, use_fp16=False, use_cuda_kernel=False)
+    text = "大家好，我现在正在bilibili 体验 ai 科技。说实话，来之前我绝对想不到！AI技术已经发展到这样匪夷所思的地步了！"
+    kwargs = {"max_text_tokens_per_segment": 20, "interval_silence": 200, "do_sample": False, "num_beams": 1,
+              "max_mel_tokens": 600}
+
+    failed = []
+    for vocoder_chunk_frames in (0, 64):
+        chunks = list(tts.infer_stream(audio_prompt, text, vocoder_chunk_frames=vocoder_chunk_frames, **kwargs))
+        segments_count = chunks[0]["segments_count"]
+        silences = [chunk for chunk in chunks if chunk["is_silence"]]
+        sil_dur = int(tts.sampling_rate * kwargs["interval_silence"] / 1000.0)
+        print(f"vocoder_chunk_frames {vocoder_chunk_frames}: {segments_count} segments, {len(chunks)} chunks, "
+              f"{len(silences)} silences")
+        if segments_count < 2:
+            failed.append(f"{vocoder_chunk_frames}: text not split")
+        if len(silences) != segments_count - 1 or any(s["wav"].shape != (1, sil_dur) for s in silences):
+            failed.append(f"{vocoder_chunk_frames}: silence chunks")
+
+    # infer is the concatenation of infer_stream
+    streamed = torch.cat([chunk["wav"] for chunk in tts.infer_stream(audio_prompt, text, **kwargs)], dim=1)
+    sampling_rate, wav_data = tts.infer(audio_prompt, text, output_path=None, **kwargs)
+    print(f"infer: {wav_data.shape[0] / sampling_rate:.2f}s, infer_stream: {streamed.shape[1] / sampling_rate:.2f}s")
+    if wav_data.shape[0] != streamed.shape[1]:
+        failed.append("infer length")
+
+    print("--" * 10)
+    if failed:
+        print("failed:", failed)
+    else:
+        print("all passed")
+    print("Test finished.")
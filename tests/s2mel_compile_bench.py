@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+
+import torch
+from omegaconf import OmegaConf
+
+from indextts.s2mel.modules.bucketed_estimator import BucketedEstimator
+from indextts.s2mel.modules.commons import load_checkpoint2, MyModel
+
+if __name__ == "__main__":
+    """
+    s2mel CFM time (`s2mel_time` without the length regulator) per segment: eager DiT estimator vs
+    `BucketedEstimator` (length buckets + `torch.compile`, CUDA graphs on CUDA), on CUDA if available.
+    Also checks that both give the same mel.
+    ```
+    python tests/s2mel_compile_bench.py checkpoints 25
+    ```
+    Without the s2mel checkpoint in the model directory the CFM is randomly initialized, which is enough for timing.
+    """
+    sys.path.append("..")
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    diffusion_steps = int(sys.argv[2]) if len(sys.argv) > 2 else 25
+    device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    torch.manual_seed(42)
+    cfg = OmegaConf.load(f"{model_dir}/config.yaml")
+    s2mel = MyModel(cfg.s2mel, use_gpt_latent=True)
+    s2mel_path = os.path.join(model_dir, cfg.s2mel_checkpoint)
+    if os.path.exists(s2mel_path):
+        s2mel, _, _, _ = load_checkpoint2(s2mel, None, s2mel_path, load_only_params=True, ignore_modules=[],
+                                          is_distributed=False)
+    else:
+        print(f">> {s2mel_path} not found, timing a randomly initialized CFM")
+    cfm = s2mel.models['cfm'].to(device).eval()
+    cfm.estimator.setup_caches(max_batch_size=1, max_seq_length=8192)
+    eager_estimator = cfm.estimator
+    bucketed_estimator = BucketedEstimator(eager_estimator)
+
+    # (prompt frames, generated frames): prompt mel + one segment, as in `IndexTTS2.infer`
+    lengths = [(300, 200), (300, 450), (300, 900)]
+    content_dim = eager_estimator.content_dim
+
+    def run(mu, prompt, style, seed=0):
+        torch.manual_seed(seed)
+        x_lens = torch.LongTensor([mu.size(1)]).to(device)
+        if device.startswith("cuda"):
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        out = cfm.inference(mu, x_lens, prompt, style, None, diffusion_steps, inference_cfg_rate=0.7)
+        if device.startswith("cuda"):
+            torch.cuda.synchronize()
+        return out, time.perf_counter() - start
+
+    start = time.perf_counter()
+    cfm.estimator = bucketed_estimator
+    timings = bucketed_estimator.warmup(batch_sizes=(2,), device=device)
+    print(f"device: {device}, threads: {torch.get_num_threads()}, steps: {diffusion_steps}")
+    print(f"warmup (compile) {time.perf_counter() - start:.2f}s:",
+          {bucket: round(t, 2) for (_, bucket), t in timings.items()})
+
+    failed = []
+    for prompt_len, gen_len in lengths:
+        mu = torch.randn(1, prompt_len + gen_len, content_dim, device=device)
+        prompt = torch.randn(1, eager_estimator.in_channels, prompt_len, device=device)
+        style = torch.randn(1, 192, device=device)
+        results = {}
+        for name, estimator in (("eager", eager_estimator), ("compiled", bucketed_estimator)):
+            cfm.estimator = estimator
+            run(mu.clone(), prompt, style)  # warm up the allocator
+            results[name] = run(mu.clone(), prompt, style)
+        (eager, eager_time), (compiled, compiled_time) = results["eager"], results["compiled"]
+        diff = (eager - compiled)[:, :, prompt_len:].abs().max().item()
+        bucket = bucketed_estimator.bucket_length(prompt_len + gen_len)
+        print(f"frames {prompt_len}+{gen_len} (bucket {bucket}): eager {eager_time:.2f}s, "
+              f"compiled {compiled_time:.2f}s, speedup {eager_time / compiled_time:.2f}x, max abs diff {diff:.2e}")
+        if diff > 1e-3:
+            failed.append(prompt_len + gen_len)
+
+    print("--" * 10)
+    if failed:
+        print("mismatch:", failed)
+    else:
+        print("all matched")
+    print("Test finished.")
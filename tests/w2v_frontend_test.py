@@ -0,0 +1,57 @@
+import sys
+import time
+
+import librosa
+import torch
+from transformers import SeamlessM4TFeatureExtractor
+
+from indextts.utils.feature_extractors import SeamlessM4TFbankFeatures
+
+if __name__ == "__main__":
+    """
+    Compare `SeamlessM4TFbankFeatures` (torch, batched, on the inference device) with the HF
+    `SeamlessM4TFeatureExtractor` it replaces in `IndexTTS2`, for single clips and for a padded batch.
+    ```
+    python tests/w2v_frontend_test.py tests/sample_prompt.wav
+    ```
+    """
+    sys.path.append("..")
+    audio_prompt = sys.argv[1] if len(sys.argv) > 1 else "tests/sample_prompt.wav"
+    device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    hf_extractor = SeamlessM4TFeatureExtractor.from_pretrained("facebook/w2v-bert-2.0")
+    extractor = SeamlessM4TFbankFeatures().to(device)
+
+    audio, _ = librosa.load(audio_prompt, sr=16000)
+    audio = torch.tensor(audio)
+    # odd and even frame counts, a quiet clip
+    clips = [audio, audio[:16000 * 3 + 123], audio[8000:8000 + 16000 * 2 + 77] * 0.01]
+
+    failed = []
+    for i, clip in enumerate(clips):
+        start = time.perf_counter()
+        expected = hf_extractor(clip.unsqueeze(0), sampling_rate=16000, return_tensors="pt")
+        hf_time = time.perf_counter() - start
+        start = time.perf_counter()
+        input_features, attention_mask = extractor(clip.unsqueeze(0).to(device))
+        torch_time = time.perf_counter() - start
+        diff = (input_features.cpu() - expected["input_features"]).abs().max().item()
+        same_mask = torch.equal(attention_mask.cpu(), expected["attention_mask"])
+        print(f"clip {i}: {clip.shape[-1] / 16000:.2f}s, max abs diff {diff:.2e}, mask equal: {same_mask}, "
+              f"hf {hf_time * 1000:.1f}ms, torch {torch_time * 1000:.1f}ms")
+        if diff > 1e-4 or not same_mask:
+            failed.append(i)
+
+    expected = hf_extractor([clip.numpy() for clip in clips], sampling_rate=16000, return_tensors="pt")
+    input_features, attention_mask = extractor([clip.to(device) for clip in clips])
+    diff = (input_features.cpu() - expected["input_features"]).abs().max().item()
+    same_mask = torch.equal(attention_mask.cpu(), expected["attention_mask"])
+    print(f"batch of {len(clips)}: max abs diff {diff:.2e}, mask equal: {same_mask}")
+    if diff > 1e-4 or not same_mask:
+        failed.append("batch")
+
+    print("--" * 10)
+    if failed:
+        print("mismatch:", failed)
+    else:
+        print("all matched")
+    print("Test finished.")